@@ -6,8 +6,15 @@ via IMAP connections.
 """
 
 from cleanmail.mail_client import MailAnalyzer
+from cleanmail.connection_pool import IMAPConnectionPool
 from cleanmail.email_validator import EmailValidator, EmailValidationError
+from cleanmail.folders import Folder
+from cleanmail.header_cache import HeaderCache
+from cleanmail.instrumentation import Instrumentation, OperationSummary
+from cleanmail.pipeline import CommandPipeline
+from cleanmail.search_query import SearchQuery
+from cleanmail.uid_set import UidSet
 
 __version__ = "0.1.0"
-__all__ = ["MailAnalyzer", "EmailValidator", "EmailValidationError"]
+__all__ = ["MailAnalyzer", "CommandPipeline", "EmailValidator", "EmailValidationError", "Folder", "HeaderCache", "IMAPConnectionPool", "Instrumentation", "OperationSummary", "SearchQuery", "UidSet"]
 
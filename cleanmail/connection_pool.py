@@ -0,0 +1,267 @@
+"""
+Pool of authenticated IMAP connections.
+
+Every IMAP connection costs a TLS handshake and a LOGIN. The pool keeps
+authenticated connections around so they can be reused across MailAnalyzer
+calls, and limits the number of simultaneous connections per account so we
+stay under the provider limits (e.g. Gmail allows 15).
+"""
+
+import hashlib
+import imaplib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cleanmail.instrumentation import InstrumentedIMAP4, InstrumentedIMAP4_SSL
+
+
+DEFAULT_MAX_CONNECTIONS = int(os.getenv("CLEANMAIL_MAX_CONNECTIONS", "5"))
+
+
+class IMAPConnectionPool:
+    """A bounded pool of authenticated IMAP connections for a single account."""
+
+    def __init__(
+        self,
+        connect: Callable[[], imaplib.IMAP4],
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        idle_timeout: float = 300.0,
+        health_check_interval: float = 30.0,
+        acquire_timeout: float = 120.0,
+    ):
+        """
+        Args:
+            connect: Function that opens a new, logged in IMAP connection
+            max_connections: Maximum number of simultaneous connections (idle and in use)
+            idle_timeout: Idle connections older than this (seconds) are logged out
+                instead of reused, servers drop them sooner or later anyway
+            health_check_interval: Idle connections older than this (seconds) are checked
+                with a NOOP before reuse. A connection the server said BYE to is
+                replaced by a freshly logged in one.
+            acquire_timeout: Maximum time (seconds) to wait for a free connection
+        """
+        self._connect = connect
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle: List[Tuple[imaplib.IMAP4, float]] = []
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self) -> imaplib.IMAP4:
+        """
+        Take a connection from the pool, opening a new one if none is idle.
+        The connection is in authenticated state (no folder selected).
+
+        Raises:
+            Exception: If no connection became available within acquire_timeout
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        mail, last_used = None, None
+        expired = []
+        with self._condition:
+            while True:
+                expired += self._pop_expired()
+                if self._idle:
+                    # Most recently used first, it is the least likely to be timed out
+                    mail, last_used = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_connections:
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise Exception(
+                        f"Timed out waiting for a free IMAP connection (max {self.max_connections} connections)"
+                    )
+                self._condition.wait(remaining)
+
+        # Network I/O happens outside the lock
+        for expired_mail in expired:
+            self._logout(expired_mail)
+        try:
+            if mail is not None and time.monotonic() - last_used > self.health_check_interval:
+                if not self._is_alive(mail):
+                    self._logout(mail)
+                    mail = None
+            if mail is None:
+                mail = self._connect()
+        except BaseException:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+        return mail
+
+    def release(self, mail: imaplib.IMAP4, discard: bool = False) -> None:
+        """
+        Return a connection to the pool.
+
+        Args:
+            mail: A connection obtained from acquire()
+            discard: If True, log the connection out instead of keeping it,
+                e.g. because it failed with a socket error.
+        """
+        with self._condition:
+            discard = discard or self._closed
+        if not discard:
+            try:
+                self._reset(mail)
+            except Exception:
+                discard = True
+        if discard:
+            self._logout(mail)
+        with self._condition:
+            self._in_use -= 1
+            # The pool may have been closed while the connection was reset
+            closed = self._closed
+            if not discard and not closed:
+                self._idle.append((mail, time.monotonic()))
+            self._condition.notify()
+        if closed and not discard:
+            self._logout(mail)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that acquires a connection and releases it afterwards.
+        Connections that failed with a socket error or a BYE are discarded.
+        """
+        mail = self.acquire()
+        try:
+            yield mail
+        except (imaplib.IMAP4.abort, OSError):
+            self.release(mail, discard=True)
+            raise
+        except BaseException:
+            self.release(mail)
+            raise
+        else:
+            self.release(mail)
+
+    def close(self) -> None:
+        """Log out all idle connections. Connections in use are logged out when released."""
+        with self._condition:
+            self._closed = True
+            idle = [mail for mail, _ in self._idle]
+            self._idle = []
+        for mail in idle:
+            self._logout(mail)
+
+    def _pop_expired(self) -> List[imaplib.IMAP4]:
+        """Remove connections idle for longer than idle_timeout. Must be called with the lock held."""
+        now = time.monotonic()
+        expired = [mail for mail, last_used in self._idle if now - last_used > self.idle_timeout]
+        if expired:
+            self._idle = [(mail, last_used) for mail, last_used in self._idle if now - last_used <= self.idle_timeout]
+        return expired
+
+    @staticmethod
+    def _reset(mail: imaplib.IMAP4) -> None:
+        """Bring a connection back to authenticated state, without expunging anything."""
+        if mail.state == "LOGOUT":
+            raise Exception("Connection is logged out")
+        if mail.state != "SELECTED":
+            return
+        if "UNSELECT" in mail.capabilities:
+            mail.unselect()
+        else:
+            # CLOSE expunges deleted messages unless the folder was opened read-only
+            if not mail.is_readonly:
+                mail.select("INBOX", readonly=True)
+            mail.close()
+
+    @staticmethod
+    def _is_alive(mail: imaplib.IMAP4) -> bool:
+        try:
+            status, _ = mail.noop()
+            return status == "OK"
+        except (imaplib.IMAP4.error, OSError):
+            # IMAP4.abort (e.g. after a BYE) is a subclass of IMAP4.error
+            return False
+
+    @staticmethod
+    def _logout(mail: imaplib.IMAP4) -> None:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+
+
+def open_connection(mail_server: str, mail_port: Optional[int], use_ssl: bool, email_address: str, mail_password: str) -> imaplib.IMAP4:
+    """
+    Open a new, logged in IMAP connection. The connection records its commands in the
+    operation running on the calling thread (see cleanmail.instrumentation).
+
+    Args:
+        mail_server: Hostname of the IMAP server
+        mail_port: Port of the IMAP server. Defaults to 993, or 143 without SSL.
+        use_ssl: Whether to connect with implicit TLS (IMAPS)
+        email_address: The account to log in with
+        mail_password: The (app) password of the account
+    """
+    if use_ssl:
+        mail = InstrumentedIMAP4_SSL(mail_server, mail_port or imaplib.IMAP4_SSL_PORT)
+    else:
+        mail = InstrumentedIMAP4(mail_server, mail_port or imaplib.IMAP4_PORT)
+    mail.login(email_address, mail_password)
+    return mail
+
+
+_pools: Dict[Tuple[str, Optional[int], bool, str, str], IMAPConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(
+    mail_server: str, email_address: str, mail_password: str, mail_port: Optional[int] = None, use_ssl: bool = True,
+) -> IMAPConnectionPool:
+    """
+    Return the process wide connection pool of an account, creating it if needed.
+    All MailAnalyzer instances of the same account and password share the pool, so the connection
+    limit holds across Streamlit sessions and reruns. The pool opens its connections
+    with open_connection(), it holds no reference to the MailAnalyzer that created it.
+
+    Args:
+        mail_server: Hostname of the IMAP server
+        email_address: The account
+        mail_password: The password. Each password has its own pool, so a wrong password
+            cannot disturb the pool of a session that logged in successfully. A closed
+            pool is replaced.
+        mail_port: Port of the IMAP server, None for the default port
+        use_ssl: Whether to connect with implicit TLS (IMAPS), each setting has its own pool
+    """
+    credentials = hashlib.sha256(mail_password.encode()).hexdigest()
+    key = (mail_server, mail_port, use_ssl, email_address.lower(), credentials)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool._closed:
+            pool = IMAPConnectionPool(partial(open_connection, mail_server, mail_port, use_ssl, email_address, mail_password))
+            _pools[key] = pool
+        return pool
+
+
+def pool_statistics() -> Dict[str, int]:
+    """
+    Totals over the process wide pools, e.g. for metrics.
+
+    Returns:
+        Dictionary with the number of 'pools' (accounts), and of the connections 'in_use' and 'idle'
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    statistics = {"pools": 0, "in_use": 0, "idle": 0}
+    for pool in pools:
+        if pool._closed:
+            continue
+        with pool._condition:
+            statistics["pools"] += 1
+            statistics["in_use"] += pool._in_use
+            statistics["idle"] += len(pool._idle)
+    return statistics
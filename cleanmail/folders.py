@@ -0,0 +1,231 @@
+"""
+Parser of IMAP LIST responses.
+
+A LIST response looks like `(\\HasNoChildren \\Trash) "/" "Deleted Items"`, but the
+hierarchy delimiter differs per server ("." on Courier and Cyrus, NIL for a flat
+namespace), the name can be an atom, a quoted string with escapes or a literal, and
+non-ASCII names are encoded in modified UTF-7 (RFC 3501, section 5.1.3), e.g.
+"Envoy&AOk-s" for "Envoyés". parse_list_response() turns the LIST data returned by
+imaplib into Folder objects:
+
+    typ, data = mail.list()
+    for folder in parse_list_response(data):
+        print(folder.name, folder.raw_name, folder.attributes)
+
+The raw name is what the server knows the folder by; quote_mailbox() (or
+Folder.imap_name) formats it as a command argument.
+"""
+
+import base64
+import binascii
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# Characters that cannot appear in an atom, so a mailbox name containing them has to be quoted
+_QUOTED_CHARS = set('(){ %*"\\')
+
+_LIST_ATTRIBUTES = re.compile(rb"\s*\(([^()]*)\)\s+")
+_LITERAL = re.compile(rb"\{(\d+)\+?\}")
+_STATUS_ITEMS = re.compile(rb"\(([^()]*)\)\s*$")
+_MODIFIED_BASE64 = re.compile(r"&([A-Za-z0-9+,]*)-")
+
+
+def decode_modified_utf7(name: str) -> str:
+    """Decode a mailbox name from modified UTF-7, e.g. "Envoy&AOk-s" to "Envoyés". Invalid names are returned as is."""
+
+    def decode(match: re.Match) -> str:
+        encoded = match.group(1)
+        if not encoded:
+            return "&"
+        encoded = encoded.replace(",", "/")
+        return base64.b64decode(encoded + "=" * (-len(encoded) % 4)).decode("utf-16-be")
+
+    try:
+        return _MODIFIED_BASE64.sub(decode, name)
+    except (binascii.Error, UnicodeDecodeError):
+        return name
+
+
+def encode_modified_utf7(name: str) -> str:
+    """Encode a mailbox name in modified UTF-7, e.g. "Envoyés" to "Envoy&AOk-s"."""
+    result: List[str] = []
+    pending: List[str] = []
+
+    def flush() -> None:
+        if pending:
+            encoded = base64.b64encode("".join(pending).encode("utf-16-be")).decode().rstrip("=")
+            result.append("&" + encoded.replace("/", ",") + "-")
+            pending.clear()
+
+    for char in name:
+        if 0x20 <= ord(char) <= 0x7E:
+            flush()
+            result.append("&-" if char == "&" else char)
+        else:
+            pending.append(char)
+    flush()
+    return "".join(result)
+
+
+def quote_mailbox(name: str) -> str:
+    """Format a raw mailbox name as a command argument: as is if it is a valid atom, quoted otherwise."""
+    if name and not any(char in _QUOTED_CHARS or ord(char) < 0x20 or ord(char) == 0x7F for char in name):
+        return name
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+@dataclass(frozen=True)
+class Folder:
+    """A mailbox from a LIST response."""
+
+    # The name as the server knows it (modified UTF-7), e.g. "INBOX.Envoy&AOk-s"
+    raw_name: str
+    # Hierarchy delimiter, None for a flat namespace
+    delimiter: Optional[str] = None
+    # Mailbox attributes as sent by the server, e.g. ("\\HasNoChildren", "\\Trash")
+    attributes: Tuple[str, ...] = ()
+    # The decoded name for display, e.g. "INBOX.Envoyés"
+    name: str = field(init=False)
+    # Raw name of the parent folder, None for top level folders
+    parent: Optional[str] = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "name", decode_modified_utf7(self.raw_name))
+        parent = None
+        if self.delimiter and self.delimiter in self.raw_name:
+            parent = self.raw_name.rsplit(self.delimiter, 1)[0] or None
+        object.__setattr__(self, "parent", parent)
+
+    @property
+    def imap_name(self) -> str:
+        """The raw name formatted as a command argument (quoted if needed)."""
+        return quote_mailbox(self.raw_name)
+
+    @property
+    def short_name(self) -> str:
+        """The decoded name without the parent folders."""
+        if self.delimiter:
+            return self.name.rsplit(self.delimiter, 1)[-1]
+        return self.name
+
+    @property
+    def selectable(self) -> bool:
+        """Whether the folder can be selected, i.e. holds messages."""
+        return not (self.has_attribute("\\Noselect") or self.has_attribute("\\NonExistent"))
+
+    def has_attribute(self, attribute: str) -> bool:
+        """Whether the folder has an attribute, e.g. "\\Trash". Attributes are case-insensitive."""
+        attribute = attribute.lower()
+        return any(value.lower() == attribute for value in self.attributes)
+
+
+def parse_list_response(data: Iterable[Any]) -> List[Folder]:
+    """
+    Parse the untagged LIST (or LSUB) responses returned by imaplib, e.g. mail.list()[1].
+    Lines that are not valid LIST responses are skipped.
+    """
+    folders = []
+    for line, literals in _join_literals(data):
+        match = _LIST_ATTRIBUTES.match(line)
+        if not match:
+            continue
+        try:
+            delimiter, position = _read_string(line, match.end(), literals, nstring=True)
+            if line[position:position + 1] != b" ":
+                continue
+            raw_name, _ = _read_string(line, position + 1, literals)
+        except ValueError:
+            continue
+        attributes = tuple(match.group(1).decode(errors="replace").split())
+        folders.append(Folder(raw_name, delimiter, attributes))
+    return folders
+
+
+def parse_status_responses(data: Iterable[Any]) -> Dict[str, Dict[str, int]]:
+    """
+    Parse untagged STATUS responses returned by imaplib, e.g. mail.response("STATUS")[1].
+
+    Returns:
+        Dictionary mapping raw folder names to their status items, e.g. {"INBOX": {"MESSAGES": 3}}
+    """
+    statuses = {}
+    for line, literals in _join_literals(data):
+        try:
+            raw_name, position = _read_string(line, 0, literals)
+        except ValueError:
+            continue
+        match = _STATUS_ITEMS.search(line, position)
+        if not match:
+            continue
+        tokens = match.group(1).decode().split()
+        statuses[raw_name] = {item.upper(): int(value) for item, value in zip(tokens[0::2], tokens[1::2])}
+    return statuses
+
+
+def _join_literals(data: Iterable[Any]) -> Iterator[Tuple[bytes, List[bytes]]]:
+    """
+    Reassemble the response lines of imaplib data, which splits a line at each literal:
+    a (text before the literal, literal) tuple per literal, then the rest of the line.
+
+    Yields:
+        Tuples of (line with the {n} literal markers, the literals in order)
+    """
+    line, literals = b"", []
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            line += item[0]
+            literals.append(item[1])
+            continue
+        line += item
+        if line.strip():
+            yield line, literals
+        line, literals = b"", []
+    if line.strip():
+        yield line, literals
+
+
+def _read_string(line: bytes, position: int, literals: List[bytes], nstring: bool = False) -> Tuple[Optional[str], int]:
+    """
+    Read a string (quoted string, literal or atom) at a position of a response line.
+
+    Args:
+        nstring: Whether the string can be NIL, read as None
+
+    Returns:
+        Tuple of (the string, and the position after it)
+
+    Raises:
+        ValueError: If there is no valid string at the position
+    """
+    if line[position:position + 1] == b'"':
+        value = bytearray()
+        position += 1
+        while position < len(line):
+            char = line[position:position + 1]
+            if char == b"\\":
+                value += line[position + 1:position + 2]
+                position += 2
+            elif char == b'"':
+                return value.decode(errors="replace"), position + 1
+            else:
+                value += char
+                position += 1
+        raise ValueError("Unterminated quoted string")
+
+    match = _LITERAL.match(line, position)
+    if match:
+        if not literals:
+            raise ValueError("Missing literal")
+        return literals.pop(0).decode(errors="replace"), match.end()
+
+    end = position
+    while end < len(line) and line[end:end + 1] not in (b" ", b"(", b")", b"\r", b"\n"):
+        end += 1
+    if end == position:
+        raise ValueError("Expected a string")
+    atom = line[position:end].decode(errors="replace")
+    return (None if nstring and atom.upper() == "NIL" else atom), end
@@ -0,0 +1,229 @@
+"""
+Persistent on-disk cache of per-message facts used by the sender statistics.
+
+get_sender_statistics() only needs a handful of facts from every message (sender,
+unsubscribe link, size and date). This module stores those facts in a local SQLite
+database keyed by server, account, folder, UIDVALIDITY and UID, so that a
+re-analysis only has to fetch the messages that arrived since the previous run.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Optional, List, Iterable
+
+from cleanmail.uid_set import UidSet
+
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "cleanmail", "headers.sqlite3"
+)
+
+
+class HeaderCache:
+    """SQLite backed cache of parsed message headers, shared by all accounts."""
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Open (and create if needed) the cache database.
+
+        Args:
+            path: Location of the SQLite file. Defaults to the CLEANMAIL_CACHE_PATH
+                environment variable, or ~/.cache/cleanmail/headers.sqlite3.
+                Use ":memory:" for a non-persistent cache.
+        """
+        self.path = path or os.getenv("CLEANMAIL_CACHE_PATH") or DEFAULT_CACHE_PATH
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Streamlit serves sessions from multiple threads, access is serialised by the lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._create_schema()
+
+    def _create_schema(self) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS folders (
+                    server TEXT NOT NULL,
+                    account TEXT NOT NULL,
+                    folder TEXT NOT NULL,
+                    uidvalidity INTEGER,
+                    highestmodseq INTEGER,
+                    PRIMARY KEY (server, account, folder)
+                )
+                """
+            )
+            # Caches created before HIGHESTMODSEQ tracking lack the column
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(folders)")]
+            if "highestmodseq" not in columns:
+                self._db.execute("ALTER TABLE folders ADD COLUMN highestmodseq INTEGER")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    server TEXT NOT NULL,
+                    account TEXT NOT NULL,
+                    folder TEXT NOT NULL,
+                    uidvalidity INTEGER NOT NULL,
+                    uid INTEGER NOT NULL,
+                    sender_addr TEXT,
+                    sender_name TEXT,
+                    unsubscribe_link TEXT,
+                    size INTEGER,
+                    date TEXT,
+                    headers TEXT,
+                    body_scanned INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (server, account, folder, uidvalidity, uid)
+                )
+                """
+            )
+
+    def folder(self, server: str, account: str, folder: str) -> "CachedFolder":
+        """Return a view on the cached messages of one folder of one account."""
+        return CachedFolder(self, server, account.lower(), folder)
+
+    def clear(self) -> None:
+        """Remove all cached data."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM messages")
+            self._db.execute("DELETE FROM folders")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class CachedFolder:
+    """The cached messages of a single folder, bound to its current UIDVALIDITY."""
+
+    def __init__(self, cache: HeaderCache, server: str, account: str, folder: str):
+        self._cache = cache
+        self._key = (server, account, folder)
+        self.uidvalidity, self.highestmodseq = self._load_state()
+
+    def _load_state(self):
+        with self._cache._lock:
+            row = self._cache._db.execute(
+                "SELECT uidvalidity, highestmodseq FROM folders WHERE server = ? AND account = ? AND folder = ?",
+                self._key,
+            ).fetchone()
+        return row if row else (None, None)
+
+    def validate(self, uidvalidity: Optional[int]) -> None:
+        """
+        Make sure the cache matches the folder's current UIDVALIDITY.
+        If it changed, the cached UIDs no longer refer to the same messages and
+        all cached entries of this folder are dropped.
+        """
+        if uidvalidity is not None and uidvalidity == self.uidvalidity:
+            return
+        with self._cache._lock, self._cache._db:
+            self._cache._db.execute(
+                "DELETE FROM messages WHERE server = ? AND account = ? AND folder = ?",
+                self._key,
+            )
+            self._cache._db.execute(
+                "INSERT OR REPLACE INTO folders (server, account, folder, uidvalidity, highestmodseq) VALUES (?, ?, ?, ?, NULL)",
+                (*self._key, uidvalidity),
+            )
+        self.uidvalidity = uidvalidity
+        self.highestmodseq = None
+
+    def set_highestmodseq(self, highestmodseq: Optional[int]) -> None:
+        """
+        Remember the folder's HIGHESTMODSEQ (RFC 7162) the cached entries are in sync with,
+        so the next analysis can ask the server for the changes since then.
+        """
+        with self._cache._lock, self._cache._db:
+            self._cache._db.execute(
+                "UPDATE folders SET highestmodseq = ? WHERE server = ? AND account = ? AND folder = ?",
+                (highestmodseq, *self._key),
+            )
+        self.highestmodseq = highestmodseq
+
+    def uids(self, body_scanned: bool = False) -> UidSet:
+        """
+        Return the cached UIDs.
+
+        Args:
+            body_scanned: If True, only return UIDs whose full message was analyzed
+                (and not only the headers), so their unsubscribe link is complete.
+        """
+        query = "SELECT uid FROM messages WHERE server = ? AND account = ? AND folder = ? AND uidvalidity = ?"
+        if body_scanned:
+            query += " AND body_scanned = 1"
+        with self._cache._lock:
+            rows = self._cache._db.execute(query, (*self._key, self.uidvalidity)).fetchall()
+        return UidSet(row[0] for row in rows)
+
+    def remove(self, uids: Iterable[int]) -> None:
+        """Drop cache entries, e.g. for messages that no longer exist on the server."""
+        with self._cache._lock, self._cache._db:
+            self._cache._db.executemany(
+                "DELETE FROM messages WHERE server = ? AND account = ? AND folder = ? AND uidvalidity = ? AND uid = ?",
+                [(*self._key, self.uidvalidity, uid) for uid in uids],
+            )
+
+    def add(self, records: List[dict], body_scanned: bool = False) -> None:
+        """
+        Store the parsed facts of freshly fetched messages.
+
+        Args:
+            records: Dictionaries as built by MailAnalyzer._parse_message(), with the keys
+                'uid', 'sender_addr', 'sender_name', 'unsubscribe_link', 'size', 'date'
+                and 'headers'.
+            body_scanned: Whether the full message was analyzed (see uids()).
+        """
+        with self._cache._lock, self._cache._db:
+            self._cache._db.executemany(
+                """
+                INSERT OR REPLACE INTO messages (
+                    server, account, folder, uidvalidity, uid, sender_addr, sender_name,
+                    unsubscribe_link, size, date, headers, body_scanned
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (
+                        *self._key,
+                        self.uidvalidity,
+                        record["uid"],
+                        record["sender_addr"],
+                        record["sender_name"],
+                        record["unsubscribe_link"],
+                        record["size"],
+                        record["date"],
+                        json.dumps(record["headers"]),
+                        int(body_scanned),
+                    )
+                    for record in records
+                ],
+            )
+
+    def records(self):
+        """
+        Iterate over all cached records of this folder in UID order.
+
+        Yields:
+            Dictionaries with the same keys as accepted by add().
+        """
+        with self._cache._lock:
+            rows = self._cache._db.execute(
+                """
+                SELECT uid, sender_addr, sender_name, unsubscribe_link, size, date, headers
+                FROM messages
+                WHERE server = ? AND account = ? AND folder = ? AND uidvalidity = ?
+                ORDER BY uid
+                """,
+                (*self._key, self.uidvalidity),
+            ).fetchall()
+        for uid, sender_addr, sender_name, unsubscribe_link, size, date, headers in rows:
+            yield {
+                "uid": uid,
+                "sender_addr": sender_addr,
+                "sender_name": sender_name,
+                "unsubscribe_link": unsubscribe_link,
+                "size": size,
+                "date": date,
+                "headers": json.loads(headers) if headers else {},
+            }
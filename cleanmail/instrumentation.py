@@ -0,0 +1,376 @@
+"""
+Per-command instrumentation of IMAP connections.
+
+MailAnalyzer.connect() returns InstrumentedIMAP4(_SSL) connections, which record
+every command they send: the verb, the wall time until the tagged response, the
+time until the first response byte, and the bytes sent and received. Commands are
+attributed to the public MailAnalyzer operation running on the same thread, so
+every call to e.g. prone_emails_older_than() yields one OperationSummary:
+
+    summary = analyzer.instrumentation.last_operation
+    print(summary)  # prone_emails_older_than: 2.31s, 46 round trips (IMAP 2.05s, client 0.26s), ...
+    summary.by_verb()["UID COPY"].seconds
+
+The time spent outside of IMAP commands (client_seconds) is our own parsing and
+processing. Of the IMAP time, the time to the first response byte of each command
+is mostly network latency and server processing, the rest is transfer time.
+
+Besides the commands, operations count the messages they process with add_count(), e.g.
+add_count("messages_moved", 50), and the connections count the messages the server
+reports as expunged ("messages_expunged").
+
+Hooks passed to Instrumentation are called for every finished command and operation,
+e.g. to export metrics. Hooks added with add_global_hooks() are called for the
+operations of every Instrumentation in the process. Commands sent outside of an
+operation are not recorded.
+"""
+
+import functools
+import imaplib
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional
+
+from cleanmail.uid_set import UidSet
+
+# Untagged responses that report expunged messages. VANISHED (EARLIER) only reports
+# messages expunged before a resync (RFC 7162), not by the running command.
+_EXPUNGE_RESPONSE = re.compile(rb"\* (?:\d+ EXPUNGE|VANISHED ([\d:,]+))\r?\n?$")
+
+
+@dataclass
+class CommandRecord:
+    """A single IMAP command and its response."""
+
+    # The command, e.g. "SELECT" or "UID FETCH". Opening a connection (TCP and TLS
+    # handshake and the server greeting) is recorded as "CONNECT".
+    verb: str
+    started: float
+    seconds: float = 0.0
+    # Time until the first byte of the response arrived
+    first_byte_seconds: Optional[float] = None
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    # Bytes of the untagged responses, i.e. the data the command returned
+    response_size: int = 0
+    # OK, NO or BAD, or the exception type if the command failed
+    result: Optional[str] = None
+    # Sent while an earlier command was still awaiting its response (see cleanmail.pipeline),
+    # so it shares the round trip of that command
+    pipelined: bool = False
+
+
+@dataclass
+class VerbStats:
+    """Totals of the commands with the same verb."""
+
+    count: int = 0
+    seconds: float = 0.0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+
+    def add(self, record: CommandRecord) -> None:
+        self.count += 1
+        self.seconds += record.seconds
+        self.bytes_sent += record.bytes_sent
+        self.bytes_received += record.bytes_received
+
+
+@dataclass
+class OperationSummary:
+    """The IMAP commands of one call to a public MailAnalyzer operation."""
+
+    name: str
+    started: float
+    seconds: float = 0.0
+    commands: List[CommandRecord] = field(default_factory=list)
+    # The exception type if the operation failed
+    error: Optional[str] = None
+    # Message counts, e.g. {"messages_moved": 50} (see add_count())
+    counts: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def round_trips(self) -> int:
+        """Commands that waited for a round trip of their own, pipelined commands share one."""
+        return sum(not record.pipelined for record in self.commands)
+
+    @property
+    def bytes_sent(self) -> int:
+        return sum(record.bytes_sent for record in self.commands)
+
+    @property
+    def bytes_received(self) -> int:
+        return sum(record.bytes_received for record in self.commands)
+
+    @property
+    def imap_seconds(self) -> float:
+        """Time spent waiting for IMAP commands."""
+        return sum(record.seconds for record in self.commands)
+
+    @property
+    def client_seconds(self) -> float:
+        """Time spent outside of IMAP commands: parsing and processing on our side."""
+        return max(0.0, self.seconds - self.imap_seconds)
+
+    def by_verb(self) -> Dict[str, VerbStats]:
+        """Totals per command verb."""
+        stats: Dict[str, VerbStats] = {}
+        for record in self.commands:
+            stats.setdefault(record.verb, VerbStats()).add(record)
+        return stats
+
+    def __str__(self) -> str:
+        verbs = ", ".join(f"{verb} x{stats.count}" for verb, stats in self.by_verb().items())
+        return (
+            f"{self.name}: {self.seconds:.2f}s, {self.round_trips} round trips "
+            f"(IMAP {self.imap_seconds:.2f}s, client {self.client_seconds:.2f}s), "
+            f"{self.bytes_sent} bytes sent, {self.bytes_received} bytes received"
+            + (f" [{verbs}]" if verbs else "")
+        )
+
+
+@dataclass
+class OperationStats:
+    """Totals of all calls of one operation."""
+
+    calls: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    imap_seconds: float = 0.0
+    round_trips: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+
+    def add(self, summary: OperationSummary) -> None:
+        self.calls += 1
+        self.errors += summary.error is not None
+        self.seconds += summary.seconds
+        self.imap_seconds += summary.imap_seconds
+        self.round_trips += summary.round_trips
+        self.bytes_sent += summary.bytes_sent
+        self.bytes_received += summary.bytes_received
+
+
+# The operation running on the current thread and its Instrumentation, as a tuple
+_current = threading.local()
+
+
+def _current_operation() -> Optional[tuple]:
+    return getattr(_current, "operation", None)
+
+
+def add_count(name: str, value: int = 1) -> None:
+    """Add to a message count of the operation running on this thread, e.g. add_count("messages_moved", 50)."""
+    current = _current_operation()
+    if current is not None and value:
+        counts = current[1].counts
+        counts[name] = counts.get(name, 0) + value
+
+
+# Hooks for the commands and operations of every Instrumentation
+_global_command_hooks: List[Callable] = []
+_global_operation_hooks: List[Callable] = []
+
+
+def add_global_hooks(
+    on_command: Optional[Callable[[str, "CommandRecord"], None]] = None,
+    on_operation: Optional[Callable[["OperationSummary"], None]] = None,
+) -> None:
+    """
+    Register hooks that are called for every Instrumentation in the process, e.g. for process wide metrics.
+    on_command is also called for connections and logins outside of an operation (e.g. testing the
+    credentials of a pool), with an empty operation name.
+    """
+    if on_command is not None:
+        _global_command_hooks.append(on_command)
+    if on_operation is not None:
+        _global_operation_hooks.append(on_operation)
+
+
+class Instrumentation:
+    """Collects the OperationSummary of every operation, and calls the hooks."""
+
+    def __init__(
+        self,
+        on_command: Optional[Callable[[str, CommandRecord], None]] = None,
+        on_operation: Optional[Callable[[OperationSummary], None]] = None,
+        history: int = 100,
+    ):
+        """
+        Args:
+            on_command: Called with the operation name and the record of every finished command
+            on_operation: Called with the summary of every finished operation
+            history: Number of recent operation summaries to keep
+        """
+        self.command_hooks: List[Callable[[str, CommandRecord], None]] = [on_command] if on_command else []
+        self.operation_hooks: List[Callable[[OperationSummary], None]] = [on_operation] if on_operation else []
+        self._history: deque = deque(maxlen=history)
+        self._stats: Dict[str, OperationStats] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def operation(self, name: str) -> Iterator[OperationSummary]:
+        """
+        Attribute the IMAP commands sent by this thread to an operation until the block ends.
+        Nested operations (one public method calling another) count as part of the outer one.
+        """
+        outer = _current_operation()
+        if outer is not None:
+            yield outer[1]
+            return
+        summary = OperationSummary(name, time.perf_counter())
+        _current.operation = (self, summary)
+        try:
+            yield summary
+        except BaseException as e:
+            summary.error = type(e).__name__
+            raise
+        finally:
+            _current.operation = None
+            summary.seconds = time.perf_counter() - summary.started
+            with self._lock:
+                self._history.append(summary)
+                self._stats.setdefault(name, OperationStats()).add(summary)
+            for hook in self.operation_hooks + _global_operation_hooks:
+                self._call_hook(hook, summary)
+
+    def command_finished(self, operation: OperationSummary, record: CommandRecord) -> None:
+        operation.commands.append(record)
+        for hook in self.command_hooks + _global_command_hooks:
+            self._call_hook(hook, operation.name, record)
+
+    @staticmethod
+    def _call_hook(hook, *args) -> None:
+        # A failing hook must not break the operation it observes
+        try:
+            hook(*args)
+        except Exception as e:
+            print(f"Instrumentation hook {hook!r} failed: {e}")
+
+    @property
+    def last_operation(self) -> Optional[OperationSummary]:
+        """The summary of the most recently finished operation."""
+        with self._lock:
+            return self._history[-1] if self._history else None
+
+    def operations(self) -> List[OperationSummary]:
+        """The summaries of the recently finished operations, oldest first."""
+        with self._lock:
+            return list(self._history)
+
+    def stats(self) -> Dict[str, OperationStats]:
+        """Totals per operation name, since the instrumentation was created."""
+        with self._lock:
+            return dict(self._stats)
+
+
+def instrumented(method):
+    """Decorator for MailAnalyzer methods: run the method as an operation of self.instrumentation."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.instrumentation.operation(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class _InstrumentedMixin:
+    """
+    Records the commands of an imaplib connection in the operation of the current thread.
+    Responses are attributed to the oldest unfinished command, servers answer pipelined
+    commands in order.
+    """
+
+    def open(self, *args, **kwargs):
+        self._pending_records: Dict[Optional[bytes], CommandRecord] = {}
+        self._record_operation = _current_operation()
+        # Completed when the first command is sent, so the greeting is included
+        self._pending_records[None] = CommandRecord("CONNECT", time.perf_counter())
+        super().open(*args, **kwargs)
+
+    def _command(self, name, *args):
+        self._finish_record(None, "OK")
+        operation = _current_operation()
+        if operation is None and name != "LOGIN":
+            return super()._command(name, *args)
+        self._record_operation = operation
+        verb = name
+        if name == "UID" and args:
+            verb = f"UID {str(args[0]).upper()}"
+        record = CommandRecord(verb, time.perf_counter(), pipelined=any(tag is not None for tag in self._pending_records))
+        # Bytes sent by super()._command() are counted for the key None until the tag is known
+        self._pending_records[None] = record
+        try:
+            tag = super()._command(name, *args)
+        except BaseException as e:
+            self._finish_record(None, type(e).__name__)
+            raise
+        self._pending_records[tag] = self._pending_records.pop(None)
+        return tag
+
+    def _command_complete(self, name, tag):
+        try:
+            typ, data = super()._command_complete(name, tag)
+        except BaseException as e:
+            self._finish_record(tag, type(e).__name__)
+            raise
+        self._finish_record(tag, typ)
+        return typ, data
+
+    def _finish_record(self, tag: Optional[bytes], result: str) -> None:
+        record = self._pending_records.pop(tag, None)
+        if record is None:
+            return
+        record.seconds = time.perf_counter() - record.started
+        record.result = result
+        if self._record_operation is None:
+            # Outside of an operation only CONNECT and LOGIN are recorded, for the global hooks
+            for hook in _global_command_hooks:
+                Instrumentation._call_hook(hook, "", record)
+            return
+        instrumentation, operation = self._record_operation
+        instrumentation.command_finished(operation, record)
+
+    def send(self, data):
+        if self._pending_records:
+            self._pending_records[next(reversed(self._pending_records))].bytes_sent += len(data)
+        return super().send(data)
+
+    def readline(self):
+        line = super().readline()
+        self._received(line, is_line=True)
+        return line
+
+    def read(self, size):
+        data = super().read(size)
+        self._received(data, is_line=False)
+        return data
+
+    def _received(self, data: bytes, is_line: bool) -> None:
+        if not self._pending_records:
+            return
+        tag, record = next(iter(self._pending_records.items()))
+        if record.first_byte_seconds is None:
+            record.first_byte_seconds = time.perf_counter() - record.started
+        record.bytes_received += len(data)
+        if not (is_line and tag is not None and data.startswith(tag + b" ")):
+            record.response_size += len(data)
+        if is_line and data.startswith(b"* ") and (data.endswith(b"EXPUNGE\r\n") or data.startswith(b"* VANISHED ")):
+            match = _EXPUNGE_RESPONSE.match(data)
+            if match and self._record_operation is not None:
+                expunged = len(UidSet.parse(match.group(1))) if match.group(1) else 1
+                counts = self._record_operation[1].counts
+                counts["messages_expunged"] = counts.get("messages_expunged", 0) + expunged
+
+
+class InstrumentedIMAP4(_InstrumentedMixin, imaplib.IMAP4):
+    """imaplib.IMAP4 that records its commands in the current operation (see Instrumentation)."""
+
+
+class InstrumentedIMAP4_SSL(_InstrumentedMixin, imaplib.IMAP4_SSL):
+    """imaplib.IMAP4_SSL that records its commands in the current operation (see Instrumentation)."""
@@ -2,131 +2,198 @@ import email
 import imaplib
 import re
 from datetime import datetime, timedelta
-from email.utils import parseaddr
+from functools import partial
+from email.message import Message
+from email.utils import parseaddr, parsedate_to_datetime
 from bs4 import BeautifulSoup
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Union, Iterable, Dict
 
 import pandas as pd
 
+from cleanmail.connection_pool import IMAPConnectionPool, get_connection_pool, open_connection
 from cleanmail.email_validator import EmailValidator, EmailValidationError
+from cleanmail.folders import Folder, parse_list_response, parse_status_responses, quote_mailbox
+from cleanmail.header_cache import HeaderCache, CachedFolder
+from cleanmail.instrumentation import Instrumentation, add_count, instrumented
+from cleanmail.pipeline import CommandPipeline, PipelinedCommand
+from cleanmail.search_query import SearchQuery
+from cleanmail.uid_set import UidSet
 
 
 class MailAnalyzer:
-    def __init__(self, email_address, mail_password, mail_server):
+    # Headers needed to build the sender statistics without downloading message bodies.
+    # BODY.PEEK does not set the \Seen flag.
+    HEADER_FIELDS = ["FROM", "DATE", "LIST-UNSUBSCRIBE", "LIST-UNSUBSCRIBE-POST", "LIST-ID"]
+    HEADER_FETCH_ITEMS = f"(RFC822.SIZE BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+    # Number of senders combined into a single OR search by delete_emails_from_senders()
+    SENDERS_PER_SEARCH = 20
+    # Special-use mailbox attributes (RFC 6154) reported by LIST
+    SPECIAL_USE_ATTRIBUTES = ["\\All", "\\Archive", "\\Drafts", "\\Flagged", "\\Junk", "\\Sent", "\\Trash"]
+    # Fallback names for servers that do not report special-use attributes
+    BIN_FOLDER_NAMES = ["Trash", "[Gmail]/Bin", "[Gmail]/Trash", "[Yahoo]/Bin", "[Yahoo]/Trash", "Deleted Items"]
+    ARCHIVE_FOLDER_NAMES = ["Archive", "Archief"]
+
+    def __init__(self, email_address, mail_password, mail_server, header_cache: Optional[HeaderCache] = None, connection_pool: Optional[IMAPConnectionPool] = None, mail_port: Optional[int] = None, use_ssl: bool = True, instrumentation: Optional[Instrumentation] = None):
+        """
+        Args:
+            email_address: The account to log in with
+            mail_password: The (app) password of the account
+            mail_server: Hostname of the IMAP server
+            mail_port: Port of the IMAP server. Defaults to 993, or 143 without SSL.
+            use_ssl: Whether to connect with implicit TLS (IMAPS). Only disable this for
+                local test servers, the password is sent in the clear otherwise.
+            header_cache: Optional persistent cache, so get_sender_statistics() only
+                has to fetch messages that are new since the previous analysis.
+            connection_pool: Optional pool to take IMAP connections from. Defaults to
+                the pool shared by all MailAnalyzer instances of the same account.
+            instrumentation: Optional Instrumentation to record the IMAP commands of every
+                operation in, e.g. with hooks to export metrics. Defaults to a new one.
+        """
         self.email_address = email_address
         self.mail_password = mail_password
         self.mail_server = mail_server
-        # Fetch and cache folder list once during initialization
-        self._folders = self.__fetch_folders()
-        self.bin_folder = self.__determine_bin_folder()
-        self.archive_folder = self.__determine_archive_folder()
+        self.mail_port = mail_port
+        self.use_ssl = use_ssl
+        self.header_cache = header_cache
+        self.instrumentation = instrumentation or Instrumentation()
+        if connection_pool is None:
+            connection_pool = get_connection_pool(mail_server, email_address, mail_password, mail_port, use_ssl)
+        self.connection_pool = connection_pool
+        # The folder list and the special folders are looked up on first use, and cached
+        self._folders: Optional[List[Folder]] = None
+        self._special_folders: Optional[Dict[str, Folder]] = None
+        self._bin_folder: Optional[Folder] = None
+        self._archive_folder: Optional[Folder] = None
+        self._archive_folder_resolved = False
 
     @staticmethod
-    def _print_folder_list(folders: List[bytes]) -> None:
+    def _print_folder_list(folders: List[Folder]) -> None:
         """Print a readable list of folder names from IMAP folder list."""
-        folder_names = []
-        for folder in folders:
-            decoded_folder = folder.decode()
-            folder_name = decoded_folder.split(' "/" ')[-1].strip('"')
-            folder_names.append(folder_name)
-        
         print("Could not find Bin or Trash folder. Available folders:")
-        for folder_name in folder_names:
-            print(f"  - {folder_name}")
+        for folder in folders:
+            print(f"  - {folder.name}")
 
-    def __fetch_folders(self) -> List[bytes]:
+    def _get_folders(self, mail: Optional[imaplib.IMAP4_SSL] = None) -> List[Folder]:
         """
-        Fetch the folder list from the IMAP server.
+        Return the cached folder list, fetching and parsing it on first use.
+        
+        Args:
+            mail: Optional active IMAP connection to list the folders with. Pass it when
+                already holding a connection, instead of taking a second one from the pool.
         
         Returns:
-            List of folder bytes as returned by mail.list()
+            List of the folders, in the order of the LIST response
         
         Raises:
             Exception: If connection fails or listing fails
         """
-        mail = self.connect()
-        try:
-            result, folders = mail.list()
-            if result != "OK":
-                raise Exception("Could not list folders")
-            return folders
-        finally:
-            mail.logout()
+        if self._folders is None:
+            with self.instrumentation.operation("list_folders"):
+                if mail is not None:
+                    self._folders = self.__fetch_folders(mail)
+                else:
+                    with self.connection_pool.connection() as mail:
+                        self._folders = self.__fetch_folders(mail)
+        return self._folders
+
+    def invalidate_folders(self) -> None:
+        """Forget the cached folder list and special folders, they are looked up again on next use."""
+        self._folders = None
+        self._special_folders = None
+        self._bin_folder = None
+        self._archive_folder = None
+        self._archive_folder_resolved = False
+
+    @staticmethod
+    def __fetch_folders(mail: imaplib.IMAP4_SSL) -> List[Folder]:
+        result, folders = mail.list()
+        if result != "OK":
+            raise Exception("Could not list folders")
+        return parse_list_response(folders)
+
+    def _get_special_folders(self, mail: Optional[imaplib.IMAP4_SSL] = None) -> Dict[str, Folder]:
+        """
+        Return the special-use folders (RFC 6154) from the attributes of the cached folder list.
+        SPECIAL-USE servers report them in every LIST response, so this needs no extra command,
+        and works whatever the folders are called in the account's language.
+        
+        Args:
+            mail: Optional active IMAP connection, used if the folder list is not cached yet
+        
+        Returns:
+            Dictionary mapping special-use attributes (e.g. "\\Trash") to the folder.
+            Empty if the server does not report special-use attributes.
+        """
+        if self._special_folders is None:
+            special_folders = {}
+            for folder in self._get_folders(mail):
+                for special_use in self.SPECIAL_USE_ATTRIBUTES:
+                    if folder.has_attribute(special_use) and special_use not in special_folders:
+                        special_folders[special_use] = folder
+            self._special_folders = special_folders
+        return self._special_folders
+
+    @property
+    def special_folders(self) -> Dict[str, str]:
+        """The raw names of the special-use folders (\\All, \\Archive, \\Junk, \\Sent, \\Trash, ...) the server reports, looked up on first use."""
+        return {special_use: folder.raw_name for special_use, folder in self._get_special_folders().items()}
 
-    def __find_folder_by_names(self, valid_folder_names: List[str], error_message: str) -> str:
+    def __find_folder_by_names(self, valid_folder_names: List[str], mail: Optional[imaplib.IMAP4_SSL] = None) -> Optional[Folder]:
         """
         Common method to find a folder by matching against a list of valid folder names.
-        Uses the cached folder list from initialization.
+        Uses the cached folder list.
         
         Args:
             valid_folder_names: List of folder names to match against
-            error_message: Error message to raise if folder is not found
+            mail: Optional active IMAP connection, used if the folder list is not cached yet
         
         Returns:
-            The folder name (quoted if it contains spaces, for OVH compatibility)
-        
-        Raises:
-            Exception: If folder is not found
+            The first matching folder, or None if no folder matches
         """
-        folders = self._folders
+        for folder in self._get_folders(mail):
+            if folder.raw_name in valid_folder_names or folder.name in valid_folder_names:
+                return folder
+        return None
 
-        for folder in folders:
-            # Decode the folder
-            decoded_folder = folder.decode()
-
-            # Extract the folder name from the string
-            # The folder name is the part between the last "/" and the end
-            folder_name = decoded_folder.split(' "/" ')[-1].strip('"')
-
-            # Match the folder name exactly
-            if folder_name in valid_folder_names:
-                # For OVH and servers with spaces in folder names, we need to quote it
-                # Extract the quoted mailbox name from LIST response
-                # Match the quoted mailbox name at the end
-                match = re.search(r'"([^"]+)"\s*$', decoded_folder)
-                if match:
-                    # Return quoted version for OVH compatibility
-                    full_path = match.group(1)
-                    # If folder name has spaces, return it quoted (OVH requires this)
-                    if ' ' in full_path:
-                        return f'"{full_path}"'
-                    return full_path
-                # Fallback: quote if it has spaces
-                if ' ' in folder_name:
-                    return f'"{folder_name}"'
-                return folder_name
-
-        self._print_folder_list(folders)
-        raise Exception(error_message)
-
-    def __determine_bin_folder(self) -> str:
-        return self.__find_folder_by_names(
-            [
-                "Trash",
-                "[Gmail]/Bin",
-                "[Gmail]/Trash",
-                "[Yahoo]/Bin",
-                "[Yahoo]/Trash",
-                "Deleted Items",
-            ],
-            "Could not find Bin or Trash folder"
-        )
-
-    def __determine_archive_folder(self) -> str:
-        return self.__find_folder_by_names(
-            [
-                "Archive",
-                "Archief",
-            ],
-            "Could not find Archive or Archief folder"
-        )
+    @property
+    def bin_folder(self) -> str:
+        """Raw name of the bin/trash folder, looked up on first use. Raises an Exception if there is none."""
+        return self._get_bin_folder().raw_name
+
+    @property
+    def archive_folder(self) -> Optional[str]:
+        """Raw name of the archive folder, looked up on first use. None if the account has no archive folder."""
+        archive_folder = self._get_archive_folder()
+        return archive_folder.raw_name if archive_folder is not None else None
+
+    def _get_bin_folder(self, mail: Optional[imaplib.IMAP4_SSL] = None) -> Folder:
+        if self._bin_folder is None:
+            bin_folder = self._get_special_folders(mail).get("\\Trash")
+            if bin_folder is None:
+                bin_folder = self.__find_folder_by_names(self.BIN_FOLDER_NAMES, mail)
+            if bin_folder is None:
+                self._print_folder_list(self._folders)
+                raise Exception("Could not find Bin or Trash folder")
+            self._bin_folder = bin_folder
+        return self._bin_folder
+
+    def _get_archive_folder(self, mail: Optional[imaplib.IMAP4_SSL] = None) -> Optional[Folder]:
+        if not self._archive_folder_resolved:
+            archive_folder = self._get_special_folders(mail).get("\\Archive")
+            if archive_folder is None:
+                archive_folder = self.__find_folder_by_names(self.ARCHIVE_FOLDER_NAMES, mail)
+            self._archive_folder = archive_folder
+            self._archive_folder_resolved = True
+        return self._archive_folder
 
     def connect(self) -> imaplib.IMAP4_SSL:
-        """Create a fresh IMAP connection"""
-        mail = imaplib.IMAP4_SSL(self.mail_server)
-        mail.login(self.email_address, self.mail_password)
-        return mail
+        """Create a fresh IMAP connection.
+        The MailAnalyzer methods take their connections from the connection_pool instead,
+        which opens new ones the same way (see open_connection()). The connection records its
+        commands in the operation running on the calling thread (see cleanmail.instrumentation)."""
+        return open_connection(self.mail_server, self.mail_port, self.use_ssl, self.email_address, self.mail_password)
 
+    @instrumented
     def count_messages(self, foldername: str) -> int:
         """
         Count the number of messages in a given folder.
@@ -135,30 +202,70 @@ class MailAnalyzer:
             foldername: The name of the folder (raw_name format, unquoted)
         
         Returns:
-            The number of messages in the folder (int). Returns 0 if folder selection fails.
+            The number of messages in the folder (int). Returns 0 if the folder status cannot be retrieved.
         """
-        mail = self.connect()
-        
-        try:
-            # Format folder name for SELECT: quote if it has spaces (for OVH and similar servers)
-            formatted_foldername = foldername
-            if ' ' in foldername:
-                formatted_foldername = f'"{foldername}"'
-            
-            # Select folder to get message count (readonly=True to avoid modifications)
-            status, data = mail.select(formatted_foldername, readonly=True)
-            if status == 'OK':
-                return int(data[0])
-            else:
-                # If selection fails, return 0
+        with self.connection_pool.connection() as mail:
+            folder_status = self._get_folder_status(mail, foldername)
+            if folder_status is None:
                 return 0
-        finally:
-            mail.logout()
+            return folder_status.get('MESSAGES', 0)
 
+    @staticmethod
+    def _get_folder_status(mail: imaplib.IMAP4_SSL, foldername: str) -> Optional[dict]:
+        """
+        Retrieve the message counts of a folder with STATUS, which unlike SELECT
+        does not open the folder.
+        
+        Args:
+            mail: Active IMAP connection
+            foldername: The name of the folder (raw_name format, unquoted)
+        
+        Returns:
+            Dictionary with the 'MESSAGES' and 'UNSEEN' counts, and 'SIZE' (in bytes) if the server
+            supports STATUS=SIZE (RFC 8438). None if the status cannot be retrieved,
+            e.g. for \\Noselect folders.
+        """
+        return MailAnalyzer._get_folder_statuses(mail, [foldername])[0]
+
+    @staticmethod
+    def _get_folder_statuses(mail: imaplib.IMAP4_SSL, foldernames: List[str]) -> List[Optional[dict]]:
+        """
+        Retrieve the message counts of many folders, with pipelined STATUS commands:
+        all of them are sent at once, so they cost about one round trip in total.
+        
+        Args:
+            mail: Active IMAP connection
+            foldernames: The names of the folders (raw_name format, unquoted)
+        
+        Returns:
+            The status of every folder (see _get_folder_status()), in the same order
+        """
+        status_items = "MESSAGES UNSEEN"
+        if "STATUS=SIZE" in mail.capabilities:
+            status_items += " SIZE"
+
+        with CommandPipeline(mail) as pipeline:
+            commands = [
+                pipeline.send("STATUS", quote_mailbox(foldername), f"({status_items})", untagged=["STATUS"])
+                for foldername in foldernames
+            ]
+
+        folder_statuses = []
+        for foldername, command in zip(foldernames, commands):
+            statuses = parse_status_responses(command.untagged["STATUS"]) if command.ok else {}
+            # Servers may spell the name differently (e.g. "inbox"), a STATUS command answers for one folder
+            folder_statuses.append(statuses.get(foldername, next(iter(statuses.values()), None)))
+        return folder_statuses
+
+    @instrumented
     def get_all_folders(self, progress_callback=None) -> List[dict]:
         """
         Retrieve all folders with their printable names, raw names, and message counts.
-        Uses the cached folder list from initialization.
+        
+        If the server supports LIST-STATUS (RFC 5819), the folder list and all counts are
+        retrieved with a single LIST command, which also refreshes the cached folder list.
+        Otherwise the cached folder list is used (listed first if needed), and all folders are
+        counted with pipelined STATUS commands over a single connection.
         
         Args:
             progress_callback: Optional callback function for progress updates.
@@ -166,118 +273,175 @@ class MailAnalyzer:
         
         Returns:
             List of dictionaries, each containing:
-            - 'printable_name': Human-readable folder name (str)
+            - 'printable_name': Human-readable folder name, decoded from modified UTF-7 (str)
             - 'raw_name': Folder name that can be used in prone_emails_older_than (str, unquoted)
             - 'message_count': Number of messages in the folder (int)
+            - 'unseen_count': Number of unseen messages in the folder (int)
+            - 'size': Total size of the folder in bytes (int), or None if the server does not support STATUS=SIZE
         
         Raises:
             Exception: If connection fails
         """
-        # Use cached folder list instead of calling mail.list() again
-        folders = self._folders
-        
         folder_info_list = []
-        total_folders = len(folders)
         
-        for idx, folder in enumerate(folders):
-            # Decode the folder
-            decoded_folder = folder.decode()
-            
-            # Extract the folder name from the string
-            # The folder name is the part between the last "/" and the end
-            folder_name = decoded_folder.split(' "/" ')[-1].strip('"')
-            
-            # Extract the full path from the LIST response for raw_name
-            # Match the quoted mailbox name at the end
-            match = re.search(r'"([^"]+)"\s*$', decoded_folder)
-            if match:
-                # Use the full path as raw_name (unquoted, matching prone_emails_older_than format)
-                raw_name = match.group(1)
-            else:
-                # Fallback: use folder_name
-                raw_name = folder_name
-            
-            # Use count_messages() to get the message count
-            message_count = self.count_messages(raw_name)
+        with self.connection_pool.connection() as mail:
+            if "LIST-STATUS" in mail.capabilities:
+                folders, folder_statuses = self._list_with_status(mail)
+                # The LIST response doubles as a refresh of the cached folder list
+                self._folders = folders
+                self._special_folders = None
+                total_folders = len(folders)
+                for idx, folder in enumerate(folders):
+                    folder_info_list.append(
+                        self._build_folder_info(folder.name, folder.raw_name, folder_statuses.get(folder.raw_name))
+                    )
+                    
+                    # Call progress callback if provided
+                    if progress_callback:
+                        progress_callback(idx + 1, total_folders)
+                return folder_info_list
             
-            folder_info_list.append({
-                'printable_name': folder_name,
-                'raw_name': raw_name,
-                'message_count': message_count
-            })
+            # Use cached folder list instead of calling mail.list() again
+            folders = self._get_folders(mail)
+            total_folders = len(folders)
+            folder_statuses = self._get_folder_statuses(mail, [folder.raw_name for folder in folders])
             
-            # Call progress callback if provided
-            if progress_callback:
-                progress_callback(idx + 1, total_folders)
+            for idx, (folder, folder_status) in enumerate(zip(folders, folder_statuses)):
+                folder_info_list.append(
+                    self._build_folder_info(folder.name, folder.raw_name, folder_status)
+                )
+                
+                # Call progress callback if provided
+                if progress_callback:
+                    progress_callback(idx + 1, total_folders)
         
         return folder_info_list
 
+    def _list_with_status(self, mail: imaplib.IMAP4_SSL):
+        """
+        List all folders together with their counts in one round trip, using
+        LIST ... RETURN (STATUS ...) (RFC 5819). Requires the LIST-STATUS capability.
+        
+        Returns:
+            Tuple of (folders, statuses): the parsed folder list, and a dictionary
+            mapping raw folder names to their parsed STATUS attributes.
+        """
+        status_items = "MESSAGES UNSEEN"
+        if "STATUS=SIZE" in mail.capabilities:
+            status_items += " SIZE"
+        # imaplib's list() does not support LIST return options
+        typ, data = mail._simple_command("LIST", '""', '"*"', "RETURN", f"(STATUS ({status_items}))")
+        _, status_data = mail.response("STATUS")
+        typ, folders = mail._untagged_response(typ, data, "LIST")
+        if typ != "OK":
+            raise Exception("Could not list folders")
+
+        return parse_list_response(folders), parse_status_responses(status_data)
+
+    @staticmethod
+    def _build_folder_info(folder_name: str, raw_name: str, folder_status: Optional[dict]) -> dict:
+        """Build a get_all_folders() entry from the folder names and its parsed STATUS."""
+        folder_status = folder_status or {}
+        return {
+            'printable_name': folder_name,
+            'raw_name': raw_name,
+            'message_count': folder_status.get('MESSAGES', 0),
+            'unseen_count': folder_status.get('UNSEEN', 0),
+            'size': folder_status.get('SIZE'),
+        }
+
     @staticmethod
     def chunk(array: List[Any], chunk_size: int) -> List[List[Any]]:
         """Split an array into chunks of a specified size."""
         return [array[i : i + chunk_size] for i in range(0, len(array), chunk_size)]
 
-    def get_sender_statistics(self, progress_callback=None, max_batches: Optional[int] = None) -> pd.DataFrame:
+    @instrumented
+    def get_sender_statistics(self, progress_callback=None, max_batches: Optional[int] = None, headers_only: bool = False, include_headers: bool = False) -> pd.DataFrame:
         """Analyze recent emails and return a DataFrame with sender information
         
+        When a header_cache is configured, only messages that are not cached yet are fetched,
+        and cache entries of messages that disappeared from the INBOX are dropped.
+        
         Args:
             progress_callback: Optional callback function for progress updates
             max_batches: Optional limit on the number of batches (500 mails per batch) to analyze. If None, all batches are processed.
+                With a header cache, the limit applies to the messages that still have to be fetched.
+            headers_only: If True, only fetch the From and List-* headers instead of the full message.
+                This is much faster, but unsubscribe links are then only taken from the
+                List-Unsubscribe header (the HTML body is not scanned). The mailbox is
+                opened read-only, so no \\Seen flags are set.
+            include_headers: If True, add a "Headers" column with a small snapshot
+                (the HEADER_FIELDS headers) of the first message of each sender.
         
         Returns:
-            DataFrame with sender statistics
+            DataFrame with sender statistics. Besides the display columns, every sender
+            row holds the "UID" and "UIDVALIDITY" of its first message, which can be
+            passed to fetch_message() to load that message on demand.
         """
-        mail = self.connect()
+        cached_folder = None
+        if self.header_cache is not None:
+            cached_folder = self.header_cache.folder(self.mail_server, self.email_address, "INBOX")
 
-        mail.select("INBOX")
-        _, messages = mail.uid("search", None, "ALL")
+        sender_data = {}
+        with self.connection_pool.connection() as mail:
+            # Header-only mode uses BODY.PEEK, so the mailbox can be opened read-only
+            uidvalidity, highestmodseq, current_uids = self._select_and_resync(
+                mail, "INBOX", headers_only, cached_folder
+            )
+            fetch_items = self.HEADER_FETCH_ITEMS if headers_only else "(RFC822)"
+            if current_uids is None:
+                current_uids = self._uid_search(mail, "ALL")
+            # Otherwise the server told us what changed since the cached state, no need to list all UIDs
+            message_ids = current_uids
 
-        message_ids = messages[0].split()
+            if cached_folder is not None and uidvalidity is None:
+                # Without UIDVALIDITY the cached UIDs cannot be trusted
+                cached_folder = None
+            if cached_folder is not None:
+                # Headers-only results can be reused for a full analysis only if the body was scanned
+                cached_uids = cached_folder.uids(body_scanned=not headers_only)
+                cached_folder.remove(cached_folder.uids() - current_uids)
+                message_ids = current_uids - cached_uids
 
-        sender_data = {}
-        batch_size = 500
-        
-        # Calculate total messages, capping at max_batches * batch_size if max_batches is set
-        if max_batches is not None:
-            total_messages = min(len(message_ids), max_batches * batch_size)
-        else:
-            total_messages = len(message_ids)
-        processed_messages = 0
-        batch_count = 0
-        for batch_ids in self.chunk(message_ids, batch_size):
-            if max_batches is not None and batch_count >= max_batches:
-                break
-            batch_count += 1
-            if progress_callback:
-                processed_messages += len(batch_ids)
-                progress_callback(processed_messages, total_messages)
+            batch_size = 500
 
-            _, msg_data = mail.uid(
-                "fetch", ",".join([el.decode() for el in batch_ids]), "(RFC822)"
-            )
+            # Calculate total messages, capping at max_batches * batch_size if max_batches is set
+            if max_batches is not None:
+                total_messages = min(len(message_ids), max_batches * batch_size)
+            else:
+                total_messages = len(message_ids)
+            processed_messages = 0
+            batch_count = 0
+            truncated = False
+            for batch_ids in message_ids.chunks(batch_size):
+                if max_batches is not None and batch_count >= max_batches:
+                    truncated = True
+                    break
+                batch_count += 1
+                if progress_callback:
+                    processed_messages += len(batch_ids)
+                    progress_callback(processed_messages, total_messages)
+
+                _, msg_data = mail.uid("fetch", batch_ids.to_imap(), fetch_items)
+
+                records = [
+                    self._parse_message(uid, size, raw_data)
+                    for uid, size, raw_data in self._iter_fetched_messages(msg_data)
+                ]
+                add_count("messages_analyzed", len(records))
+                if cached_folder is not None:
+                    # Store every batch right away, so an interrupted analysis is not lost
+                    cached_folder.add(records, body_scanned=not headers_only)
+                else:
+                    for record in records:
+                        self._add_sender_record(sender_data, record, uidvalidity, include_headers)
 
-            for response_part in msg_data:
-                if isinstance(response_part, tuple):
-                    email_message = email.message_from_bytes(response_part[1])
-                    raw_data = response_part[1]
-
-                    sender = email_message["from"]
-                    sender_name, sender_addr = parseaddr(sender)
-
-                    if sender_addr:
-                        if sender_addr not in sender_data:
-                            sender_data[sender_addr] = {
-                                "Sender Name": sender_name,
-                                "Email": sender_addr,
-                                "Count": 0,
-                                "Raw Data": raw_data,
-                                "Unsubscribe Link": MailAnalyzer.get_unsubscribe_link(
-                                    raw_data
-                                ),
-                            }
-                        sender_data[sender_addr]["Count"] += 1
-
-        mail.logout()
+        if cached_folder is not None:
+            if not truncated:
+                # The cache only reflects the mailbox at HIGHESTMODSEQ if every message was analyzed
+                cached_folder.set_highestmodseq(highestmodseq)
+            for record in cached_folder.records():
+                self._add_sender_record(sender_data, record, uidvalidity, include_headers)
 
         if not sender_data:
             return pd.DataFrame()
@@ -285,6 +449,338 @@ class MailAnalyzer:
         df = pd.DataFrame(sender_data.values())
         return df.sort_values("Count", ascending=False).reset_index(drop=True)
 
+    def _parse_message(self, uid: Optional[int], size: Optional[int], raw_data: bytes) -> dict:
+        """
+        Extract the facts needed for the sender statistics from a fetched message.
+        
+        Args:
+            uid: The UID of the message
+            size: The RFC822.SIZE of the message, if it was fetched. Defaults to len(raw_data).
+            raw_data: The full message or only its HEADER_FIELDS headers
+        
+        Returns:
+            Dictionary with 'uid', 'sender_addr', 'sender_name', 'unsubscribe_link',
+            'size', 'date' (ISO format) and 'headers' (the HEADER_FIELDS snapshot).
+        """
+        email_message = email.message_from_bytes(raw_data)
+
+        sender_name, sender_addr = parseaddr(email_message["from"])
+
+        date = None
+        try:
+            if email_message["date"]:
+                date = parsedate_to_datetime(email_message["date"]).isoformat()
+        except (TypeError, ValueError):
+            pass
+
+        return {
+            "uid": uid,
+            "sender_addr": sender_addr,
+            "sender_name": sender_name,
+            "unsubscribe_link": MailAnalyzer.get_unsubscribe_link(raw_data) if sender_addr else None,
+            "size": size if size is not None else len(raw_data),
+            "date": date,
+            "headers": {
+                name: str(value)
+                for name, value in email_message.items()
+                if name.upper() in self.HEADER_FIELDS
+            },
+        }
+
+    @staticmethod
+    def _add_sender_record(sender_data: dict, record: dict, uidvalidity: Optional[int], include_headers: bool) -> None:
+        """Add a message record (see _parse_message) to the per-sender statistics."""
+        sender_addr = record["sender_addr"]
+        if not sender_addr:
+            return
+        if sender_addr not in sender_data:
+            # Only keep a compact reference to the message, the raw bytes
+            # can be fetched again with fetch_message() when needed
+            sender_data[sender_addr] = {
+                "Sender Name": record["sender_name"],
+                "Email": sender_addr,
+                "Count": 0,
+                "Unsubscribe Link": record["unsubscribe_link"],
+                "UID": record["uid"],
+                "UIDVALIDITY": uidvalidity,
+            }
+            if include_headers:
+                sender_data[sender_addr]["Headers"] = record["headers"]
+        sender_data[sender_addr]["Count"] += 1
+
+    def _select_and_resync(self, mail: imaplib.IMAP4_SSL, foldername: str, readonly: bool, cached_folder: Optional[CachedFolder]):
+        """
+        Select a folder and, if the server supports CONDSTORE/QRESYNC (RFC 7162), find out
+        which UIDs it contains based on the cached state, without listing all UIDs.
+        
+        With QRESYNC the server reports the UIDs that vanished since the cached HIGHESTMODSEQ
+        directly in the SELECT response, only UIDs above the cached maximum have to be searched.
+        With CONDSTORE only, an unchanged HIGHESTMODSEQ (and message count) means nothing changed.
+        Flag changes do not matter, the cached facts only come from immutable headers.
+        
+        Args:
+            mail: Active IMAP connection in authenticated state
+            foldername: Raw name of the folder to select
+            readonly: Whether to select the folder read-only (EXAMINE)
+            cached_folder: The cached state of the folder, if any. It is validated against
+                the folder's UIDVALIDITY.
+        
+        Returns:
+            Tuple of (uidvalidity, highestmodseq, current_uids). current_uids is the UidSet of the
+            folder, or None if a full UID SEARCH is needed.
+        """
+        capabilities = mail.capabilities
+        params = None
+        qresync = False
+        if cached_folder is not None:
+            if "QRESYNC" in capabilities and "ENABLE" in capabilities:
+                # QRESYNC must be enabled explicitly, this also enables CONDSTORE
+                mail.enable("QRESYNC")
+                if cached_folder.uidvalidity is not None and cached_folder.highestmodseq is not None:
+                    qresync = True
+                    params = f"(QRESYNC ({cached_folder.uidvalidity} {cached_folder.highestmodseq}))"
+                else:
+                    params = "(CONDSTORE)"
+            elif "CONDSTORE" in capabilities:
+                params = "(CONDSTORE)"
+
+        if params is None:
+            status, data = mail.select(quote_mailbox(foldername), readonly=readonly)
+        else:
+            status, data = self._select_with_params(mail, quote_mailbox(foldername), readonly, params)
+        if status != "OK":
+            raise Exception(f"Failed to select folder {foldername}: {status}")
+        exists = int(data[-1]) if data and data[-1] else 0
+        uidvalidity = self._get_uidvalidity(mail)
+        _, modseq_data = mail.response("HIGHESTMODSEQ")
+        highestmodseq = int(modseq_data[-1]) if modseq_data and modseq_data[-1] else None
+        _, vanished_data = mail.response("VANISHED")
+        # Discard the FETCH responses for changed messages, so they do not mix with later fetches
+        mail.response("FETCH")
+
+        if cached_folder is None or uidvalidity is None:
+            return uidvalidity, highestmodseq, None
+
+        previous_highestmodseq = cached_folder.highestmodseq
+        cached_folder.validate(uidvalidity)
+        if highestmodseq is None or cached_folder.highestmodseq is None:
+            # New or reset cache, or the mailbox does not support mod-sequences (NOMODSEQ)
+            return uidvalidity, highestmodseq, None
+
+        current_uids = cached_folder.uids()
+        if highestmodseq == previous_highestmodseq:
+            # Nothing was added, expunged or changed since the cached state
+            pass
+        elif qresync:
+            for vanished in vanished_data:
+                if vanished:
+                    current_uids -= UidSet.parse(vanished.replace(b"(EARLIER)", b""))
+            # New messages always get a higher UID than the ones already cached
+            next_uid = (current_uids.last() or 0) + 1
+            new_uids = self._uid_search(mail, SearchQuery.uids(f"{next_uid}:*"))
+            # "n:*" also matches the last message if n is larger than all UIDs
+            current_uids |= new_uids - UidSet.from_ranges([(1, next_uid - 1)])
+        else:
+            return uidvalidity, highestmodseq, None
+
+        if len(current_uids) != exists:
+            # Out of sync, e.g. an analysis that was interrupted: fall back to a full search
+            return uidvalidity, highestmodseq, None
+        return uidvalidity, highestmodseq, current_uids
+
+    @staticmethod
+    def _select_with_params(mail: imaplib.IMAP4_SSL, foldername: str, readonly: bool, params: str):
+        """
+        Same as mail.select(), but with SELECT parameters such as (CONDSTORE), which imaplib does not support.
+        """
+        mail.untagged_responses = {}
+        mail.is_readonly = readonly
+        name = "EXAMINE" if readonly else "SELECT"
+        status, data = mail._simple_command(name, foldername, params)
+        if status != "OK":
+            mail.state = "AUTH"
+            return status, data
+        mail.state = "SELECTED"
+        return status, mail.untagged_responses.get("EXISTS", [None])
+
+    @staticmethod
+    def _get_uidvalidity(mail: imaplib.IMAP4_SSL) -> Optional[int]:
+        """Return the UIDVALIDITY of the currently selected folder, if the server sent it."""
+        _, data = mail.response("UIDVALIDITY")
+        if data and data[-1]:
+            return int(data[-1])
+        return None
+
+    @staticmethod
+    def _uid_search(mail: imaplib.IMAP4_SSL, criteria: Union[str, SearchQuery]) -> UidSet:
+        """
+        Run a UID SEARCH in the selected folder.
+        
+        If the server supports ESEARCH (RFC 4731), the result is requested with RETURN (ALL),
+        so it comes back as a sequence set ("1:500,502,610:900") instead of one number
+        per message, which keeps the response small for huge folders.
+        
+        Args:
+            mail: Active IMAP connection with a folder selected
+            criteria: The search criteria, a SearchQuery or a fixed string such as 'ALL'
+        
+        Returns:
+            UidSet of the matching messages.
+        
+        Raises:
+            Exception: If the server rejects the search
+        """
+        return MailAnalyzer._uid_search_many(mail, [criteria])[0]
+
+    @staticmethod
+    def _uid_search_many(mail: imaplib.IMAP4_SSL, criteria_list: Iterable[Union[str, SearchQuery]]) -> List[UidSet]:
+        """
+        Run several UID SEARCHes in the selected folder as pipelined commands, so they
+        cost about one round trip in total (see _uid_search()).
+        
+        Args:
+            mail: Active IMAP connection with a folder selected
+            criteria_list: The search criteria of every search
+        
+        Returns:
+            UidSet of the matching messages of every search, in the same order.
+        
+        Raises:
+            Exception: If the server rejects one of the searches
+        """
+        esearch = "ESEARCH" in mail.capabilities
+        with CommandPipeline(mail) as pipeline:
+            searches = []
+            for criteria in criteria_list:
+                if isinstance(criteria, SearchQuery):
+                    # Queues the synchronising literals, if any, for this command
+                    criteria = criteria.prepare(mail)
+                if esearch:
+                    searches.append(pipeline.send("UID", "SEARCH", "RETURN", "(ALL)", criteria, untagged=["ESEARCH"]))
+                else:
+                    searches.append(pipeline.send("UID", "SEARCH", criteria, untagged=["SEARCH"]))
+        
+        results = []
+        for search in searches:
+            if not search.ok:
+                raise Exception(f"Search failed: {search.result} {search.data}")
+            if esearch:
+                responses = search.untagged["ESEARCH"]
+                esearch_response = MailAnalyzer._strip_esearch_correlator(responses[-1] if responses else None)
+                # ALL is omitted if nothing matched
+                match = re.search(rb'\bALL ([\d:,]+)', esearch_response)
+                results.append(UidSet.parse(match.group(1) if match else None))
+            else:
+                responses = search.untagged["SEARCH"]
+                results.append(UidSet.parse(responses[-1] if responses else None))
+        return results
+
+    @staticmethod
+    def _uid_search_count(mail: imaplib.IMAP4_SSL, criteria: Union[str, SearchQuery]) -> int:
+        """
+        Count the messages matching a UID SEARCH in the selected folder.
+        With ESEARCH only the count is transferred (RETURN (COUNT)), not the UIDs.
+        
+        Args:
+            mail: Active IMAP connection with a folder selected
+            criteria: The search criteria, a SearchQuery or a fixed string such as 'ALL'
+        
+        Raises:
+            Exception: If the server rejects the search
+        """
+        if "ESEARCH" not in mail.capabilities:
+            return len(MailAnalyzer._uid_search(mail, criteria))
+        if isinstance(criteria, SearchQuery):
+            criteria = criteria.prepare(mail)
+        status, data = mail.uid("SEARCH", "RETURN", "(COUNT)", criteria)
+        if status != "OK":
+            raise Exception(f"Search failed: {status} {data}")
+        match = re.search(rb'\bCOUNT (\d+)', MailAnalyzer._pop_esearch_response(mail))
+        return int(match.group(1)) if match else 0
+
+    @staticmethod
+    def _pop_esearch_response(mail: imaplib.IMAP4_SSL) -> bytes:
+        """
+        Take the ESEARCH response of the last search, e.g. b'(TAG "A5") UID COUNT 3 ALL 4:6'.
+        imaplib leaves it in the untagged responses, uid("SEARCH", ...) itself only returns [None].
+        """
+        _, data = mail.response("ESEARCH")
+        return MailAnalyzer._strip_esearch_correlator(data[-1] if data else None)
+
+    @staticmethod
+    def _strip_esearch_correlator(esearch: Optional[bytes]) -> bytes:
+        """Drop the correlator of an ESEARCH response, so a quoted tag cannot be mistaken for a result."""
+        return re.sub(rb'^\(TAG "[^"]*"\)', b"", esearch or b"")
+
+    @staticmethod
+    def _iter_fetched_messages(msg_data: List[Any]):
+        """
+        Iterate over the message literals of a UID FETCH response.
+        
+        Args:
+            msg_data: The data returned by mail.uid("fetch", ...)
+        
+        Yields:
+            Tuples of (uid, size, literal bytes). The uid and size (RFC822.SIZE)
+            are None if the server did not return them.
+        """
+        def parse_attribute(name: bytes, data: bytes) -> Optional[int]:
+            match = re.search(name + rb' (\d+)', data)
+            return int(match.group(1)) if match else None
+
+        pending = None
+        for response_part in msg_data:
+            if isinstance(response_part, tuple):
+                if pending is not None:
+                    yield pending
+                pending = (
+                    parse_attribute(rb'UID', response_part[0]),
+                    parse_attribute(rb'RFC822\.SIZE', response_part[0]),
+                    response_part[1],
+                )
+            elif pending is not None:
+                # Some servers send attributes after the literal, e.g. b' UID 123)'
+                if isinstance(response_part, bytes):
+                    uid, size, raw_data = pending
+                    if uid is None:
+                        uid = parse_attribute(rb'UID', response_part)
+                    if size is None:
+                        size = parse_attribute(rb'RFC822\.SIZE', response_part)
+                    pending = (uid, size, raw_data)
+                yield pending
+                pending = None
+        if pending is not None:
+            yield pending
+
+    @instrumented
+    def fetch_message(self, uid: int, uidvalidity: Optional[int], foldername: str = "INBOX") -> Optional[Message]:
+        """
+        Lazily fetch a full message, e.g. the first message of a sender in get_sender_statistics().
+        The message is fetched with BODY.PEEK[], so its \\Seen flag is left untouched.
+        
+        Args:
+            uid: The UID of the message
+            uidvalidity: The UIDVALIDITY the UID was obtained with. If it no longer matches
+                the folder, the UID refers to a different message and None is returned.
+            foldername: The folder containing the message (default: "INBOX")
+        
+        Returns:
+            The parsed email message, or None if the message no longer exists.
+        """
+        with self.connection_pool.connection() as mail:
+            status, _ = mail.select(quote_mailbox(foldername), readonly=True)
+            if status != "OK":
+                raise Exception(f"Failed to select folder {foldername}: {status}")
+            if uidvalidity is not None and self._get_uidvalidity(mail) != uidvalidity:
+                return None
+
+            result, msg_data = mail.uid("FETCH", str(uid), "(BODY.PEEK[])")
+            if result != "OK":
+                raise Exception(f"Failed to fetch email UID {uid}: {result}")
+            for _, _, raw_data in self._iter_fetched_messages(msg_data):
+                return email.message_from_bytes(raw_data)
+            return None
+
     @staticmethod
     def get_unsubscribe_link(raw_email_data) -> Optional[str]:
         """Extract unsubscribe link from email data"""
@@ -320,15 +816,16 @@ class MailAnalyzer:
         except Exception as e:
             return None
 
-    def _move_message_uids(self, mail: imaplib.IMAP4_SSL, message_uids: List[bytes], destination_folder: str, mark_as_deleted: bool = True, progress_callback=None, total_messages: int = None) -> int:
+    def _move_message_uids(self, mail: imaplib.IMAP4_SSL, message_uids: Union[UidSet, List[bytes]], destination_folder: str, mark_as_deleted: bool = True, progress_callback=None, total_messages: int = None) -> int:
         """
         Helper method to move messages by their UIDs to a destination folder.
         
         Args:
             mail: Active IMAP connection
-            message_uids: List of message UIDs (bytes) to move
-            destination_folder: Folder to move messages to (bin or archive)
-            mark_as_deleted: If True, mark messages as deleted and expunge. If False, just copy.
+            message_uids: UidSet (or list of UIDs as bytes) of the messages to move
+            destination_folder: Raw name of the folder to move messages to (bin or archive)
+            mark_as_deleted: If True, mark messages as deleted and expunge (or use UID MOVE if the
+                server supports it). If False, just copy.
             progress_callback: Optional callback function for progress updates.
                 Called as progress_callback(current_processed, total_messages).
             total_messages: Total number of messages for progress tracking. If None, uses len(message_uids).
@@ -336,6 +833,8 @@ class MailAnalyzer:
         Returns:
             The number of emails moved.
         """
+        if not isinstance(message_uids, UidSet):
+            message_uids = UidSet(int(uid) for uid in message_uids)
         if not message_uids:
             return 0
         
@@ -343,99 +842,223 @@ class MailAnalyzer:
         if total_messages is None:
             total_messages = len(message_uids)
         
+        if mark_as_deleted and "MOVE" in mail.capabilities:
+            total_moved = self._uid_move_message_uids(mail, message_uids, destination_folder, progress_callback, total_messages)
+            add_count("messages_moved", total_moved)
+            return total_moved
+        
         # Process emails in small batches for better performance
         # OVH's IMAP server works with quoted folder names and small batches
         batch_size = 50
+        uidplus = "UIDPLUS" in mail.capabilities
+        batches = list(message_uids.chunks(batch_size))
+        print(f"Copying {len(batches)} batches ({len(message_uids)} emails)...")
+        
+        # The batches are independent, so their commands are pipelined. Each step only
+        # starts when the previous one succeeded for every batch: a message is never
+        # flagged as deleted before its copy is confirmed, nor expunged before it is flagged.
         total_copied = 0
         
-        for batch_start in range(0, len(message_uids), batch_size):
-            batch_uids = message_uids[batch_start:batch_start + batch_size]
-            batch_num = batch_start // batch_size + 1
-            total_batches = (len(message_uids) + batch_size - 1) // batch_size
-            
-            print(f"Processing batch {batch_num} of {total_batches} ({len(batch_uids)} emails)...")
-            
-            # Decode UIDs
-            uid_strings = [uid.decode() for uid in batch_uids]
-            uid_list = ','.join(uid_strings)
-            
-            # Batch fetch sequence numbers for all UIDs in this batch
-            result, data = mail.uid("FETCH", uid_list, "(UID)")
-            if result != "OK":
-                raise Exception(f"Failed to fetch sequence numbers for batch: {result}")
-            
-            # Parse sequence numbers from FETCH response
-            # Format: b'1 (UID 12345)', b'2 (UID 12346)', etc.
-            seq_nums = []
-            for item in data:
-                if isinstance(item, tuple):
-                    # Skip the data part, we only need the header
-                    continue
-                if isinstance(item, bytes):
-                    # Parse: b'1 (UID 12345)'
-                    parts = item.decode().split()
-                    if parts:
-                        seq_nums.append(parts[0])
-            
-            if len(seq_nums) != len(batch_uids):
-                raise Exception(f"Mismatch: got {len(seq_nums)} sequence numbers for {len(batch_uids)} UIDs")
-            
-            # Batch COPY: try copying all at once, fall back to individual if needed
-            seq_list = ','.join(seq_nums)
-            result, response = mail.copy(seq_list, destination_folder)
-            
-            if result != "OK":
+        def batch_copied(batch_uids: UidSet) -> None:
+            # Copying is the bulk of the work, so progress follows the copies, batch by batch
+            nonlocal total_copied
+            total_copied += len(batch_uids)
+            if progress_callback:
+                progress_callback(total_copied, total_messages)
+        
+        def copy_completed(batch_uids: UidSet, copy: PipelinedCommand) -> None:
+            # Failed batches are copied one by one below, once the pipeline is drained
+            if copy.ok:
+                batch_copied(batch_uids)
+        
+        with CommandPipeline(mail) as pipeline:
+            # Batch UID COPY, serialising UIDs as a compact sequence set, e.g. "1:20,25"
+            copies = [
+                pipeline.send(
+                    "UID", "COPY", batch_uids.to_imap(), quote_mailbox(destination_folder),
+                    on_complete=partial(copy_completed, batch_uids),
+                )
+                for batch_uids in batches
+            ]
+        
+        for batch_uids, copy in zip(batches, copies):
+            if not copy.ok:
                 # Fall back to individual copies if batch fails
                 print("Batch COPY failed, falling back to individual copies...")
-                for seq_num, uid in zip(seq_nums, uid_strings):
-                    result, response = mail.copy(seq_num, destination_folder)
+                for uid in batch_uids:
+                    result, response = mail.uid("COPY", str(uid), quote_mailbox(destination_folder))
                     if result != "OK":
-                        raise Exception(f"Failed to copy email UID {uid} (seq {seq_num}) to {destination_folder}: {result} {response}")
+                        raise Exception(f"Failed to copy email UID {uid} to {destination_folder}: {result} {response}")
+                batch_copied(batch_uids)
+        
+        # Only mark as deleted and expunge if this is a delete operation
+        if mark_as_deleted:
+            # Batch STORE: mark all as deleted. .SILENT stops the server from
+            # echoing an untagged FETCH with the new flags for every message.
+            with CommandPipeline(mail) as pipeline:
+                stores = [
+                    pipeline.send("UID", "STORE", batch_uids.to_imap(), '+FLAGS.SILENT', '(\\Deleted)')
+                    for batch_uids in batches
+                ]
+            failed = next((store for store in stores if not store.ok), None)
+            if failed is not None:
+                raise Exception(f"Failed to mark emails as deleted: {failed.result} {failed.data}")
             
-            # Only mark as deleted and expunge if this is a delete operation
-            if mark_as_deleted:
-                # Batch STORE: mark all as deleted at once
-                result, response = mail.uid("STORE", uid_list, '+FLAGS', '\\Deleted')
-                if result != "OK":
-                    raise Exception(f"Failed to mark emails as deleted: {result} {response}")
+            if uidplus:
+                # UID EXPUNGE (RFC 4315) only removes the messages we flagged,
+                # not other messages that happen to be flagged as deleted
+                with CommandPipeline(mail) as pipeline:
+                    expunges = [pipeline.send("UID", "EXPUNGE", batch_uids.to_imap()) for batch_uids in batches]
+                for expunge in expunges:
+                    if not expunge.ok:
+                        print(f"Warning: UID EXPUNGE failed: {expunge.result} {expunge.data}")
+            else:
+                try:
+                    mail.expunge()
+                except Exception as e:
+                    print(f"Warning: Expunge failed: {e}")
+        
+        add_count("messages_moved" if mark_as_deleted else "messages_copied", total_copied)
+        return total_copied
+
+    @staticmethod
+    def _uid_move_message_uids(mail: imaplib.IMAP4_SSL, message_uids: UidSet, destination_folder: str, progress_callback=None, total_messages: int = None) -> int:
+        """
+        Move messages with UID MOVE (RFC 6851). This copies, flags and expunges the messages
+        in a single command, so much larger batches can be used than with COPY/STORE/EXPUNGE.
+        Requires the MOVE capability.
+        
+        Args:
+            mail: Active IMAP connection with the source folder selected
+            message_uids: UidSet of the messages to move
+            destination_folder: Raw name of the folder to move messages to
+            progress_callback: Optional callback function for progress updates.
+                Called as progress_callback(current_processed, total_messages).
+            total_messages: Total number of messages for progress tracking. If None, uses len(message_uids).
+        
+        Returns:
+            The number of emails moved.
+        """
+        if total_messages is None:
+            total_messages = len(message_uids)
+        
+        # Batches are limited by count for progress reporting, and by the length
+        # of the sequence set to stay below server line length limits
+        batches = list(message_uids.chunks(max_count=10000))
+        total_moved = 0
+        
+        print(f"Moving {len(batches)} batches ({len(message_uids)} emails)...")
+        # Every MOVE is atomic and independent of the others, so they are pipelined
+        with CommandPipeline(mail) as pipeline:
+            moves = [
+                pipeline.send("UID", "MOVE", batch_uids.to_imap(), quote_mailbox(destination_folder))
+                for batch_uids in batches
+            ]
+        
+        for batch_uids, move in zip(batches, moves):
+            if not move.ok:
+                raise Exception(f"Failed to move emails to {destination_folder}: {move.result} {move.data}")
             
-            total_copied += len(batch_uids)
+            total_moved += len(batch_uids)
             
             # Call progress callback if provided
             if progress_callback:
-                progress_callback(total_copied, total_messages)
-            
-            # Expunge every 50 emails to keep memory usage down (only if deleting)
-            if mark_as_deleted and total_copied % 50 == 0:
-                try:
-                    mail.expunge()
-                except Exception as e:
-                    # If expunge fails, continue - we'll expunge at the end
-                    print(f"Warning: Expunge failed at {total_copied} emails: {e}")
+                progress_callback(total_moved, total_messages)
         
-        # Final expunge at the end (only if deleting)
-        if mark_as_deleted:
-            try:
-                mail.expunge()
-            except Exception as e:
-                print(f"Warning: Final expunge failed: {e}")
+        return total_moved
+
+    @staticmethod
+    def _close_folder(mail: imaplib.IMAP4_SSL) -> None:
+        """
+        Leave the selected folder after moving messages out of it.
+        CLOSE expunges every message flagged as deleted, also the ones flagged by other clients.
+        With UIDPLUS or MOVE our own messages were already expunged by UID, so UNSELECT is used
+        instead when the server supports it.
+        """
+        capabilities = mail.capabilities
+        if ("UIDPLUS" in capabilities or "MOVE" in capabilities) and "UNSELECT" in capabilities:
+            mail.unselect()
+        else:
+            mail.close()
+
+    @staticmethod
+    def _flag_deleted_in_batches(mail: imaplib.IMAP4_SSL, message_uids: UidSet) -> None:
+        """
+        Mark messages as deleted with UID STORE, in range encoded batches.
         
-        return total_copied
+        Args:
+            mail: Active IMAP connection with the folder selected
+            message_uids: UidSet of the messages to mark
+        
+        Raises:
+            Exception: If the server rejects a STORE
+        """
+        total_batches = (len(message_uids) + 4999) // 5000
+        for batch_num, batch_uids in enumerate(message_uids.chunks(5000), start=1):
+            print(f"Marking batch {batch_num} of {total_batches} ({len(batch_uids)} emails) as deleted...")
+            result, response = mail.uid("STORE", batch_uids.to_imap(), "+FLAGS.SILENT", "(\\Deleted)")
+            if result != "OK":
+                raise Exception(f"Failed to mark emails as deleted: {result} {response}")
 
-    def _delete_message_uids(self, mail: imaplib.IMAP4_SSL, message_uids: List[bytes]) -> int:
+    @staticmethod
+    def _expunge_with_progress(mail: imaplib.IMAP4_SSL, progress_callback=None, total_messages: int = 0) -> int:
+        """
+        Run EXPUNGE and count the expunged messages as the server reports them.
+        
+        The server sends an untagged EXPUNGE response per message, or VANISHED responses
+        with UID ranges if QRESYNC was enabled on the connection (RFC 7162), while the
+        command runs. Counting them as they arrive allows progress reporting of a single
+        EXPUNGE of a large folder.
+        
+        Args:
+            mail: Active IMAP connection with the folder selected read-write
+            progress_callback: Optional callback function for progress updates.
+                Called as progress_callback(current_expunged, total_messages).
+            total_messages: The expected number of messages, for the progress updates
+        
+        Returns:
+            The number of expunged messages.
+        
+        Raises:
+            Exception: If the server rejects the EXPUNGE
+        """
+        # Drop responses of earlier commands, they must not be counted
+        mail.untagged_responses.pop("EXPUNGE", None)
+        mail.untagged_responses.pop("VANISHED", None)
+        tag = mail._command("EXPUNGE")
+        expunged = 0
+        reported = 0
+        while mail.tagged_commands[tag] is None:
+            mail._get_response()
+            expunged += len(mail.untagged_responses.pop("EXPUNGE", []))
+            for vanished in mail.untagged_responses.pop("VANISHED", []):
+                expunged += len(UidSet.parse(vanished))
+            # Report every 500 messages, not for every response line
+            if progress_callback and expunged - reported >= 500:
+                progress_callback(expunged, max(total_messages, expunged))
+                reported = expunged
+        result, response = mail._command_complete("EXPUNGE", tag)
+        if result != "OK":
+            raise Exception(f"Expunge failed: {result} {response}")
+        if progress_callback:
+            progress_callback(expunged, max(total_messages, expunged))
+        return expunged
+
+    def _delete_message_uids(self, mail: imaplib.IMAP4_SSL, message_uids: UidSet) -> int:
         """
         Helper method to delete messages by their UIDs.
         Moves messages to the bin folder and marks them as deleted.
         
         Args:
             mail: Active IMAP connection
-            message_uids: List of message UIDs (bytes) to delete
+            message_uids: UidSet of the messages to delete
         
         Returns:
             The number of emails moved to the bin.
         """
-        return self._move_message_uids(mail, message_uids, self.bin_folder, mark_as_deleted=True)
+        return self._move_message_uids(mail, message_uids, self._get_bin_folder(mail).raw_name, mark_as_deleted=True)
 
+    @instrumented
     def delete_emails_from_sender(self, sender_email) -> int:
         """
         Delete emails from a specific sender by moving them to the bin folder.
@@ -452,25 +1075,138 @@ class MailAnalyzer:
         """
         # Validate email address to prevent IMAP command injection
         sender_email = EmailValidator.validate_email_for_imap(sender_email)
+        return self.delete_emails_from_senders([sender_email])[sender_email]
+
+    @instrumented
+    def delete_emails_from_senders(self, sender_emails: Iterable[str], progress_callback=None) -> Dict[str, int]:
+        """
+        Delete emails from several senders by moving them to the bin folder, in a single session.
         
-        mail = self.connect()
+        The senders are combined into OR searches (SENDERS_PER_SEARCH senders per search),
+        and all matching emails are moved in one pass over the union of the results.
         
-        try:
-            mail.select("INBOX", readonly=False)
-            # Use UID SEARCH to get UIDs (which remain stable after deletions)
-            _, messages = mail.uid("SEARCH", None, f'FROM "{sender_email}"')
-            if not messages[0]:
-                return 0
+        Args:
+            sender_emails: The email addresses of the senders. They are validated
+                          to prevent IMAP command injection.
+            progress_callback: Optional callback function for progress updates.
+                Called as progress_callback(current_processed, total_messages).
+        
+        Returns:
+            Dictionary mapping every (validated, lowercase) sender address to the number
+            of its emails moved to the bin.
+        
+        Raises:
+            EmailValidationError: If one of the sender_emails is invalid or unsafe.
+                Nothing is deleted in that case.
+        """
+        # Validate all addresses before touching the mailbox, dict keeps the order and drops duplicates
+        senders = list(dict.fromkeys(
+            EmailValidator.validate_email_for_imap(sender_email) for sender_email in sender_emails
+        ))
+        counts = {sender: 0 for sender in senders}
+        if not senders:
+            return counts
+        
+        with self.connection_pool.connection() as mail:
+            status, _ = mail.select("INBOX", readonly=False)
+            if status != "OK":
+                raise Exception(f"Failed to select folder INBOX: {status}")
+            try:
+                # Use UID SEARCH to get UIDs (which remain stable after deletions),
+                # the searches of all sender chunks are pipelined
+                message_uids = UidSet()
+                queries = [
+                    SearchQuery.any_of(SearchQuery.from_(sender) for sender in sender_chunk)
+                    for sender_chunk in self.chunk(senders, self.SENDERS_PER_SEARCH)
+                ]
+                for chunk_uids in self._uid_search_many(mail, queries):
+                    message_uids |= chunk_uids
+                if not message_uids:
+                    return counts
+                
+                if len(senders) == 1:
+                    counts[senders[0]] = len(message_uids)
+                else:
+                    self._count_messages_per_sender(mail, message_uids, counts)
+                
+                self._move_message_uids(mail, message_uids, self._get_bin_folder(mail).raw_name, mark_as_deleted=True, progress_callback=progress_callback)
+                return counts
+            finally:
+                self._close_folder(mail)
 
-            message_uids = messages[0].split()
-            if not message_uids:
-                return 0
-            
-            total_copied = self._delete_message_uids(mail, message_uids)
-            return total_copied
-        finally:
-            mail.close()
+    def _count_messages_per_sender(self, mail: imaplib.IMAP4_SSL, message_uids: UidSet, counts: Dict[str, int]) -> None:
+        """
+        Attribute messages found by a combined FROM search to the senders, by their From header.
+        Messages whose header names none of the senders, e.g. because the server matched an
+        encoded display name, are attributed with a FROM search per sender instead.
+        
+        Args:
+            mail: Active IMAP connection with the folder selected
+            message_uids: UidSet of the messages to attribute
+            counts: Dictionary of sender address to count, updated in place
+        """
+        senders = list(counts)
+        unmatched_uids = []
+        for batch_uids in message_uids.chunks(500):
+            _, msg_data = mail.uid("FETCH", batch_uids.to_imap(), "(BODY.PEEK[HEADER.FIELDS (FROM)])")
+            for uid, _, raw_data in self._iter_fetched_messages(msg_data):
+                from_header = str(email.message_from_bytes(raw_data).get("From", ""))
+                sender_addr = parseaddr(from_header)[1].lower()
+                if sender_addr not in counts:
+                    # FROM searches match substrings of the header, e.g. "john@example.com"
+                    # also matches "Little John <littlejohn@example.com>"
+                    sender_addr = next((sender for sender in senders if sender in from_header.lower()), None)
+                if sender_addr is not None:
+                    counts[sender_addr] += 1
+                elif uid is not None:
+                    unmatched_uids.append(uid)
+        if not unmatched_uids:
+            return
+        
+        # Let the server decide, the first sender whose search matches a message gets it
+        unmatched_uids = UidSet(unmatched_uids)
+        queries = [SearchQuery.from_(sender) & SearchQuery.uids(unmatched_uids) for sender in senders]
+        attributed_uids = UidSet()
+        for sender, sender_uids in zip(senders, self._uid_search_many(mail, queries)):
+            sender_uids -= attributed_uids
+            counts[sender] += len(sender_uids)
+            attributed_uids |= sender_uids
+        if len(attributed_uids) < len(unmatched_uids):
+            print(f"Warning: Could not attribute {len(unmatched_uids) - len(attributed_uids)} emails to a sender")
+
+    @staticmethod
+    def _sent_before_criteria(days_ago: int) -> SearchQuery:
+        """Search criteria for the messages sent more than days_ago days ago."""
+        # Calculate the threshold date
+        threshold_date = datetime.now() - timedelta(days=days_ago)
+        return SearchQuery.sent_before(threshold_date.date())
+
+    @instrumented
+    def count_emails_older_than(self, foldername: str, days_ago: int) -> int:
+        """
+        Count the emails older than a specified number of days in a folder, e.g. to preview
+        what prone_emails_older_than() would move. The folder is opened read-only.
+        
+        Args:
+            foldername: The name of the folder to search in (e.g., "INBOX")
+            days_ago: Number of days ago as threshold
+        
+        Returns:
+            The number of emails older than days_ago days.
+        
+        Raises:
+            ValueError: If days_ago is negative
+        """
+        if days_ago < 0:
+            raise ValueError("days_ago must be a non-negative integer")
+        
+        with self.connection_pool.connection() as mail:
+            status, _ = mail.select(quote_mailbox(foldername), readonly=True)
+            if status != "OK":
+                raise Exception(f"Failed to select folder {foldername}: {status}")
+            return self._uid_search_count(mail, self._sent_before_criteria(days_ago))
 
+    @instrumented
     def prone_emails_older_than(self, foldername: str, days_ago: int, action: str = "delete", progress_callback=None) -> int:
         """
         Prune (delete or archive) emails older than a specified number of days from a given folder.
@@ -500,53 +1236,48 @@ class MailAnalyzer:
             mark_as_deleted = True
         else:  # action == "archive"
             destination_folder = self.archive_folder
+            if destination_folder is None:
+                raise Exception("Could not find Archive or Archief folder")
             mark_as_deleted = False
         
-        # Calculate the threshold date
-        threshold_date = datetime.now() - timedelta(days=days_ago)
-        # Format date for IMAP: DD-MMM-YYYY (e.g., "01-Jan-2024")
-        imap_date = threshold_date.strftime("%d-%b-%Y")
-        
-        # Format folder name: quote if it has spaces (for OVH and similar servers)
-        formatted_foldername = foldername
-        if ' ' in foldername:
-            formatted_foldername = f'"{foldername}"'
-        
-        mail = self.connect()
-        selected = False
-        
-        try:
-            mail.select(formatted_foldername, readonly=False)
-            selected = True
-            # Use UID SEARCH with SENTBEFORE to find messages older than the threshold date
-            _, messages = mail.uid("SEARCH", None, f'SENTBEFORE "{imap_date}"')
-            if not messages[0]:
-                return 0
-            
-            message_uids = messages[0].split()
-            if not message_uids:
-                return 0
+        with self.connection_pool.connection() as mail:
+            selected = False
             
-            total_messages = len(message_uids)
-            total_copied = self._move_message_uids(mail, message_uids, destination_folder, mark_as_deleted, progress_callback, total_messages)
-            return total_copied
-        finally:
-            # Use close() only if we successfully selected a folder, otherwise use logout()
-            if selected:
-                try:
-                    mail.close()
-                except Exception:
-                    mail.logout()
-            else:
-                mail.logout()
+            try:
+                status, _ = mail.select(quote_mailbox(foldername), readonly=False)
+                if status != "OK":
+                    raise Exception(f"Failed to select folder {foldername}: {status}")
+                selected = True
+                # Use UID SEARCH with SENTBEFORE to find messages older than the threshold date
+                message_uids = self._uid_search(mail, self._sent_before_criteria(days_ago))
+                if not message_uids:
+                    return 0
+                
+                total_messages = len(message_uids)
+                total_copied = self._move_message_uids(mail, message_uids, destination_folder, mark_as_deleted, progress_callback, total_messages)
+                return total_copied
+            finally:
+                # Close the folder only if we successfully selected it.
+                # The connection goes back to the pool.
+                if selected:
+                    try:
+                        self._close_folder(mail)
+                    except Exception as e:
+                        print(f"Warning: Close failed: {e}")
 
+    @instrumented
     def empty_bin_folder(self, progress_callback=None) -> int:
         """
         Permanently delete all emails in the bin/trash folder.
         
+        All messages are flagged with a single STORE 1:* +FLAGS.SILENT (\\Deleted) and removed
+        with a single EXPUNGE. Only if the server rejects the STORE, the UIDs are flagged in
+        range encoded batches instead.
+        
         Args:
             progress_callback: Optional callback function for progress updates.
-                Called as progress_callback(current_deleted, total_messages).
+                Called as progress_callback(current_deleted, total_messages), while the
+                server reports the expunged messages.
         
         Returns:
             The number of emails permanently deleted.
@@ -554,83 +1285,42 @@ class MailAnalyzer:
         Raises:
             Exception: If connection fails or folder selection fails
         """
-        mail = self.connect()
-        selected = False
-        
-        try:
-            # Format folder name for SELECT: unquote if already quoted, then quote if it has spaces
-            # (for OVH and similar servers)
-            unquoted_foldername = self.bin_folder.strip('"')
-            formatted_foldername = unquoted_foldername
-            if ' ' in unquoted_foldername:
-                formatted_foldername = f'"{unquoted_foldername}"'
+        with self.connection_pool.connection() as mail:
+            selected = False
             
-            # Select the bin folder
-            status, data = mail.select(formatted_foldername, readonly=False)
-            if status != "OK":
-                raise Exception(f"Failed to select bin folder: {status}")
-            selected = True
-            
-            # Get all message UIDs in the bin folder
-            _, messages = mail.uid("SEARCH", None, "ALL")
-            if not messages[0]:
-                return 0
-            
-            message_uids = messages[0].split()
-            if not message_uids:
-                return 0
-            
-            total_messages = len(message_uids)
-            
-            # Process in batches for better performance
-            batch_size = 50
-            total_deleted = 0
-            
-            for batch_start in range(0, len(message_uids), batch_size):
-                batch_uids = message_uids[batch_start:batch_start + batch_size]
-                batch_num = batch_start // batch_size + 1
-                total_batches = (len(message_uids) + batch_size - 1) // batch_size
-                
-                print(f"Processing batch {batch_num} of {total_batches} ({len(batch_uids)} emails)...")
+            try:
+                # Select the bin folder
+                status, data = mail.select(self._get_bin_folder(mail).imap_name, readonly=False)
+                if status != "OK":
+                    raise Exception(f"Failed to select bin folder: {status}")
+                selected = True
                 
-                # Decode UIDs
-                uid_strings = [uid.decode() for uid in batch_uids]
-                uid_list = ','.join(uid_strings)
+                total_messages = int(data[-1]) if data and data[-1] else 0
+                if total_messages == 0:
+                    return 0
                 
-                # Mark messages as deleted
-                result, response = mail.uid("STORE", uid_list, '+FLAGS', '\\Deleted')
+                # Fast path: flag every message in the folder with one command
+                try:
+                    result, response = mail.store("1:*", "+FLAGS.SILENT", "(\\Deleted)")
+                except imaplib.IMAP4.error as e:
+                    # BAD, e.g. a server that limits the number of messages per command.
+                    # IMAP4.abort (connection lost) is not recoverable.
+                    if isinstance(e, imaplib.IMAP4.abort):
+                        raise
+                    result, response = "BAD", [str(e)]
                 if result != "OK":
-                    raise Exception(f"Failed to mark emails as deleted: {result} {response}")
+                    print(f"Warning: Flagging all emails at once failed ({result} {response}), flagging in batches")
+                    self._flag_deleted_in_batches(mail, self._uid_search(mail, "ALL"))
                 
-                total_deleted += len(batch_uids)
+                # Permanently delete all marked messages
+                return self._expunge_with_progress(mail, progress_callback, total_messages)
                 
-                # Call progress callback if provided
-                if progress_callback:
-                    progress_callback(total_deleted, total_messages)
-                
-                # Expunge every 50 emails to keep memory usage down
-                if total_deleted % 50 == 0:
+            finally:
+                # Use close() only if we successfully selected a folder, it also expunges
+                # the messages marked as deleted. The connection goes back to the pool.
+                if selected:
                     try:
-                        mail.expunge()
+                        mail.close()
                     except Exception as e:
-                        # If expunge fails, continue - we'll expunge at the end
-                        print(f"Warning: Expunge failed at {total_deleted} emails: {e}")
-            
-            # Final expunge to permanently delete all marked messages
-            try:
-                mail.expunge()
-            except Exception as e:
-                print(f"Warning: Final expunge failed: {e}")
-            
-            return total_deleted
-            
-        finally:
-            # Use close() only if we successfully selected a folder, otherwise use logout()
-            if selected:
-                try:
-                    mail.close()
-                except Exception:
-                    mail.logout()
-            else:
-                mail.logout()
+                        print(f"Warning: Close failed: {e}")
 
@@ -0,0 +1,307 @@
+"""
+Prometheus metrics of the IMAP traffic and the cleanup operations.
+
+The metrics are collected from the instrumentation of every MailAnalyzer in the
+process (see cleanmail.instrumentation) and rendered in the Prometheus text
+exposition format, without a dependency on a client library. They are enabled
+with environment variables, see enable_metrics_from_env():
+
+    CLEANMAIL_METRICS_PORT=9108        serve http://<host>:9108/metrics from a sidecar thread
+    CLEANMAIL_METRICS_ADDRESS=0.0.0.0  address of that endpoint (default: all interfaces)
+    CLEANMAIL_METRICS_TEXTFILE=/var/lib/node_exporter/cleanmail.prom
+                                       rewrite this file after every operation, for the
+                                       node_exporter textfile collector
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from cleanmail.connection_pool import pool_statistics
+from cleanmail.instrumentation import CommandRecord, OperationSummary, add_global_hooks
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+COMMAND_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+OPERATION_DURATION_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+# Message counts reported by the operations (see instrumentation.add_count())
+MESSAGE_COUNTS = {
+    "messages_analyzed": "Messages fetched and parsed for the sender statistics",
+    "messages_moved": "Messages moved to another folder (bin or archive)",
+    "messages_copied": "Messages copied to another folder (archive)",
+    "messages_expunged": "Messages the server reported as expunged",
+}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    labels = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self._samples()]
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A monotonically increasing total, per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._label_values(labels), 0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.label_names:
+            values = [((), 0)]
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """A value that is read when the metrics are rendered."""
+
+    type = "gauge"
+
+    def __init__(
+        self, name: str, documentation: str, collect: Callable[[], Dict[Tuple[str, ...], float]], label_names: Sequence[str] = ()
+    ):
+        """
+        Args:
+            collect: Function returning the current value per tuple of label values
+        """
+        super().__init__(name, documentation, label_names)
+        self._collect = collect
+
+    def _samples(self) -> Iterable[str]:
+        for key, value in sorted(self._collect().items()):
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """Observations counted in cumulative buckets, per combination of label values."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Label values -> (count per bucket, sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CleanmailMetrics:
+    """The metrics of CleanMail, fed by the hooks of the MailAnalyzer instrumentation."""
+
+    def __init__(self):
+        self.connections_opened = Counter(
+            "cleanmail_imap_connections_opened_total", "IMAP connections opened (TCP and TLS handshake)"
+        )
+        self.logins = Counter("cleanmail_imap_logins_total", "IMAP logins by result", ["result"])
+        self.commands = Counter("cleanmail_imap_commands_total", "IMAP commands by command and result", ["command", "result"])
+        self.command_duration = Histogram(
+            "cleanmail_imap_command_duration_seconds",
+            "Time from sending an IMAP command until its tagged response",
+            COMMAND_DURATION_BUCKETS,
+            ["command"],
+        )
+        self.bytes_sent = Counter("cleanmail_imap_bytes_sent_total", "Bytes sent to IMAP servers", ["command"])
+        self.bytes_received = Counter("cleanmail_imap_bytes_received_total", "Bytes received from IMAP servers", ["command"])
+        self.messages = {
+            name: Counter(f"cleanmail_{name}_total", documentation, ["operation"])
+            for name, documentation in MESSAGE_COUNTS.items()
+        }
+        self.operations = Counter("cleanmail_operations_total", "MailAnalyzer operations by result", ["operation", "result"])
+        self.operation_duration = Histogram(
+            "cleanmail_operation_duration_seconds",
+            "Duration of MailAnalyzer operations",
+            OPERATION_DURATION_BUCKETS,
+            ["operation"],
+        )
+        self.open_connections = Gauge(
+            "cleanmail_imap_connections",
+            "Pooled IMAP connections by state",
+            lambda: {(state,): count for state, count in pool_statistics().items() if state != "pools"},
+            ["state"],
+        )
+        self.accounts = Gauge(
+            "cleanmail_imap_accounts",
+            "Accounts with a connection pool",
+            lambda: {(): pool_statistics()["pools"]},
+        )
+
+    def record_command(self, operation: str, record: CommandRecord) -> None:
+        if record.verb == "CONNECT":
+            self.connections_opened.inc()
+        elif record.verb == "LOGIN":
+            self.logins.inc(result=record.result or "")
+        self.commands.inc(command=record.verb, result=record.result or "")
+        self.command_duration.observe(record.seconds, command=record.verb)
+        self.bytes_sent.inc(record.bytes_sent, command=record.verb)
+        self.bytes_received.inc(record.bytes_received, command=record.verb)
+
+    def record_operation(self, summary: OperationSummary) -> None:
+        self.operations.inc(operation=summary.name, result=summary.error or "OK")
+        self.operation_duration.observe(summary.seconds, operation=summary.name)
+        for name, value in summary.counts.items():
+            counter = self.messages.get(name)
+            if counter is not None:
+                counter.inc(value, operation=summary.name)
+
+    def metrics(self) -> List[_Metric]:
+        return [value for value in vars(self).values() if isinstance(value, _Metric)] + list(self.messages.values())
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """Write the metrics to a file for the node_exporter textfile collector, atomically."""
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f:
+            f.write(self.render())
+        os.replace(temporary_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are too frequent to log
+        pass
+
+
+def start_metrics_server(metrics: CleanmailMetrics, port: int, address: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve the metrics on http://address:port/metrics from a daemon thread."""
+    server = ThreadingHTTPServer((address, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+_metrics: Optional[CleanmailMetrics] = None
+_metrics_server: Optional[ThreadingHTTPServer] = None
+_metrics_lock = threading.Lock()
+
+
+def enable_metrics(port: Optional[int] = None, address: str = "0.0.0.0", textfile: Optional[str] = None) -> CleanmailMetrics:
+    """
+    Start collecting the metrics of every MailAnalyzer in the process. Only the first
+    call has an effect, later calls (e.g. Streamlit reruns) return the same metrics.
+
+    Args:
+        port: Port to serve the metrics on, None for no HTTP endpoint
+        address: Address of the HTTP endpoint
+        textfile: Path of a file to rewrite with the metrics after every operation, None for no file
+    """
+    global _metrics, _metrics_server
+    with _metrics_lock:
+        if _metrics is not None:
+            return _metrics
+        metrics = CleanmailMetrics()
+        on_operation = metrics.record_operation
+        if textfile:
+            def on_operation(summary: OperationSummary) -> None:
+                metrics.record_operation(summary)
+                metrics.write_textfile(textfile)
+        add_global_hooks(on_command=metrics.record_command, on_operation=on_operation)
+        if port is not None:
+            try:
+                _metrics_server = start_metrics_server(metrics, port, address)
+                print(f"Serving metrics on http://{address}:{port}/metrics")
+            except OSError as e:
+                print(f"Warning: Could not serve metrics on {address}:{port}: {e}")
+        _metrics = metrics
+        return metrics
+
+
+def enable_metrics_from_env() -> Optional[CleanmailMetrics]:
+    """Call enable_metrics() if CLEANMAIL_METRICS_PORT or CLEANMAIL_METRICS_TEXTFILE is set."""
+    port = os.getenv("CLEANMAIL_METRICS_PORT")
+    textfile = os.getenv("CLEANMAIL_METRICS_TEXTFILE")
+    if not port and not textfile:
+        return None
+    return enable_metrics(
+        port=int(port) if port else None,
+        address=os.getenv("CLEANMAIL_METRICS_ADDRESS", "0.0.0.0"),
+        textfile=textfile,
+    )
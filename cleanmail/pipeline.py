@@ -0,0 +1,139 @@
+"""
+Pipelined execution of IMAP commands.
+
+imaplib sends a command and waits for its tagged response before the next one
+can be sent, so every command costs a full round trip. IMAP allows a client to
+send several commands without waiting (RFC 3501, section 5.5), and the server
+answers them in order. CommandPipeline sends independent commands back to back
+and collects their responses afterwards:
+
+    with CommandPipeline(mail) as pipeline:
+        commands = [pipeline.send("STATUS", quote_mailbox(name), "(MESSAGES)", untagged=["STATUS"]) for name in names]
+    for command in commands:
+        print(command.result, command.untagged["STATUS"])
+
+Over a link with 150 ms round trip time, 300 STATUS commands take well under a
+second instead of 45 seconds.
+
+Only pipeline commands that do not depend on each other's outcome, e.g. never a
+STORE \\Deleted behind the COPY that must succeed first. Commands are completed in
+the order they were sent, and the untagged responses received before a tagged
+response belong to that command, which is how they are attributed. A command
+with a synchronising literal first completes the commands before it, because
+imaplib reads responses while it waits for the continuation request.
+"""
+
+import imaplib
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+
+# Commands sent without waiting for their response. This bounds the data that can
+# pile up in the socket buffers, so neither side blocks on a full buffer.
+DEFAULT_WINDOW = 64
+
+
+@dataclass
+class PipelinedCommand:
+    """A command sent through a CommandPipeline, and its response once completed."""
+
+    name: str
+    args: Tuple[Any, ...]
+    # Types of untagged responses to collect for this command, e.g. ("STATUS",)
+    untagged_types: Tuple[str, ...] = ()
+    tag: Optional[bytes] = None
+    # OK, NO or BAD, None until the command is completed
+    result: Optional[str] = None
+    # Data of the tagged response, e.g. [b'COPY completed']
+    data: List[Any] = field(default_factory=list)
+    # The collected untagged responses by type
+    untagged: Dict[str, List[Any]] = field(default_factory=dict)
+    # Called with the command as soon as its response has been received
+    on_complete: Optional[Callable[["PipelinedCommand"], None]] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.result == "OK"
+
+
+class CommandPipeline:
+    """Sends IMAP commands on one connection without waiting for the previous responses."""
+
+    def __init__(self, mail: imaplib.IMAP4, window: int = DEFAULT_WINDOW):
+        """
+        Args:
+            mail: The connection to send the commands on
+            window: Maximum number of commands awaiting their response. When it is
+                reached, the oldest command is completed before the next is sent.
+        """
+        self.mail = mail
+        self.window = max(1, window)
+        self._pending: Deque[PipelinedCommand] = deque()
+
+    def send(
+        self, name: str, *args: Any, untagged: Sequence[str] = (),
+        on_complete: Optional[Callable[[PipelinedCommand], None]] = None,
+    ) -> PipelinedCommand:
+        """
+        Send a command without waiting for its response, e.g. send("UID", "COPY", "1:50", "Trash").
+
+        Args:
+            name: The command name as imaplib knows it ("UID" for UID commands)
+            args: The arguments, formatted for the command line
+            untagged: Types of untagged responses to collect for this command
+            on_complete: Called with the command once its response is received, e.g. to
+                report progress while later commands are still in flight
+
+        Raises:
+            imaplib.IMAP4.abort: If the connection fails
+        """
+        command = PipelinedCommand(name, args, tuple(untagged), on_complete=on_complete)
+        if not self._pending:
+            # Leftovers of earlier commands must not be attributed to this one
+            for typ in command.untagged_types:
+                self.mail.untagged_responses.pop(typ, None)
+        if self.mail.literal is not None or len(self._pending) >= self.window:
+            # imaplib reads responses while waiting for a continuation request, so
+            # a command with a literal may only be sent once nothing is pending
+            self._complete_pending(keep=0 if self.mail.literal is not None else self.window - 1)
+        command.tag = self.mail._command(name, *args)
+        self._pending.append(command)
+        return command
+
+    def flush(self) -> None:
+        """Wait for the responses of all pending commands."""
+        self._complete_pending(keep=0)
+
+    def _complete_pending(self, keep: int) -> None:
+        while len(self._pending) > keep:
+            self._complete(self._pending.popleft())
+
+    def _complete(self, command: PipelinedCommand) -> None:
+        try:
+            command.result, command.data = self.mail._command_complete(command.name, command.tag)
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as e:
+            # imaplib raises for BAD, the other commands of the pipeline are still answered
+            command.result, command.data = "BAD", [str(e).encode()]
+        for typ in command.untagged_types:
+            command.untagged[typ] = self.mail.untagged_responses.pop(typ, [])
+        if command.on_complete is not None:
+            command.on_complete(command)
+
+    def __enter__(self) -> "CommandPipeline":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.flush()
+            return
+        # Leave the connection without unanswered commands, or unusable if that fails
+        try:
+            self.flush()
+        except Exception:
+            try:
+                self.mail.shutdown()
+            except Exception:
+                pass
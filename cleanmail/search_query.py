@@ -0,0 +1,246 @@
+"""
+Builder for IMAP SEARCH criteria.
+
+Search criteria used to be assembled with f-strings, which is only safe as long
+as every value is free of quotes, backslashes and line breaks. SearchQuery keeps
+the values apart from the search keys and encodes each of them as a quoted string
+or, if that is not possible (8-bit text, line breaks), as an IMAP literal:
+
+    query = SearchQuery.any_of([SearchQuery.from_(sender) for sender in senders])
+    query &= SearchQuery.sent_before(date(2024, 1, 1))
+    mail.uid("SEARCH", query.prepare(mail))
+
+With LITERAL+ (RFC 7888) literals are sent inline in a single command. Without it,
+every literal needs a continuation request from the server, which prepare()
+hands to imaplib through the connection's literal hook.
+"""
+
+import imaplib
+from datetime import date
+from typing import Iterable, List, Optional, Union
+
+from cleanmail.uid_set import UidSet
+
+
+# Month names of IMAP dates, independent of the locale (strftime("%b") is not)
+_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+class _String:
+    """A string argument of a search key, e.g. the address of FROM."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: str):
+        if not isinstance(value, str):
+            raise TypeError(f"Search value must be a string, got {type(value).__name__}")
+        if "\x00" in value:
+            raise ValueError("Search value cannot contain NUL characters")
+        self.value = value
+
+
+class SearchQuery:
+    """
+    An IMAP SEARCH query. Queries are combined with & (all must match), | (OR)
+    and ~ (NOT), or with all_of() and any_of() for many queries at once.
+    """
+
+    __slots__ = ("_tokens", "_keys")
+
+    def __init__(self, *tokens: Union[str, _String, "SearchQuery"]):
+        """
+        Args:
+            tokens: Search key atoms (str, sent as is), string arguments, and nested
+                queries whose keys all have to match. Use the class methods instead.
+        """
+        self._tokens: List[Union[str, _String]] = []
+        self._keys = 0
+        for token in tokens:
+            if isinstance(token, SearchQuery):
+                self._tokens += token._tokens
+                self._keys += token._keys
+            else:
+                self._tokens.append(token)
+        if tokens and not any(isinstance(token, SearchQuery) for token in tokens):
+            self._keys = 1
+
+    @classmethod
+    def all(cls) -> "SearchQuery":
+        return cls("ALL")
+
+    @classmethod
+    def from_(cls, address: str) -> "SearchQuery":
+        """Messages whose From header contains address."""
+        return cls("FROM", _String(address))
+
+    @classmethod
+    def to(cls, address: str) -> "SearchQuery":
+        """Messages whose To header contains address."""
+        return cls("TO", _String(address))
+
+    @classmethod
+    def subject(cls, text: str) -> "SearchQuery":
+        """Messages whose Subject header contains text."""
+        return cls("SUBJECT", _String(text))
+
+    @classmethod
+    def header(cls, name: str, value: str) -> "SearchQuery":
+        """Messages with a header name that contains value (an empty value matches any message with the header)."""
+        return cls("HEADER", _String(name), _String(value))
+
+    @classmethod
+    def before(cls, day: date) -> "SearchQuery":
+        """Messages received (internal date) before day."""
+        return cls("BEFORE", cls._format_date(day))
+
+    @classmethod
+    def since(cls, day: date) -> "SearchQuery":
+        """Messages received (internal date) on or after day."""
+        return cls("SINCE", cls._format_date(day))
+
+    @classmethod
+    def sent_before(cls, day: date) -> "SearchQuery":
+        """Messages whose Date header is before day."""
+        return cls("SENTBEFORE", cls._format_date(day))
+
+    @classmethod
+    def sent_since(cls, day: date) -> "SearchQuery":
+        """Messages whose Date header is on or after day."""
+        return cls("SENTSINCE", cls._format_date(day))
+
+    @classmethod
+    def larger(cls, size: int) -> "SearchQuery":
+        """Messages larger than size bytes."""
+        if not isinstance(size, int) or size < 0:
+            raise ValueError(f"Size must be a non-negative integer, got {size!r}")
+        return cls("LARGER", str(size))
+
+    @classmethod
+    def uids(cls, uids: Union[UidSet, str]) -> "SearchQuery":
+        """Messages with the given UIDs, a UidSet or a sequence set such as "100:*"."""
+        sequence_set = uids.to_imap() if isinstance(uids, UidSet) else uids
+        if not sequence_set or any(char not in "0123456789:,*" for char in sequence_set):
+            raise ValueError(f"Invalid UID set: {sequence_set!r}")
+        return cls("UID", sequence_set)
+
+    @classmethod
+    def all_of(cls, queries: Iterable["SearchQuery"]) -> "SearchQuery":
+        """Messages that match all queries."""
+        queries = list(queries)
+        if not queries:
+            raise ValueError("all_of() needs at least one query")
+        return cls(*queries)
+
+    @classmethod
+    def any_of(cls, queries: Iterable["SearchQuery"]) -> "SearchQuery":
+        """
+        Messages that match any of the queries. The queries are combined in a balanced
+        tree of OR keys, which keeps the nesting shallow: servers limit the parser recursion depth.
+        """
+        queries = list(queries)
+        if not queries:
+            raise ValueError("any_of() needs at least one query")
+        if len(queries) == 1:
+            return queries[0]
+        middle = len(queries) // 2
+        return cls.any_of(queries[:middle]) | cls.any_of(queries[middle:])
+
+    def __and__(self, other: "SearchQuery") -> "SearchQuery":
+        return SearchQuery(self, other)
+
+    def __or__(self, other: "SearchQuery") -> "SearchQuery":
+        query = SearchQuery("OR")
+        query._tokens += self._grouped() + other._grouped()
+        return query
+
+    def __invert__(self) -> "SearchQuery":
+        query = SearchQuery("NOT")
+        query._tokens += self._grouped()
+        return query
+
+    def _grouped(self) -> List[Union[str, _String]]:
+        """The tokens as a single search key, in parentheses if there are several keys."""
+        if self._keys > 1:
+            return ["(", *self._tokens, ")"]
+        return list(self._tokens)
+
+    @staticmethod
+    def _format_date(day: date) -> str:
+        # IMAP date: D-MMM-YYYY (e.g., "1-Jan-2024")
+        return f"{day.day}-{_MONTHS[day.month - 1]}-{day.year}"
+
+    def compile(self, literal_plus: bool = False) -> List[bytes]:
+        """
+        Encode the query as search criteria.
+
+        Strings are sent as quoted strings when possible, and as literals when they
+        contain 8-bit characters or line breaks. Non-ASCII text adds CHARSET UTF-8.
+
+        Args:
+            literal_plus: Whether the server supports LITERAL+, so literals can be sent
+                without waiting for a continuation request.
+
+        Returns:
+            The criteria split at every synchronising literal: the first segment goes on
+            the command line, and every following segment is sent after the server's
+            continuation request. With literal_plus, this is always a single segment.
+        """
+        segments = [b""]
+        utf8 = False
+        previous = None
+        for token in self._tokens:
+            if previous is not None and previous != "(" and token != ")":
+                segments[-1] += b" "
+            previous = token
+            if isinstance(token, str):
+                segments[-1] += token.encode("ascii")
+                continue
+            value = token.value.encode("utf-8")
+            if not token.value.isascii():
+                utf8 = True
+            if all(0x20 <= byte < 0x7F for byte in value):
+                segments[-1] += b'"' + value.replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"'
+            elif literal_plus:
+                segments[-1] += b"{%d+}\r\n" % len(value) + value
+            else:
+                segments[-1] += b"{%d}" % len(value)
+                segments.append(value)
+        if utf8:
+            segments[0] = b"CHARSET UTF-8 " + segments[0]
+        return segments
+
+    def prepare(self, mail: imaplib.IMAP4) -> bytes:
+        """
+        Compile the query for a connection, to be passed as the criteria of the next
+        mail.search() or mail.uid("SEARCH", ...) call, which must follow immediately.
+
+        Args:
+            mail: The connection that will run the search
+
+        Returns:
+            The criteria for the command line. Synchronising literals that follow are
+            queued in mail.literal, imaplib sends them when the server asks for them.
+        """
+        segments = self.compile(literal_plus="LITERAL+" in mail.capabilities)
+        if len(segments) > 1:
+            mail.literal = _LiteralContinuation(segments[1:]).next_segment
+        return segments[0]
+
+    def __str__(self) -> str:
+        return self.compile(literal_plus=True)[0].decode("utf-8", errors="replace")
+
+    def __repr__(self) -> str:
+        return f"SearchQuery({str(self)!r})"
+
+
+class _LiteralContinuation:
+    """Feeds the segments after each synchronising literal to imaplib, one per continuation request."""
+
+    def __init__(self, segments: List[bytes]):
+        self._segments = list(segments)
+
+    def next_segment(self, continuation_response: Optional[bytes]) -> bytes:
+        # imaplib only accepts a bound method as literal generator
+        if not self._segments:
+            raise imaplib.IMAP4.abort(f"unexpected continuation request: {continuation_response!r}")
+        return self._segments.pop(0)
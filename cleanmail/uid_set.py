@@ -0,0 +1,186 @@
+"""
+Compact, range encoded set of message UIDs.
+
+SEARCH results are usually long runs of consecutive UIDs. Storing them as
+(start, end) ranges instead of one Python object per UID keeps even million
+message folders small, and serialises to short IMAP sequence sets such as
+"1:500,502,610:900", so a single command can cover many more messages.
+"""
+
+import re
+from array import array
+from bisect import bisect_right
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+
+# Conservative limit for the length of a serialised UID set, so the complete command
+# stays below the line length limits of common servers (RFC 7162 recommends 8192 octets)
+MAX_UID_SET_LENGTH = 7000
+
+_NUMBER_OR_RANGE = re.compile(rb"(\d+)(?::(\d+))?")
+
+
+class UidSet:
+    """A sorted set of UIDs, stored as inclusive (start, end) ranges in two unsigned int arrays."""
+
+    __slots__ = ("_starts", "_ends", "_length")
+
+    def __init__(self, uids: Iterable[int] = ()):
+        """
+        Args:
+            uids: The UIDs of the set, in any order. Duplicates are ignored.
+        """
+        self._starts = array("I")
+        self._ends = array("I")
+        self._length = 0
+        previous = None
+        for uid in sorted(set(uids)):
+            if previous is not None and uid == previous + 1:
+                self._ends[-1] = uid
+            else:
+                self._starts.append(uid)
+                self._ends.append(uid)
+            previous = uid
+            self._length += 1
+
+    @classmethod
+    def from_ranges(cls, ranges: Iterable[Tuple[int, int]]) -> "UidSet":
+        """Build a set from inclusive (start, end) ranges, in any order and possibly overlapping."""
+        uid_set = cls()
+        for start, end in sorted((min(start, end), max(start, end)) for start, end in ranges):
+            if uid_set._ends and start <= uid_set._ends[-1] + 1:
+                if end > uid_set._ends[-1]:
+                    uid_set._length += end - uid_set._ends[-1]
+                    uid_set._ends[-1] = end
+            else:
+                uid_set._starts.append(start)
+                uid_set._ends.append(end)
+                uid_set._length += end - start + 1
+        return uid_set
+
+    @classmethod
+    def parse(cls, data: Union[bytes, str, None]) -> "UidSet":
+        """
+        Parse a UID SEARCH response (b'1 2 3 7') or an IMAP sequence set (b'1:3,7').
+
+        Args:
+            data: The response data, e.g. messages[0] of mail.uid("SEARCH", ...).
+                None or empty data gives an empty set.
+        """
+        if not data:
+            return cls()
+        if isinstance(data, str):
+            data = data.encode()
+        ranges = []
+        for match in _NUMBER_OR_RANGE.finditer(data):
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else start
+            # Results are normally sorted: extend the current range in place
+            if ranges and ranges[-1][1] + 1 == start and end >= start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return cls.from_ranges(ranges)
+
+    def ranges(self) -> Iterator[Tuple[int, int]]:
+        """Iterate over the inclusive (start, end) ranges in ascending order."""
+        return zip(self._starts, self._ends)
+
+    def to_imap(self) -> str:
+        """Serialise as IMAP sequence set, e.g. "1:500,502,610:900"."""
+        return ",".join(
+            str(start) if start == end else f"{start}:{end}"
+            for start, end in self.ranges()
+        )
+
+    def chunks(self, max_count: Optional[int] = None, max_length: int = MAX_UID_SET_LENGTH) -> Iterator["UidSet"]:
+        """
+        Split the set into consecutive batches, in ascending UID order.
+
+        Args:
+            max_count: Maximum number of UIDs per batch (None for no limit)
+            max_length: Maximum length of the serialised sequence set of a batch
+        """
+        chunk = UidSet()
+        length = 0
+        for start, end in self.ranges():
+            while start <= end:
+                if max_count is not None and len(chunk) >= max_count:
+                    yield chunk
+                    chunk, length = UidSet(), 0
+                stop = end
+                if max_count is not None:
+                    stop = min(stop, start + max_count - len(chunk) - 1)
+                part = str(start) if start == stop else f"{start}:{stop}"
+                part_length = len(part) + (1 if length else 0)
+                if length and length + part_length > max_length:
+                    yield chunk
+                    chunk, length = UidSet(), 0
+                    continue
+                chunk._append_range(start, stop)
+                length += len(part) + (1 if length else 0)
+                start = stop + 1
+        if chunk:
+            yield chunk
+
+    def _append_range(self, start: int, end: int) -> None:
+        """Append a range that lies above all current UIDs."""
+        if self._ends and start == self._ends[-1] + 1:
+            self._ends[-1] = end
+        else:
+            self._starts.append(start)
+            self._ends.append(end)
+        self._length += end - start + 1
+
+    def first(self) -> Optional[int]:
+        """The lowest UID, or None for an empty set."""
+        return self._starts[0] if self._starts else None
+
+    def last(self) -> Optional[int]:
+        """The highest UID, or None for an empty set."""
+        return self._ends[-1] if self._ends else None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __iter__(self) -> Iterator[int]:
+        for start, end in self.ranges():
+            yield from range(start, end + 1)
+
+    def __contains__(self, uid: int) -> bool:
+        index = bisect_right(self._starts, uid) - 1
+        return index >= 0 and uid <= self._ends[index]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, UidSet):
+            return NotImplemented
+        return self._starts == other._starts and self._ends == other._ends
+
+    def __or__(self, other: "UidSet") -> "UidSet":
+        return UidSet.from_ranges([*self.ranges(), *other.ranges()])
+
+    def __sub__(self, other: "UidSet") -> "UidSet":
+        result: List[Tuple[int, int]] = []
+        other_ranges = list(other.ranges())
+        index = 0
+        for start, end in self.ranges():
+            # Skip the ranges of other that end before this range
+            while index < len(other_ranges) and other_ranges[index][1] < start:
+                index += 1
+            position = index
+            while start <= end:
+                if position >= len(other_ranges) or other_ranges[position][0] > end:
+                    result.append((start, end))
+                    break
+                other_start, other_end = other_ranges[position]
+                if other_start > start:
+                    result.append((start, other_start - 1))
+                start = max(start, other_end + 1)
+                position += 1
+        return UidSet.from_ranges(result)
+
+    def __repr__(self) -> str:
+        return f"UidSet('{self.to_imap()}')"
@@ -3,10 +3,42 @@ import os
 
 import streamlit as st
 from dotenv import load_dotenv
-from cleanmail import MailAnalyzer, EmailValidator, EmailValidationError
+from cleanmail import MailAnalyzer, EmailValidator, EmailValidationError, HeaderCache
+from cleanmail.metrics import enable_metrics_from_env
 from cleanmail.styling import apply_custom_styles
 
 
+@st.cache_resource
+def get_header_cache():
+    """Shared on-disk header cache, so repeated analyses only fetch new emails.
+    Set CLEANMAIL_HEADER_CACHE=0 to disable it."""
+    if os.getenv("CLEANMAIL_HEADER_CACHE", "1") == "0":
+        return None
+    return HeaderCache()
+
+
+def get_analyzer() -> MailAnalyzer:
+    """The MailAnalyzer of the session's credentials.
+    It is created once and kept in the session state, with its folder list and bin/archive
+    folders once they are looked up, so reruns do not log in and list the folders again. A change of credentials
+    creates a new one, invalidate_analyzer() forces that."""
+    credentials = (st.session_state.server, st.session_state.email_address, st.session_state.mail_password)
+    if st.session_state.get("analyzer") is None or st.session_state.get("analyzer_credentials") != credentials:
+        st.session_state.analyzer = MailAnalyzer(
+            st.session_state.email_address, st.session_state.mail_password, st.session_state.server,
+            header_cache=get_header_cache()
+        )
+        st.session_state.analyzer_credentials = credentials
+        st.session_state.trash_count = None
+    return st.session_state.analyzer
+
+
+def invalidate_analyzer():
+    """Drop the session's MailAnalyzer, e.g. to pick up new folders."""
+    st.session_state.analyzer = None
+    st.session_state.trash_count = None
+
+
 def analyze_emails_component(analyzer):
     max_batches = st.number_input(
         "Limit number of Batches to Analyze (500 emails per batch)",
@@ -16,6 +48,13 @@ def analyze_emails_component(analyzer):
         help="Optional: Limit the number of batches to analyze. Leave empty to analyze all emails.",
         key="max_batches_input"
     )
+    headers_only = st.checkbox(
+        "Quick analysis (headers only)",
+        value=True,
+        help="Only download the sender and unsubscribe headers instead of full emails. "
+             "Much faster, but unsubscribe links hidden in the email body are not detected.",
+        key="headers_only_checkbox"
+    )
     
     if st.button("Analyze Emails"):
         progress_bar = st.progress(0)
@@ -41,7 +80,8 @@ def analyze_emails_component(analyzer):
 
         st.session_state.email_data = analyzer.get_sender_statistics(
             progress_callback=update_progress,
-            max_batches=max_batches if max_batches else None
+            max_batches=max_batches if max_batches else None,
+            headers_only=headers_only
         )
 
         progress_bar.empty()
@@ -106,32 +146,36 @@ def sender_list_for_cleanup_component():
                 st.toast(
                     "This may take a while depending on the number of emails. Please be patient!"
                 )
-                analyzer = MailAnalyzer(
-                    st.session_state.email_address, st.session_state.mail_password, st.session_state.server
-                )
-                # TODO: move to bulk delete
+                analyzer = get_analyzer()
+                # Validate emails before deletion (additional safety check)
+                validated_senders = []
                 for sender in sender_ids_to_be_cleaned:
                     try:
-                        # Validate email before deletion (additional safety check)
-                        validated_sender = EmailValidator.validate_email_for_imap(sender)
-                        deleted_count = analyzer.delete_emails_from_sender(validated_sender)
-                        st.toast(f"Moved {deleted_count} emails from {sender} to the bin!")
+                        validated_senders.append(EmailValidator.validate_email_for_imap(sender))
                     except EmailValidationError as e:
                         st.error(f"Invalid email address '{sender}': {e}")
                         st.toast(f"Skipped invalid email address: {sender}")
                         print(f"Invalid email address '{sender}': {e}")
+                if not validated_senders:
+                    # Nothing to delete, keep the page (and the validation errors above) as is
+                    st.toast("No valid senders selected, nothing was deleted")
+                else:
+                    try:
+                        deleted_counts = analyzer.delete_emails_from_senders(validated_senders)
+                        for sender, deleted_count in deleted_counts.items():
+                            print(f"Moved {deleted_count} emails from {sender} to the bin")
+                        st.toast(f"Moved {sum(deleted_counts.values())} emails from {len(deleted_counts)} senders to the bin!")
                     except Exception as e:
-                        st.error(f"Error deleting emails from {sender}: {e}")
-                        print(f"Error deleting emails from {sender}: {e}")
-                        st.toast(f"Failed to delete emails from {sender}")
-                st.session_state.email_data = None
-                st.rerun()
+                        st.error(f"Error deleting emails: {e}")
+                        print(f"Error deleting emails from {', '.join(validated_senders)}: {e}")
+                        st.toast("Failed to delete emails")
+                    st.session_state.email_data = None
+                    st.session_state.trash_count = None
+                    st.rerun()
 
 
 def inbox_cleanup_component():
-    analyzer = MailAnalyzer(
-        st.session_state.email_address, st.session_state.mail_password, st.session_state.server
-    )
+    analyzer = get_analyzer()
     # Show "Analyze Emails" button only if sender_stats is not populated
     if st.session_state.email_data is None:
         st.markdown("""
@@ -157,19 +201,17 @@ def trash_bin_component():
         st.info("Please authenticate using your credentials in the sidebar to use this feature.")
         return
 
-    analyzer = MailAnalyzer(
-        st.session_state.email_address, st.session_state.mail_password, st.session_state.server
-    )
+    analyzer = get_analyzer()
 
-    # Get unquoted bin folder name for count_messages()
-    bin_folder_unquoted = analyzer.bin_folder.strip('"')
-    
-    # Get message count in trash bin
-    try:
-        trash_count = analyzer.count_messages(bin_folder_unquoted)
-    except Exception as e:
-        trash_count = 0
-        st.warning(f"Could not retrieve trash bin message count: {e}")
+    # Get message count in trash bin, only again after an action changed it
+    trash_count = st.session_state.get("trash_count")
+    if trash_count is None:
+        try:
+            trash_count = analyzer.count_messages(analyzer.bin_folder)
+            st.session_state.trash_count = trash_count
+        except Exception as e:
+            trash_count = 0
+            st.warning(f"Could not retrieve trash bin message count: {e}")
 
     st.markdown(f"""
     ### Trash Bin Management
@@ -198,6 +240,7 @@ def trash_bin_component():
                 )
             
             deleted_count = analyzer.empty_bin_folder(progress_callback=update_progress)
+            st.session_state.trash_count = None
             
             if deleted_count > 0:
                 st.success(f"Successfully deleted {deleted_count} emails from the trash bin!")
@@ -253,9 +296,7 @@ def folder_pruning_component():
         st.info("Please authenticate using your credentials in the sidebar to use this feature.")
         return
 
-    analyzer = MailAnalyzer(
-        st.session_state.email_address, st.session_state.mail_password, st.session_state.server
-    )
+    analyzer = get_analyzer()
 
     col1, col2 = st.columns([1,1])
     with col1:
@@ -269,6 +310,8 @@ def folder_pruning_component():
     with col2:
         # Get list of folders
         if st.button("🔄 Refresh Folder List", use_container_width=True):
+            # Start from a fresh folder list, folders may have been added elsewhere
+            analyzer.invalidate_folders()
             load_folders(analyzer)
             st.rerun()
         prune_action = st.selectbox(
@@ -277,7 +320,12 @@ def folder_pruning_component():
             key="prune_action_selectbox"
         )
         st.session_state.prune_action = prune_action
-        st.write(f'Pruning emails will be moved to: {analyzer.bin_folder if prune_action == "Delete" else analyzer.archive_folder}')
+        if prune_action == "Delete":
+            st.write(f'Pruning emails will be moved to: {analyzer.bin_folder}')
+        elif analyzer.archive_folder is None:
+            st.warning("No Archive folder found on this account, pruned emails can only be deleted.")
+        else:
+            st.write(f'Pruning emails will be moved to: {analyzer.archive_folder}')
     
     # Initialize folders in session state if not present
     if 'folders' not in st.session_state:
@@ -309,9 +357,9 @@ def folder_pruning_component():
     
     # Create table rows with dropdowns and buttons in the same row
     for idx, folder in enumerate(folders):
-            if folder['printable_name'] == analyzer.archive_folder and st.session_state.prune_action == "Move to Archive":
+            if folder['raw_name'] == analyzer.archive_folder and st.session_state.prune_action == "Move to Archive":
                 continue
-            if folder['printable_name'] == analyzer.bin_folder:
+            if folder['raw_name'] == analyzer.bin_folder:
                 continue
 
             folder_name = folder['printable_name']
@@ -383,6 +431,7 @@ def prune_folder_fragment(analyzer: MailAnalyzer, folder_raw_name: str, folder_d
                     action=action,
                     progress_callback=update_progress
                 )
+                st.session_state.trash_count = None
                 
                 if processed_count > 0:
                     st.success(f"Successfully {action_past_verb} {processed_count} emails older than {days} days from '{folder_display_name}'!")
@@ -436,15 +485,14 @@ def sidebar_component():
                     st.session_state.email_address = email_input
                     st.session_state.mail_password = password_input
                     
-                    analyzer = MailAnalyzer(
-                        email_input, password_input, server_input
-                    )
-                    test_conn = analyzer.connect()
-                    if test_conn:
-                        test_conn.logout()
-                        st.success("Successfully connected to Gmail!")
-                        st.session_state.email_data = None
-                        st.rerun()
+                    # Log in with the new credentials, which tests them
+                    invalidate_analyzer()
+                    analyzer = get_analyzer()
+                    with analyzer.instrumentation.operation("connect"), analyzer.connection_pool.connection():
+                        pass
+                    st.success("Successfully connected to Gmail!")
+                    st.session_state.email_data = None
+                    st.rerun()
             
             # Handle Save button
             if save_clicked:
@@ -487,6 +535,9 @@ def main():
     
     # Load defaults from .env file if it exists
     load_dotenv()
+
+    # Prometheus metrics, if CLEANMAIL_METRICS_PORT or CLEANMAIL_METRICS_TEXTFILE is set (started once per process)
+    enable_metrics_from_env()
     
     # Use session state to store email credentials and sender stats
     # Load defaults from .env file, falling back to None if not set
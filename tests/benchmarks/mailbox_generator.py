@@ -0,0 +1,177 @@
+"""
+Reproducible synthetic mailboxes for benchmarks.
+
+generate_mailbox() fills a FakeIMAPServer with a mailbox that looks like a real,
+cluttered one: a few senders account for most of the messages (Zipf distribution),
+many of them are newsletters with an unsubscribe link in the List-Unsubscribe header
+or in their HTML body, some messages carry attachments, and part of the mail is
+filed in a tree of folders. The same profile and seed always give the same mailbox
+(dates are relative to the generation time).
+
+Every message is kept in memory by the fake server: a million messages with the
+default profile need a few GB of RAM.
+"""
+
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Dict, List, Optional
+
+from fake_imap_server import FakeIMAPServer, build_message
+
+
+@dataclass
+class MailboxProfile:
+    """Shape of a generated mailbox."""
+
+    # Number of messages in INBOX and the other folders, Trash not included
+    messages: int = 10_000
+    senders: int = 500
+    # Exponent of the Zipf distribution of messages over senders (higher is more skewed)
+    zipf_exponent: float = 1.1
+    # Share of the senders that are newsletters, and share of those with an HTML body
+    newsletter_share: float = 0.4
+    html_share: float = 0.5
+    # Share of the messages with an attachment, and the median attachment size in bytes
+    attachment_share: float = 0.05
+    attachment_size: int = 32 * 1024
+    # Messages are dated up to this many days back
+    max_age_days: int = 5 * 365
+    # Number of folders besides INBOX, Trash and Archive, nested up to folder_depth levels
+    folders: int = 20
+    folder_depth: int = 3
+    # Share of the messages filed in those folders instead of INBOX
+    folder_share: float = 0.3
+    trash_messages: int = 1_000
+    seed: int = 0
+
+
+@dataclass
+class GeneratedMailbox:
+    """What generate_mailbox() created, to check benchmark results against."""
+
+    profile: MailboxProfile
+    # INBOX messages per sender address, most frequent sender first
+    inbox_counts: Dict[str, int] = field(default_factory=dict)
+    folders: List[str] = field(default_factory=list)
+    # INBOX messages sent before the (local) day 365 days ago, what SENTBEFORE matches
+    inbox_older_than_year: int = 0
+    trash_messages: int = 0
+    total_bytes: int = 0
+
+    @property
+    def top_sender(self) -> str:
+        return next(iter(self.inbox_counts))
+
+
+def generate_mailbox(
+    server: FakeIMAPServer, profile: Optional[MailboxProfile] = None, now: Optional[datetime] = None
+) -> GeneratedMailbox:
+    """
+    Fill a fake server with a synthetic mailbox.
+
+    Args:
+        server: The server to add the folders and messages to
+        profile: The shape of the mailbox, defaults to MailboxProfile()
+        now: Reference time for the message dates, defaults to the current time
+
+    Returns:
+        A summary of the generated mailbox
+    """
+    profile = profile or MailboxProfile()
+    now = now or datetime.now(timezone.utc)
+    rng = random.Random(profile.seed)
+    result = GeneratedMailbox(profile)
+
+    senders = [_make_sender(rng, rank, profile) for rank in range(1, profile.senders + 1)]
+    cumulative_weights = list(accumulate(1 / rank ** profile.zipf_exponent for rank in range(1, profile.senders + 1)))
+
+    result.folders = _make_folder_tree(rng, profile.folders, profile.folder_depth)
+    for folder in result.folders:
+        server.add_mailbox(folder)
+
+    inbox_counts: Dict[str, int] = {}
+    year_ago = (now.astimezone() - timedelta(days=365)).date()
+    for number, sender in enumerate(rng.choices(senders, cum_weights=cumulative_weights, k=profile.messages)):
+        date = now - timedelta(seconds=rng.uniform(0, profile.max_age_days * 86400))
+        raw = _make_message(rng, number, sender, date, profile)
+        folder = "INBOX"
+        if result.folders and rng.random() < profile.folder_share:
+            folder = rng.choice(result.folders)
+        flags = ["\\Seen"] if rng.random() < 0.7 else []
+        server.add_message(folder, raw, flags=flags, internal_date=date)
+        result.total_bytes += len(raw)
+        if folder == "INBOX":
+            inbox_counts[sender["address"]] = inbox_counts.get(sender["address"], 0) + 1
+            if date.date() < year_ago:
+                result.inbox_older_than_year += 1
+
+    for number in range(profile.trash_messages):
+        sender = rng.choice(senders)
+        date = now - timedelta(seconds=rng.uniform(0, 90 * 86400))
+        raw = _make_message(rng, profile.messages + number, sender, date, profile)
+        server.add_message("Trash", raw, flags=["\\Seen"], internal_date=date)
+        result.total_bytes += len(raw)
+    result.trash_messages = profile.trash_messages
+
+    result.inbox_counts = dict(sorted(inbox_counts.items(), key=lambda item: item[1], reverse=True))
+    return result
+
+
+def _make_sender(rng: random.Random, rank: int, profile: MailboxProfile) -> dict:
+    newsletter = rng.random() < profile.newsletter_share
+    domain = f"{'news' if newsletter else 'mail'}{rank}.example"
+    return {
+        "address": f"{'newsletter' if newsletter else 'person'}{rank}@{domain}",
+        "name": f"{'Newsletter' if newsletter else 'Person'} {rank}",
+        "domain": domain,
+        "newsletter": newsletter,
+        "html": newsletter and rng.random() < profile.html_share,
+    }
+
+
+def _make_folder_tree(rng: random.Random, count: int, max_depth: int) -> List[str]:
+    """Folder names like "Projects 2/Folder 5/Folder 7", parents listed before their children."""
+    folders: List[str] = []
+    for number in range(1, count + 1):
+        parents = [folder for folder in folders if folder.count("/") < max_depth - 1]
+        if parents and rng.random() < 0.6:
+            folders.append(f"{rng.choice(parents)}/Folder {number}")
+        else:
+            folders.append(f"Projects {number}")
+    return folders
+
+
+def _make_message(rng: random.Random, number: int, sender: dict, date: datetime, profile: MailboxProfile) -> bytes:
+    headers = {}
+    if sender["newsletter"]:
+        subject = f"{sender['name']} issue {number}"
+        if sender["html"]:
+            paragraphs = "".join(f"<p>Article {index} of issue {number}.</p>" for index in range(rng.randint(3, 30)))
+            body = (
+                f"<html><body><h1>{subject}</h1>{paragraphs}"
+                f'<a href="https://{sender["domain"]}/unsubscribe?id={number}">Unsubscribe</a></body></html>'
+            )
+        else:
+            headers["List-Unsubscribe"] = f"<https://{sender['domain']}/unsubscribe>, <mailto:unsubscribe@{sender['domain']}>"
+            headers["List-Unsubscribe-Post"] = "List-Unsubscribe=One-Click"
+            body = f"{subject}\n\n" + "Lorem ipsum dolor sit amet. " * rng.randint(5, 100)
+    else:
+        subject = f"Message {number}"
+        body = "Hi,\n\n" + "Lorem ipsum dolor sit amet. " * rng.randint(1, 40) + f"\n\n{sender['name']}"
+
+    attachments = []
+    if rng.random() < profile.attachment_share:
+        size = int(rng.lognormvariate(0, 1) * profile.attachment_size)
+        attachments.append((f"attachment-{number}.bin", rng.randbytes(size)))
+
+    return build_message(
+        f"{sender['name']} <{sender['address']}>",
+        subject=subject,
+        date=date,
+        body=body,
+        html=sender["html"],
+        headers=headers,
+        attachments=attachments,
+    )
@@ -0,0 +1,181 @@
+"""
+TCP proxy that shapes traffic like a slow network link.
+
+Hosted IMAP providers are typically 80-200 ms away, a localhost benchmark hides
+every cost that comes from round trips. NetworkShapingProxy sits between the
+client and the fake server and delays the data in each direction:
+
+    with FakeIMAPServer() as server, NetworkShapingProxy(server.host, server.port, rtt=0.1) as proxy:
+        analyzer = MailAnalyzer(..., proxy.host, mail_port=proxy.port, use_ssl=False)
+
+Every chunk of data is delivered half the round trip time (plus jitter) after it
+was received, and no sooner than the bandwidth allows. Delays are applied per
+chunk, not per request: data the client sends without waiting for an answer
+(pipelined commands, LITERAL+) pays the latency only once, just like on a real link.
+"""
+
+import random
+import socket
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class NetworkShapingProxy:
+    """Forwards TCP connections to a target, adding latency, jitter and a bandwidth limit."""
+
+    def __init__(
+        self,
+        target_host: str,
+        target_port: int,
+        rtt: float = 0.1,
+        jitter: float = 0.0,
+        bandwidth: Optional[float] = None,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            target_host: Host of the server to forward to
+            target_port: Port of the server to forward to
+            rtt: Round trip time in seconds, half of it is added in each direction
+            jitter: Maximum extra delay (seconds) per chunk, drawn uniformly. Data is
+                never reordered, a chunk waits for the chunks before it.
+            bandwidth: Link capacity in bytes per second in each direction, None for no limit
+            seed: Seed of the jitter, so runs are reproducible
+        """
+        self.target = (target_host, target_port)
+        self.rtt = rtt
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._listener = socket.create_server(("127.0.0.1", 0))
+        self._closed = threading.Event()
+        self._sockets: List[socket.socket] = []
+        self._sockets_lock = threading.Lock()
+        self.connections = 0
+        self.bytes_to_server = 0
+        self.bytes_to_client = 0
+
+    @property
+    def host(self) -> str:
+        return self._listener.getsockname()[0]
+
+    @property
+    def port(self) -> int:
+        return self._listener.getsockname()[1]
+
+    def start(self) -> "NetworkShapingProxy":
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._closed.set()
+        self._listener.close()
+        with self._sockets_lock:
+            for sock in self._sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                sock.close()
+            self._sockets.clear()
+
+    def __enter__(self) -> "NetworkShapingProxy":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _accept_loop(self) -> None:
+        while not self._closed.is_set():
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            try:
+                upstream = socket.create_connection(self.target)
+            except OSError:
+                client.close()
+                continue
+            for sock in (client, upstream):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._sockets_lock:
+                self._sockets += [client, upstream]
+                self.connections += 1
+            _Link(self, client, upstream, "bytes_to_server").start()
+            _Link(self, upstream, client, "bytes_to_client").start()
+
+    def _delay(self) -> float:
+        """The one-way delay of the next chunk."""
+        if not self.jitter:
+            return self.rtt / 2
+        with self._random_lock:
+            return self.rtt / 2 + self._random.uniform(0, self.jitter)
+
+
+class _Link:
+    """One direction of a proxied connection: a reader that schedules chunks and a writer that delivers them on time."""
+
+    def __init__(self, proxy: NetworkShapingProxy, source: socket.socket, destination: socket.socket, counter: str):
+        self.proxy = proxy
+        self.source = source
+        self.destination = destination
+        self.counter = counter
+        # (delivery time, data) in delivery order, data None marks the end of the stream
+        self.queue: deque = deque()
+        self.condition = threading.Condition()
+        # When the link has finished transmitting the previous chunk, for the bandwidth limit
+        self.link_free_at = 0.0
+        self.last_delivery = 0.0
+
+    def start(self) -> None:
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def _schedule(self, data: Optional[bytes]) -> None:
+        now = time.monotonic()
+        sent_at = now
+        if data and self.proxy.bandwidth:
+            self.link_free_at = max(self.link_free_at, now) + len(data) / self.proxy.bandwidth
+            sent_at = self.link_free_at
+        # TCP delivers in order: a chunk never overtakes the one before it
+        self.last_delivery = max(self.last_delivery, sent_at + self.proxy._delay())
+        with self.condition:
+            self.queue.append((self.last_delivery, data))
+            self.condition.notify()
+
+    def _read(self) -> None:
+        while True:
+            try:
+                data = self.source.recv(_CHUNK_SIZE)
+            except OSError:
+                data = b""
+            if not data:
+                self._schedule(None)
+                return
+            with self.proxy._sockets_lock:
+                setattr(self.proxy, self.counter, getattr(self.proxy, self.counter) + len(data))
+            self._schedule(data)
+
+    def _write(self) -> None:
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                deliver_at, data = self.queue[0]
+                wait = deliver_at - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                self.queue.popleft()
+            try:
+                if data is None:
+                    self.destination.shutdown(socket.SHUT_WR)
+                    return
+                self.destination.sendall(data)
+            except OSError:
+                return
@@ -0,0 +1,294 @@
+"""
+Benchmarks of the MailAnalyzer hot paths against a synthetic mailbox.
+
+Every operation runs against the fake IMAP server (see fake_imap_server.py),
+once for a bare IMAP4rev1 server and once for a server with all supported
+extensions. With --rtt, --jitter or --bandwidth the client connects through a
+NetworkShapingProxy (see network_proxy.py), so round trips cost what they cost
+on a real network. For each operation the wall clock time, the number of round
+trips (commands plus continuation requests, pipelined commands share the round
+trip of the command before them), the commands by name, the number of
+new connections, the bytes sent and received, and the split of the time between
+IMAP commands and client side processing (see cleanmail.instrumentation) are
+recorded and written to a JSON file. Pass the file of a previous run as --baseline
+to compare against it.
+
+Usage:
+
+    uv run python tests/benchmarks/run_benchmarks.py --messages 10000 --output benchmark.json
+    uv run python tests/benchmarks/run_benchmarks.py --rtt 120 --jitter 20 --bandwidth 20
+    uv run python tests/benchmarks/run_benchmarks.py --baseline benchmark.json --check
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import asdict
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+# Make the fake server and the cleanmail package importable when run as a script
+_TESTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _path in (_TESTS_DIR, os.path.dirname(_TESTS_DIR)):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+from benchmarks.mailbox_generator import GeneratedMailbox, MailboxProfile, generate_mailbox  # noqa: E402
+from benchmarks.network_proxy import NetworkShapingProxy  # noqa: E402
+from cleanmail import HeaderCache, MailAnalyzer  # noqa: E402
+from fake_imap_server import SUPPORTED_CAPABILITIES, FakeIMAPServer  # noqa: E402
+
+
+CAPABILITY_PROFILES = {
+    "minimal": ("IMAP4rev1",),
+    "modern": SUPPORTED_CAPABILITIES,
+}
+
+OPERATIONS = [
+    "connect",
+    "get_all_folders",
+    "get_sender_statistics",
+    "get_sender_statistics_cached",
+    "prone_emails_older_than",
+    "delete_emails_from_sender",
+    "empty_bin_folder",
+]
+
+
+def measure(server: FakeIMAPServer, operation: Callable[[], object]) -> dict:
+    """Run an operation and return its timing and the traffic it caused on the server."""
+    server.reset_counters()
+    start = time.perf_counter()
+    result = operation()
+    seconds = time.perf_counter() - start
+    with server.lock:
+        return {
+            "seconds": round(seconds, 4),
+            "round_trips": server.round_trips,
+            "commands": dict(Counter(server.commands)),
+            "connections": server.connections,
+            "bytes_sent": server.bytes_sent,
+            "bytes_received": server.bytes_received,
+            "result": _summarize(result),
+        }
+
+
+def _summarize(result):
+    if isinstance(result, (int, float, str)) or result is None:
+        return result
+    return len(result)
+
+
+def run_profile(
+    capabilities, profile: MailboxProfile, latency: float = 0.0, network: Optional[dict] = None, log=print
+) -> Dict[str, dict]:
+    """
+    Run all benchmark operations against a fresh server with the given capabilities.
+
+    Args:
+        capabilities: The capabilities the fake server advertises
+        profile: The mailbox to generate
+        latency: Server delay per tagged response in seconds
+        network: Arguments of the NetworkShapingProxy to connect through (rtt, jitter,
+            bandwidth), None to connect to the server directly
+
+    Returns:
+        The measurements of each operation, in the order of OPERATIONS
+    """
+    with ExitStack() as stack:
+        server = stack.enter_context(FakeIMAPServer(capabilities=capabilities))
+        host, port = server.host, server.port
+        if network:
+            proxy = stack.enter_context(NetworkShapingProxy(server.host, server.port, **network))
+            host, port = proxy.host, proxy.port
+        log(f"Generating {profile.messages} messages...")
+        mailbox = generate_mailbox(server, profile)
+        # Latency only applies to the measured operations
+        server.latency = latency
+        results: Dict[str, dict] = {}
+        analyzer: Optional[MailAnalyzer] = None
+
+        def make_analyzer():
+            nonlocal analyzer
+            analyzer = MailAnalyzer(
+                server.username,
+                server.password,
+                host,
+                header_cache=HeaderCache(":memory:"),
+                mail_port=port,
+                use_ssl=False,
+            )
+            # Construction is free, the first lookup logs in and lists the folders
+            analyzer.bin_folder
+
+        steps = {
+            "connect": make_analyzer,
+            "get_all_folders": lambda: analyzer.get_all_folders(),
+            "get_sender_statistics": lambda: analyzer.get_sender_statistics(headers_only=True),
+            "get_sender_statistics_cached": lambda: analyzer.get_sender_statistics(headers_only=True),
+            "prone_emails_older_than": lambda: analyzer.prone_emails_older_than("INBOX", 365, action="delete"),
+            "delete_emails_from_sender": lambda: analyzer.delete_emails_from_sender(mailbox.top_sender),
+            "empty_bin_folder": lambda: analyzer.empty_bin_folder(),
+        }
+        try:
+            for name in OPERATIONS:
+                results[name] = measure(server, steps[name])
+                # Split the time into waiting for the server and our own processing
+                summary = analyzer.instrumentation.last_operation
+                results[name]["pipelined"] = sum(record.pipelined for record in summary.commands)
+                results[name]["round_trips"] -= results[name]["pipelined"]
+                results[name]["imap_seconds"] = round(summary.imap_seconds, 4)
+                results[name]["client_seconds"] = round(summary.client_seconds, 4)
+                log(f"  {name}: {results[name]['seconds']:.3f}s, {results[name]['round_trips']} round trips")
+        finally:
+            if analyzer is not None:
+                analyzer.connection_pool.close()
+        _check_results(mailbox, results)
+    return results
+
+
+def _check_results(mailbox: GeneratedMailbox, results: Dict[str, dict]) -> None:
+    """Make sure the operations did what they should, a fast but wrong result is no improvement."""
+    statistics = results["get_sender_statistics"]["result"]
+    expected = {
+        "get_sender_statistics": len(mailbox.inbox_counts),
+        "get_sender_statistics_cached": statistics,
+        "prone_emails_older_than": mailbox.inbox_older_than_year,
+        # The bin holds its own messages plus everything the prune and the delete moved there
+        "empty_bin_folder": (
+            mailbox.trash_messages
+            + results["prone_emails_older_than"]["result"]
+            + results["delete_emails_from_sender"]["result"]
+        ),
+    }
+    for name, count in expected.items():
+        if results[name]["result"] != count:
+            raise AssertionError(f"{name} returned {results[name]['result']}, expected {count}")
+
+
+def run_benchmarks(
+    profile: MailboxProfile,
+    capability_profiles: List[str],
+    latency: float = 0.0,
+    network: Optional[dict] = None,
+    log=print,
+) -> dict:
+    """Run the benchmarks for each capability profile and return the report that is written to JSON."""
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": latency,
+        "network": network,
+        "mailbox": asdict(profile),
+        "results": {},
+    }
+    for name in capability_profiles:
+        log(f"Capability profile {name}")
+        report["results"][name] = run_profile(CAPABILITY_PROFILES[name], profile, latency, network, log)
+    return report
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=_TESTS_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Print the change of every measurement against a baseline report.
+
+    Args:
+        report: The current report
+        baseline: A report of an earlier run
+        tolerance: Relative slowdown that is still accepted (0.2 = 20%)
+
+    Returns:
+        Descriptions of the regressions: more round trips, or a slowdown beyond the tolerance
+    """
+    regressions = []
+    if any(report[key] != baseline.get(key) for key in ("mailbox", "latency", "network")):
+        print("Warning: the baseline was run with a different mailbox, latency or network")
+    print(f"{'profile':<9} {'operation':<30} {'seconds':>18} {'round trips':>18}")
+    for profile, operations in report["results"].items():
+        for name, current in operations.items():
+            previous = baseline.get("results", {}).get(profile, {}).get(name)
+            if previous is None:
+                continue
+            print(
+                f"{profile:<9} {name:<30} "
+                f"{previous['seconds']:>8.3f} -> {current['seconds']:<7.3f} "
+                f"{previous['round_trips']:>8} -> {current['round_trips']:<7}"
+            )
+            if current["round_trips"] > previous["round_trips"]:
+                regressions.append(f"{profile} {name}: {previous['round_trips']} -> {current['round_trips']} round trips")
+            if current["seconds"] > previous["seconds"] * (1 + tolerance) and current["seconds"] - previous["seconds"] > 0.05:
+                regressions.append(f"{profile} {name}: {previous['seconds']:.3f}s -> {current['seconds']:.3f}s")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", type=int, default=10_000, help="Number of messages (default: 10000)")
+    parser.add_argument("--senders", type=int, help="Number of senders (default: messages / 20)")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of the sender distribution")
+    parser.add_argument("--folders", type=int, default=20, help="Number of extra folders")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the mailbox generator")
+    parser.add_argument("--latency", type=float, default=0.0, help="Server delay per response in seconds")
+    parser.add_argument("--rtt", type=float, default=0.0, help="Network round trip time in milliseconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Maximum extra network delay in milliseconds")
+    parser.add_argument("--bandwidth", type=float, help="Network bandwidth in Mbit/s (default: unlimited)")
+    parser.add_argument(
+        "--profile", action="append", choices=sorted(CAPABILITY_PROFILES), dest="profiles",
+        help="Server capability profile to run, can be repeated (default: all)",
+    )
+    parser.add_argument("--output", default="benchmark-results.json", help="JSON file for the results")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Accepted relative slowdown against the baseline")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 on regressions against the baseline")
+    args = parser.parse_args(argv)
+
+    profile = MailboxProfile(
+        messages=args.messages,
+        senders=args.senders or max(1, args.messages // 20),
+        zipf_exponent=args.zipf,
+        folders=args.folders,
+        trash_messages=args.messages // 10,
+        seed=args.seed,
+    )
+    network = None
+    if args.rtt or args.jitter or args.bandwidth:
+        network = {
+            "rtt": args.rtt / 1000,
+            "jitter": args.jitter / 1000,
+            "bandwidth": args.bandwidth * 125_000 if args.bandwidth else None,
+        }
+    report = run_benchmarks(profile, args.profiles or list(CAPABILITY_PROFILES), args.latency, network)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions and args.check:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""
+Pytest fixtures around the in-process fake IMAP server (see fake_imap_server.py).
+
+The analyzer and seeded_imap_server fixtures run every test that uses them twice:
+against a bare IMAP4rev1 server, and against a server with all extensions
+MailAnalyzer takes advantage of.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from cleanmail import MailAnalyzer
+from fake_imap_server import FakeIMAPServer, build_message
+
+
+MINIMAL_CAPABILITIES = ("IMAP4rev1",)
+MODERN_CAPABILITIES = (
+    "IMAP4rev1", "UIDPLUS", "UNSELECT", "MOVE", "ESEARCH", "LIST-STATUS", "STATUS=SIZE", "LITERAL+", "SPECIAL-USE",
+    "ENABLE", "CONDSTORE", "QRESYNC",
+)
+
+# Contents of the seeded mailbox: sender -> number of INBOX messages
+SEED_NEWSLETTER = "Shop <newsletter@shop.example>"
+SEED_HTML_NEWSLETTER = "The Paper <news@paper.example>"
+SEED_FRIEND = "A Friend <friend@example.com>"
+SEED_OLD_SENDER = "Old News <old@archive.example>"
+SEED_COUNTS = {
+    "newsletter@shop.example": 30,
+    "news@paper.example": 20,
+    "friend@example.com": 5,
+    "old@archive.example": 10,
+}
+SEED_TRASH_COUNT = 15
+
+
+def seed_mailbox(server: FakeIMAPServer) -> None:
+    """Fill a fake server with a small, deterministic mailbox (see SEED_COUNTS)."""
+    now = datetime.now(timezone.utc)
+    for number in range(SEED_COUNTS["newsletter@shop.example"]):
+        server.add_message("INBOX", build_message(
+            SEED_NEWSLETTER,
+            subject=f"Deals of week {number}",
+            date=now - timedelta(days=number),
+            headers={
+                "List-Unsubscribe": "<https://shop.example/unsubscribe>, <mailto:unsubscribe@shop.example>",
+                "List-Unsubscribe-Post": "List-Unsubscribe=One-Click",
+            },
+        ))
+    for number in range(SEED_COUNTS["news@paper.example"]):
+        server.add_message("INBOX", build_message(
+            SEED_HTML_NEWSLETTER,
+            subject=f"Daily news {number}",
+            date=now - timedelta(days=number),
+            body=f'<html><body><p>News {number}</p><a href="https://paper.example/unsubscribe?id=7">Unsubscribe</a></body></html>',
+            html=True,
+        ))
+    for number in range(SEED_COUNTS["friend@example.com"]):
+        server.add_message("INBOX", build_message(SEED_FRIEND, subject=f"Dinner {number}", date=now - timedelta(days=number)))
+    for number in range(SEED_COUNTS["old@archive.example"]):
+        server.add_message("INBOX", build_message(
+            SEED_OLD_SENDER, subject=f"From the archive {number}", date=datetime(2020, 1, 1 + number, tzinfo=timezone.utc),
+        ))
+    for number in range(SEED_TRASH_COUNT):
+        server.add_message("Trash", build_message(SEED_FRIEND, subject=f"Deleted {number}", date=now))
+    server.add_mailbox("Projects")
+    server.add_message("Projects", build_message(SEED_FRIEND, subject="Plans", date=now), flags=["\\Seen"])
+
+
+@pytest.fixture
+def make_imap_server():
+    """Factory for started fake servers, all stopped at the end of the test."""
+    servers = []
+
+    def make(**kwargs) -> FakeIMAPServer:
+        server = FakeIMAPServer(**kwargs).start()
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def make_analyzer():
+    """Factory for MailAnalyzers connected to a fake server, their pools are closed at the end of the test."""
+    analyzers = []
+
+    def make(server: FakeIMAPServer, **kwargs) -> MailAnalyzer:
+        analyzer = MailAnalyzer(
+            server.username, server.password, server.host, mail_port=server.port, use_ssl=False, **kwargs
+        )
+        analyzers.append(analyzer)
+        return analyzer
+
+    yield make
+    for analyzer in analyzers:
+        analyzer.connection_pool.close()
+
+
+@pytest.fixture(params=[MINIMAL_CAPABILITIES, MODERN_CAPABILITIES], ids=["minimal", "modern"])
+def imap_server(request, make_imap_server) -> FakeIMAPServer:
+    return make_imap_server(capabilities=request.param)
+
+
+@pytest.fixture
+def seeded_imap_server(imap_server) -> FakeIMAPServer:
+    seed_mailbox(imap_server)
+    return imap_server
+
+
+@pytest.fixture
+def analyzer(seeded_imap_server, make_analyzer) -> MailAnalyzer:
+    """A MailAnalyzer for the seeded fake server."""
+    return make_analyzer(seeded_imap_server)
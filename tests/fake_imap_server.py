@@ -0,0 +1,952 @@
+"""
+In-process fake IMAP server for tests and benchmarks.
+
+Implements the part of IMAP4rev1 that MailAnalyzer uses: LOGIN, LIST, STATUS,
+SELECT/EXAMINE, UID SEARCH/FETCH/COPY/STORE/MOVE/EXPUNGE, STORE, EXPUNGE, CLOSE,
+UNSELECT and ENABLE, plus the extensions listed in SUPPORTED_CAPABILITIES. Which
+extensions are advertised is configurable, so tests can cover the fallback paths
+of servers without them.
+
+Every mailbox keeps mod-sequences (RFC 7162): appending, flagging and expunging a
+message raise its HIGHESTMODSEQ, and expunged UIDs are remembered, so a client
+can resync with SELECT (QRESYNC (uidvalidity modseq)) after ENABLE QRESYNC.
+
+The server counts the commands it receives and the bytes it sends and receives,
+and can add a fixed latency to every response, so tests and benchmarks can check
+how chatty a code path is. TLS is optional (pass an ssl_context).
+
+Usage:
+
+    with FakeIMAPServer() as server:
+        server.add_message("INBOX", b"From: a@example.com\\r\\n\\r\\nHello")
+        analyzer = MailAnalyzer(server.username, server.password, server.host,
+                                mail_port=server.port, use_ssl=False)
+"""
+
+import base64
+import hashlib
+import re
+import socket
+import socketserver
+import ssl
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+DEFAULT_CAPABILITIES = ("IMAP4rev1", "UIDPLUS", "UNSELECT")
+
+# Everything the fake server implements, besides IMAP4rev1 itself
+SUPPORTED_CAPABILITIES = (
+    "IMAP4rev1", "UIDPLUS", "UNSELECT", "MOVE", "ESEARCH", "LIST-STATUS", "STATUS=SIZE", "LITERAL+", "SPECIAL-USE",
+    "ENABLE", "CONDSTORE", "QRESYNC",
+)
+
+_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def build_message(
+    sender: str,
+    subject: str = "Hello",
+    date: Optional[datetime] = None,
+    body: str = "Hello!",
+    html: bool = False,
+    headers: Optional[Dict[str, str]] = None,
+    attachments: Iterable[Tuple[str, bytes]] = (),
+) -> bytes:
+    """
+    Build a simple RFC 5322 message.
+
+    Args:
+        sender: The From header, e.g. "Shop <news@shop.example>"
+        subject: The Subject header
+        date: The Date header, defaults to now
+        body: The message body
+        html: Whether the body is HTML (text/html) instead of plain text
+        headers: Extra headers, e.g. {"List-Unsubscribe": "<https://...>"}
+        attachments: (file name, content) pairs, attached base64 encoded in a multipart/mixed message
+    """
+    date = date or datetime.now(timezone.utc)
+    attachments = list(attachments)
+    lines = [
+        f"From: {sender}",
+        "To: user@example.com",
+        f"Subject: {subject}",
+        f"Date: {format_datetime(date)}",
+        f"Message-ID: <{hashlib.sha1(repr((sender, subject, date, body)).encode()).hexdigest()[:20]}@example.com>",
+        "MIME-Version: 1.0",
+    ]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    content_type = f"Content-Type: text/{'html' if html else 'plain'}; charset=utf-8"
+    body = body.replace("\n", "\r\n") + "\r\n"
+    if not attachments:
+        return ("\r\n".join([*lines, content_type]) + "\r\n\r\n" + body).encode()
+    boundary = "=_boundary_" + hashlib.sha1(body.encode()).hexdigest()[:16]
+    parts = [f"--{boundary}\r\n{content_type}\r\n\r\n{body}".encode()]
+    for filename, content in attachments:
+        parts.append(
+            f"--{boundary}\r\nContent-Type: application/octet-stream; name=\"{filename}\"\r\n"
+            f"Content-Disposition: attachment; filename=\"{filename}\"\r\n"
+            "Content-Transfer-Encoding: base64\r\n\r\n".encode()
+            + base64.encodebytes(content).replace(b"\n", b"\r\n")
+        )
+    header = "\r\n".join([*lines, f'Content-Type: multipart/mixed; boundary="{boundary}"']) + "\r\n\r\n"
+    return header.encode() + b"".join(parts) + f"--{boundary}--\r\n".encode()
+
+
+class FakeMessage:
+    def __init__(self, uid: int, raw: bytes, flags: Iterable[str] = (), internal_date: Optional[datetime] = None):
+        self.uid = uid
+        self.raw = raw
+        self.flags = set(flags)
+        # Mod-sequence of the last change (RFC 7162), set by the mailbox
+        self.modseq = 0
+        self.headers = message_from_bytes(raw.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n")
+        if internal_date is None:
+            internal_date = _parse_date_header(self.headers.get("Date")) or datetime.now(timezone.utc)
+        self.internal_date = internal_date
+
+
+class FakeMailbox:
+    def __init__(self, name: str, attributes: Iterable[str] = (), uidvalidity: int = 1):
+        self.name = name
+        self.attributes = list(attributes)
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages: List[FakeMessage] = []
+        self.highestmodseq = 1
+        # (UID, mod-sequence of the expunge) of every expunged message, for VANISHED (EARLIER)
+        self.expunged: List[Tuple[int, int]] = []
+
+    def append(self, raw: bytes, flags: Iterable[str] = (), internal_date: Optional[datetime] = None) -> FakeMessage:
+        message = FakeMessage(self.uidnext, raw, flags, internal_date)
+        message.modseq = self.next_modseq()
+        self.uidnext += 1
+        self.messages.append(message)
+        return message
+
+    def next_modseq(self) -> int:
+        """Raise and return the HIGHESTMODSEQ, for a change of the mailbox."""
+        self.highestmodseq += 1
+        return self.highestmodseq
+
+    def expunge(self, uids: Iterable[int]) -> List[Tuple[int, int]]:
+        """
+        Remove the messages with the given UIDs.
+
+        Returns:
+            (sequence number, UID) of each removed message, in ascending order, with the
+            sequence number an EXPUNGE response has to report when sent in this order
+        """
+        uids = set(uids)
+        kept, removed = [], []
+        for message in self.messages:
+            if message.uid in uids:
+                # Sequence numbers shift down with every expunged message
+                removed.append((len(kept) + 1, message.uid))
+                self.expunged.append((message.uid, self.next_modseq()))
+            else:
+                kept.append(message)
+        self.messages = kept
+        return removed
+
+    def reset_uidvalidity(self, uidvalidity: int) -> None:
+        """Assign a new UIDVALIDITY and renumber the messages, as servers do when they rebuild a mailbox index."""
+        self.uidvalidity = uidvalidity
+        self.expunged = []
+        for uid, message in enumerate(self.messages, start=1):
+            message.uid = uid
+            message.modseq = self.next_modseq()
+        self.uidnext = len(self.messages) + 1
+
+    @property
+    def size(self) -> int:
+        return sum(len(message.raw) for message in self.messages)
+
+
+class FakeIMAPServer:
+    """A threaded fake IMAP server listening on localhost, with a single account."""
+
+    def __init__(
+        self,
+        capabilities: Iterable[str] = DEFAULT_CAPABILITIES,
+        username: str = "user@example.com",
+        password: str = "secret",
+        latency: float = 0.0,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ):
+        """
+        Args:
+            capabilities: The capabilities to advertise, a subset of SUPPORTED_CAPABILITIES
+            username: The account name to accept at LOGIN
+            password: The password to accept at LOGIN
+            latency: Delay (seconds) before every tagged response, to simulate a round trip
+            ssl_context: Server side SSL context for implicit TLS (IMAPS), None for plain text
+        """
+        self.capabilities = list(capabilities)
+        unsupported = set(self.capabilities) - set(SUPPORTED_CAPABILITIES)
+        if unsupported:
+            raise ValueError(f"Unsupported capabilities: {', '.join(sorted(unsupported))}")
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.mailboxes: Dict[str, FakeMailbox] = {}
+        self.lock = threading.RLock()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # Bytes sent in response to each command name, e.g. {"UID STORE": 120}
+        self.bytes_sent_by_command: Dict[str, int] = {}
+        self.commands: List[str] = []
+        # Continuation requests for synchronising literals, each costs the client a round trip
+        self.continuations = 0
+        self.connections = 0
+        for name, attributes in (("INBOX", ()), ("Trash", ("\\Trash",)), ("Archive", ("\\Archive",))):
+            self.add_mailbox(name, attributes)
+        self._server = _ThreadingServer(("127.0.0.1", 0), _Handler)
+        self._server.fake = self
+        self._server.ssl_context = ssl_context
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "FakeIMAPServer":
+        # A short poll interval keeps stop() fast
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeIMAPServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def add_mailbox(self, name: str, attributes: Iterable[str] = ()) -> FakeMailbox:
+        with self.lock:
+            mailbox = self.mailboxes.get(name)
+            if mailbox is None:
+                mailbox = self.mailboxes[name] = FakeMailbox(name, attributes)
+            return mailbox
+
+    def add_message(self, mailbox: str, raw: bytes, flags: Iterable[str] = (), internal_date: Optional[datetime] = None) -> int:
+        """Store a message and return its UID."""
+        with self.lock:
+            return self.add_mailbox(mailbox).append(raw, flags, internal_date).uid
+
+    @property
+    def round_trips(self) -> int:
+        """Commands received plus continuation requests sent, as the client waits for a response to each."""
+        with self.lock:
+            return len(self.commands) + self.continuations
+
+    def reset_counters(self) -> None:
+        with self.lock:
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.bytes_sent_by_command = {}
+            self.commands = []
+            self.continuations = 0
+            self.connections = 0
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True)
+        return sock, address
+
+
+class _ProtocolError(Exception):
+    """A malformed or unsupported command, answered with BAD."""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One client connection."""
+
+    # Commands allowed before LOGIN
+    UNAUTHENTICATED_COMMANDS = ("CAPABILITY", "NOOP", "LOGOUT", "LOGIN")
+
+    def setup(self) -> None:
+        # Responses are written line by line, do not let Nagle's algorithm delay them
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+        self.fake: FakeIMAPServer = self.server.fake
+        self.authenticated = False
+        self.selected: Optional[FakeMailbox] = None
+        self.readonly = False
+        # Extensions the client enabled for this session: ENABLE (RFC 5161), or CONDSTORE by use
+        self.enabled = set()
+        self.tag: Optional[str] = None
+        self.command: Optional[str] = None
+        with self.fake.lock:
+            self.fake.connections += 1
+
+    # --- I/O -----------------------------------------------------------------
+
+    def send(self, data: bytes) -> None:
+        with self.fake.lock:
+            self.fake.bytes_sent += len(data)
+            if self.command is not None:
+                by_command = self.fake.bytes_sent_by_command
+                by_command[self.command] = by_command.get(self.command, 0) + len(data)
+        self.wfile.write(data)
+
+    def untagged(self, line: str) -> None:
+        self.send(f"* {line}\r\n".encode())
+
+    def read_command(self) -> Optional[bytes]:
+        """Read a command line, including the literals embedded in it."""
+        data = b""
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            with self.fake.lock:
+                self.fake.bytes_received += len(line)
+            data += line
+            match = re.search(rb"\{(\d+)(\+?)\}\r\n$", line)
+            if not match:
+                return data.rstrip(b"\r\n")
+            if not match.group(2):
+                with self.fake.lock:
+                    self.fake.continuations += 1
+                self.send(b"+ Ready for literal data\r\n")
+            elif "LITERAL+" not in self.fake.capabilities:
+                raise _ProtocolError("Non-synchronizing literals are not supported")
+            literal = self.rfile.read(int(match.group(1)))
+            with self.fake.lock:
+                self.fake.bytes_received += len(literal)
+            data += literal
+
+    def handle(self) -> None:
+        self.untagged("OK Fake IMAP server ready")
+        while True:
+            try:
+                line = self.read_command()
+            except _ProtocolError as e:
+                self.untagged(f"BYE {e}")
+                return
+            except OSError:
+                return
+            if line is None:
+                return
+            try:
+                self.tag, command, arguments = self.parse_command(line)
+            except _ProtocolError as e:
+                self.untagged(f"BAD {e}")
+                continue
+            self.command = command
+            with self.fake.lock:
+                self.fake.commands.append(command)
+            handler = getattr(self, "do_" + command.replace(" ", "_"), None)
+            try:
+                if handler is None:
+                    raise _ProtocolError(f"Unknown command {command}")
+                if not self.authenticated and command not in self.UNAUTHENTICATED_COMMANDS:
+                    result = "NO Not authenticated"
+                else:
+                    with self.fake.lock:
+                        result = handler(arguments)
+            except _ProtocolError as e:
+                result = f"BAD {e}"
+            except (IndexError, ValueError) as e:
+                result = f"BAD Invalid arguments: {e}"
+            if self.fake.latency:
+                time.sleep(self.fake.latency)
+            try:
+                self.send(f"{self.tag} {result or 'OK ' + command + ' completed'}\r\n".encode())
+            except OSError:
+                return
+            if command == "LOGOUT":
+                return
+
+    def parse_command(self, line: bytes):
+        tokens = _tokenize(line)
+        if len(tokens) < 2 or not isinstance(tokens[0], str) or not isinstance(tokens[1], str):
+            raise _ProtocolError("Missing tag or command")
+        tag, command = tokens[0], tokens[1].upper()
+        arguments = tokens[2:]
+        if command == "UID":
+            if not arguments or not isinstance(arguments[0], str):
+                raise _ProtocolError("Missing UID command")
+            command = "UID " + arguments[0].upper()
+            arguments = arguments[1:]
+        return tag, command, arguments
+
+    # --- Commands ------------------------------------------------------------
+
+    def require_capability(self, capability: str) -> None:
+        if capability not in self.fake.capabilities:
+            raise _ProtocolError(f"{capability} is not supported")
+
+    def require_selected(self) -> FakeMailbox:
+        if self.selected is None:
+            raise _ProtocolError("No mailbox selected")
+        return self.selected
+
+    def get_mailbox(self, name) -> Optional[FakeMailbox]:
+        return self.fake.mailboxes.get(_decode(name))
+
+    def do_CAPABILITY(self, arguments):
+        self.untagged("CAPABILITY " + " ".join(self.fake.capabilities))
+
+    def do_NOOP(self, arguments):
+        pass
+
+    def do_LOGOUT(self, arguments):
+        self.untagged("BYE Logging out")
+
+    def do_LOGIN(self, arguments):
+        if len(arguments) != 2:
+            raise _ProtocolError("LOGIN needs a user name and a password")
+        if _decode(arguments[0]) != self.fake.username or _decode(arguments[1]) != self.fake.password:
+            return "NO [AUTHENTICATIONFAILED] Invalid credentials"
+        self.authenticated = True
+        return f"OK [CAPABILITY {' '.join(self.fake.capabilities)}] Logged in"
+
+    def do_ENABLE(self, arguments):
+        self.require_capability("ENABLE")
+        if self.selected is not None:
+            raise _ProtocolError("ENABLE is only valid before a mailbox is selected")
+        enabled = []
+        for argument in arguments:
+            extension = _decode(argument).upper()
+            # Unknown extensions are ignored, the response lists what was enabled
+            if extension in ("CONDSTORE", "QRESYNC") and extension in self.fake.capabilities:
+                self.enabled.add(extension)
+                enabled.append(extension)
+        if "QRESYNC" in self.enabled:
+            # QRESYNC implies CONDSTORE
+            self.enabled.add("CONDSTORE")
+        self.untagged("ENABLED" + "".join(f" {extension}" for extension in enabled))
+
+    def do_LIST(self, arguments):
+        status_items = None
+        if len(arguments) >= 4 and _is_atom(arguments[2], "RETURN"):
+            options = arguments[3]
+            for index, option in enumerate(options):
+                if _is_atom(option, "STATUS"):
+                    self.require_capability("LIST-STATUS")
+                    status_items = options[index + 1]
+        names = self.fake.mailboxes.keys()
+        # Special-use attributes (\Trash, \Archive, ...) are only reported by SPECIAL-USE servers
+        special_use = "SPECIAL-USE" in self.fake.capabilities
+        for mailbox in self.fake.mailboxes.values():
+            has_children = any(name.startswith(mailbox.name + "/") for name in names)
+            attributes = " ".join(
+                ["\\HasChildren" if has_children else "\\HasNoChildren", *(mailbox.attributes if special_use else ())]
+            )
+            self.untagged(f'LIST ({attributes}) "/" {_quote(mailbox.name)}')
+            if status_items is not None:
+                self.send_status(mailbox, status_items)
+
+    def do_STATUS(self, arguments):
+        mailbox = self.get_mailbox(arguments[0])
+        if mailbox is None:
+            return "NO Mailbox does not exist"
+        self.send_status(mailbox, arguments[1])
+
+    def send_status(self, mailbox: FakeMailbox, items: list) -> None:
+        values = []
+        for item in items:
+            item = item.upper()
+            if item == "MESSAGES":
+                value = len(mailbox.messages)
+            elif item == "UNSEEN":
+                value = sum(1 for message in mailbox.messages if "\\Seen" not in message.flags)
+            elif item == "UIDNEXT":
+                value = mailbox.uidnext
+            elif item == "UIDVALIDITY":
+                value = mailbox.uidvalidity
+            elif item == "RECENT":
+                value = 0
+            elif item == "SIZE":
+                self.require_capability("STATUS=SIZE")
+                value = mailbox.size
+            elif item == "HIGHESTMODSEQ":
+                self.require_capability("CONDSTORE")
+                self.enabled.add("CONDSTORE")
+                value = mailbox.highestmodseq
+            else:
+                raise _ProtocolError(f"Unsupported STATUS item {item}")
+            values.append(f"{item} {value}")
+        self.untagged(f"STATUS {_quote(mailbox.name)} ({' '.join(values)})")
+
+    def do_SELECT(self, arguments, readonly=False):
+        if len(arguments) > 2:
+            raise _ProtocolError("SELECT takes a mailbox and a list of parameters")
+        qresync = self.parse_select_parameters(arguments[1] if len(arguments) == 2 else [])
+        mailbox = self.get_mailbox(arguments[0]) if arguments else None
+        if mailbox is None:
+            self.selected = None
+            return "NO Mailbox does not exist"
+        self.selected = mailbox
+        self.readonly = readonly
+        self.untagged("FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)")
+        self.untagged(f"{len(mailbox.messages)} EXISTS")
+        self.untagged("0 RECENT")
+        self.untagged(f"OK [UIDVALIDITY {mailbox.uidvalidity}] UIDs valid")
+        self.untagged(f"OK [UIDNEXT {mailbox.uidnext}] Predicted next UID")
+        if "CONDSTORE" in self.fake.capabilities:
+            self.untagged(f"OK [HIGHESTMODSEQ {mailbox.highestmodseq}] Highest")
+        if qresync is not None and int(qresync[0]) == mailbox.uidvalidity:
+            self.send_changes_since(mailbox, int(qresync[1]), qresync[2] if len(qresync) > 2 else None)
+        return f"OK [{'READ-ONLY' if readonly else 'READ-WRITE'}] Select completed"
+
+    def parse_select_parameters(self, parameters) -> Optional[list]:
+        """
+        Parse the SELECT/EXAMINE parameters (RFC 7162): CONDSTORE, or QRESYNC followed
+        by (uidvalidity modseq [known-uids]).
+
+        Returns:
+            The QRESYNC arguments, None without QRESYNC
+        """
+        if not isinstance(parameters, list):
+            raise _ProtocolError("SELECT parameters must be a list")
+        qresync = None
+        index = 0
+        while index < len(parameters):
+            parameter = _decode(parameters[index]).upper() if not isinstance(parameters[index], list) else ""
+            if parameter == "CONDSTORE":
+                self.require_capability("CONDSTORE")
+                self.enabled.add("CONDSTORE")
+            elif parameter == "QRESYNC":
+                if "QRESYNC" not in self.enabled:
+                    raise _ProtocolError("QRESYNC is not enabled")
+                if index + 1 >= len(parameters) or not isinstance(parameters[index + 1], list):
+                    raise _ProtocolError("QRESYNC needs (uidvalidity modseq)")
+                qresync = parameters[index + 1]
+                if len(qresync) < 2:
+                    raise _ProtocolError("QRESYNC needs (uidvalidity modseq)")
+                index += 1
+            else:
+                raise _ProtocolError(f"Unsupported SELECT parameter {parameters[index]}")
+            index += 1
+        return qresync
+
+    def send_changes_since(self, mailbox: FakeMailbox, modseq: int, known_uids=None) -> None:
+        """Report what changed since a mod-sequence: VANISHED (EARLIER) for expunged UIDs, FETCH for changed messages."""
+        known = _NumberSet.parse(known_uids, mailbox.uidnext) if known_uids is not None else None
+        vanished = sorted(
+            uid for uid, expunged_modseq in mailbox.expunged
+            if expunged_modseq > modseq and (known is None or uid in known)
+        )
+        if vanished:
+            self.untagged(f"VANISHED (EARLIER) {_to_sequence_set(vanished)}")
+        for sequence_number, message in enumerate(mailbox.messages, start=1):
+            if message.modseq > modseq:
+                self.untagged(
+                    f"{sequence_number} FETCH (UID {message.uid} FLAGS ({' '.join(sorted(message.flags))}) MODSEQ ({message.modseq}))"
+                )
+
+    def send_expunged(self, removed: List[Tuple[int, int]]) -> None:
+        """Report expunged messages: as VANISHED once QRESYNC is enabled (RFC 7162), as EXPUNGE otherwise."""
+        if not removed:
+            return
+        if "QRESYNC" in self.enabled:
+            self.untagged(f"VANISHED {_to_sequence_set(sorted(uid for _, uid in removed))}")
+            return
+        for sequence_number, _ in removed:
+            self.untagged(f"{sequence_number} EXPUNGE")
+
+    def do_EXAMINE(self, arguments):
+        return self.do_SELECT(arguments, readonly=True)
+
+    def do_CLOSE(self, arguments):
+        mailbox = self.require_selected()
+        if not self.readonly:
+            # CLOSE expunges without reporting the messages
+            mailbox.expunge(message.uid for message in mailbox.messages if "\\Deleted" in message.flags)
+        self.selected = None
+
+    def do_UNSELECT(self, arguments):
+        self.require_capability("UNSELECT")
+        self.require_selected()
+        self.selected = None
+
+    def do_EXPUNGE(self, arguments, uids=None):
+        mailbox = self.require_selected()
+        if self.readonly:
+            return "NO Mailbox is read-only"
+        self.send_expunged(mailbox.expunge(
+            message.uid for message in mailbox.messages
+            if "\\Deleted" in message.flags and (uids is None or message.uid in uids)
+        ))
+
+    def do_UID_EXPUNGE(self, arguments):
+        self.require_capability("UIDPLUS")
+        mailbox = self.require_selected()
+        return self.do_EXPUNGE([], uids=_NumberSet.parse(arguments[0], self.max_uid(mailbox)))
+
+    def do_STORE(self, arguments, by_uid=False):
+        mailbox = self.require_selected()
+        if len(arguments) != 3:
+            raise _ProtocolError("STORE needs a message set, an action and flags")
+        if self.readonly:
+            return "NO Mailbox is read-only"
+        message_set, action, flags = arguments
+        action = action.upper()
+        flags = set(flags if isinstance(flags, list) else [flags])
+        for sequence_number, message in self.select_messages(mailbox, message_set, by_uid):
+            if action.startswith("+FLAGS"):
+                message.flags |= flags
+            elif action.startswith("-FLAGS"):
+                message.flags -= flags
+            elif action.startswith("FLAGS"):
+                message.flags = set(flags)
+            else:
+                raise _ProtocolError(f"Invalid STORE action {action}")
+            message.modseq = mailbox.next_modseq()
+            if not action.endswith(".SILENT"):
+                uid = f" UID {message.uid}" if by_uid else ""
+                modseq = f" MODSEQ ({message.modseq})" if "CONDSTORE" in self.enabled else ""
+                self.untagged(f"{sequence_number} FETCH (FLAGS ({' '.join(sorted(message.flags))}){uid}{modseq})")
+
+    def do_UID_STORE(self, arguments):
+        return self.do_STORE(arguments, by_uid=True)
+
+    def do_UID_COPY(self, arguments, move=False):
+        mailbox = self.require_selected()
+        if len(arguments) != 2:
+            raise _ProtocolError("COPY needs a message set and a mailbox")
+        destination = self.get_mailbox(arguments[1])
+        if destination is None:
+            return "NO [TRYCREATE] Mailbox does not exist"
+        selected = list(self.select_messages(mailbox, arguments[0], by_uid=True))
+        for _, message in selected:
+            destination.append(message.raw, message.flags - {"\\Deleted"}, message.internal_date)
+        if move:
+            self.send_expunged(mailbox.expunge(message.uid for _, message in selected))
+
+    def do_UID_MOVE(self, arguments):
+        self.require_capability("MOVE")
+        return self.do_UID_COPY(arguments, move=True)
+
+    def do_UID_FETCH(self, arguments):
+        mailbox = self.require_selected()
+        if len(arguments) != 2:
+            raise _ProtocolError("FETCH needs a message set and items")
+        items = _parse_fetch_items(arguments[1])
+        for sequence_number, message in self.select_messages(mailbox, arguments[0], by_uid=True):
+            self.send_fetch(sequence_number, message, items)
+
+    def send_fetch(self, sequence_number: int, message: FakeMessage, items: list) -> None:
+        parts = [b"UID " + str(message.uid).encode()]
+        for name, section, fields in items:
+            if name == "UID":
+                continue
+            if name == "FLAGS":
+                parts.append(f"FLAGS ({' '.join(sorted(message.flags))})".encode())
+            elif name == "RFC822.SIZE":
+                parts.append(b"RFC822.SIZE " + str(len(message.raw)).encode())
+            elif name == "INTERNALDATE":
+                parts.append(f'INTERNALDATE "{_format_internal_date(message.internal_date)}"'.encode())
+            elif name == "MODSEQ":
+                self.require_capability("CONDSTORE")
+                self.enabled.add("CONDSTORE")
+                parts.append(f"MODSEQ ({message.modseq})".encode())
+            elif name in ("RFC822", "RFC822.HEADER", "BODY", "BODY.PEEK"):
+                if section is None and name == "RFC822.HEADER":
+                    section = "HEADER"
+                data = _message_section(message, section or "", fields)
+                if name == "RFC822":
+                    label = "RFC822"
+                elif name == "RFC822.HEADER":
+                    label = "RFC822.HEADER"
+                elif fields is not None:
+                    label = f"BODY[{section} ({' '.join(fields)})]"
+                else:
+                    label = f"BODY[{section or ''}]"
+                parts.append(label.encode() + b" {%d}\r\n" % len(data) + data)
+                if name in ("RFC822", "BODY") and section in (None, "", "TEXT") and not self.readonly and "\\Seen" not in message.flags:
+                    message.flags.add("\\Seen")
+                    message.modseq = self.selected.next_modseq()
+            else:
+                raise _ProtocolError(f"Unsupported FETCH item {name}")
+        self.send(b"* %d FETCH (" % sequence_number + b" ".join(parts) + b")\r\n")
+
+    def do_UID_SEARCH(self, arguments):
+        mailbox = self.require_selected()
+        return_options = None
+        if arguments and _is_atom(arguments[0], "RETURN"):
+            self.require_capability("ESEARCH")
+            return_options = [option.upper() for option in arguments[1]] or ["ALL"]
+            arguments = arguments[2:]
+        if arguments and _is_atom(arguments[0], "CHARSET"):
+            arguments = arguments[2:]
+        max_uid = self.max_uid(mailbox)
+        matches = [
+            message.uid
+            for message in mailbox.messages
+            if _matches(message, list(arguments), max_uid)
+        ]
+        if return_options is None:
+            self.untagged("SEARCH" + "".join(f" {uid}" for uid in matches))
+            return
+        results = []
+        if "MIN" in return_options and matches:
+            results.append(f"MIN {matches[0]}")
+        if "MAX" in return_options and matches:
+            results.append(f"MAX {matches[-1]}")
+        if "COUNT" in return_options:
+            results.append(f"COUNT {len(matches)}")
+        if "ALL" in return_options and matches:
+            results.append(f"ALL {_to_sequence_set(matches)}")
+        self.untagged(" ".join([f'ESEARCH (TAG "{self.tag}") UID', *results]))
+
+    # --- Helpers -------------------------------------------------------------
+
+    @staticmethod
+    def max_uid(mailbox: FakeMailbox) -> int:
+        return mailbox.messages[-1].uid if mailbox.messages else 0
+
+    def select_messages(self, mailbox: FakeMailbox, message_set, by_uid: bool):
+        """Yield (sequence number, message) for a UID or sequence number set."""
+        if by_uid:
+            uids = _NumberSet.parse(message_set, self.max_uid(mailbox))
+            for sequence_number, message in enumerate(mailbox.messages, start=1):
+                if message.uid in uids:
+                    yield sequence_number, message
+        else:
+            numbers = _NumberSet.parse(message_set, len(mailbox.messages))
+            for sequence_number, message in enumerate(mailbox.messages, start=1):
+                if sequence_number in numbers:
+                    yield sequence_number, message
+
+
+class _NumberSet:
+    """A parsed sequence set such as "1:5,7,10:*", as sorted ranges."""
+
+    def __init__(self, ranges):
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self._starts = [start for start, _ in merged]
+        self._ends = [end for _, end in merged]
+
+    @classmethod
+    def parse(cls, value, largest: int) -> "_NumberSet":
+        ranges = []
+        for part in _decode(value).split(","):
+            start, _, end = part.partition(":")
+            start = largest if start == "*" else int(start)
+            end = start if not end else (largest if end == "*" else int(end))
+            ranges.append((min(start, end), max(start, end)))
+        return cls(ranges)
+
+    def __contains__(self, number: int) -> bool:
+        index = bisect_right(self._starts, number) - 1
+        return index >= 0 and number <= self._ends[index]
+
+
+def _tokenize(line: bytes) -> list:
+    """
+    Split a command into tokens: atoms (str), quoted strings and literals (bytes)
+    and parenthesized lists (list).
+    """
+    stack: List[list] = [[]]
+    position = 0
+    while position < len(line):
+        char = line[position:position + 1]
+        if char == b" ":
+            position += 1
+        elif char == b"(":
+            stack.append([])
+            position += 1
+        elif char == b")":
+            if len(stack) == 1:
+                raise _ProtocolError("Unbalanced parentheses")
+            group = stack.pop()
+            stack[-1].append(group)
+            position += 1
+        elif char == b'"':
+            end = position + 1
+            value = b""
+            while end < len(line) and line[end:end + 1] != b'"':
+                if line[end:end + 1] == b"\\":
+                    end += 1
+                value += line[end:end + 1]
+                end += 1
+            stack[-1].append(value)
+            position = end + 1
+        elif char == b"{":
+            match = re.match(rb"\{(\d+)\+?\}\r\n", line[position:])
+            if not match:
+                raise _ProtocolError("Invalid literal")
+            start = position + match.end()
+            size = int(match.group(1))
+            stack[-1].append(line[start:start + size])
+            position = start + size
+        else:
+            match = re.match(rb"[^ ()]+", line[position:])
+            stack[-1].append(match.group(0).decode())
+            position += match.end()
+    if len(stack) != 1:
+        raise _ProtocolError("Unbalanced parentheses")
+    return stack[0]
+
+
+def _parse_fetch_items(value) -> list:
+    """
+    Parse FETCH items into (name, section, header fields) tuples, e.g.
+    BODY.PEEK[HEADER.FIELDS (FROM DATE)] gives ("BODY.PEEK", "HEADER.FIELDS", ["FROM", "DATE"]).
+    The tokenizer splits such items at the parentheses, they are joined back here.
+    """
+    tokens = value if isinstance(value, list) else [value]
+    items = []
+    index = 0
+    while index < len(tokens):
+        token = _decode(tokens[index]).upper()
+        index += 1
+        if "[" not in token:
+            items.append((token, None, None))
+            continue
+        name, _, section = token.partition("[")
+        fields = None
+        if not section.endswith("]"):
+            # The section continues with a list of header fields and a closing bracket
+            fields = [_decode(field).upper() for field in tokens[index]]
+            index += 2
+        items.append((name, section.rstrip("]"), fields))
+    return items
+
+
+def _message_section(message: FakeMessage, section: str, fields: Optional[List[str]]) -> bytes:
+    """The data of a BODY[section] of a message."""
+    header, separator, body = message.raw.partition(b"\r\n\r\n")
+    if section == "":
+        return message.raw
+    if section == "TEXT":
+        return body
+    if section == "HEADER":
+        return header + b"\r\n\r\n"
+    if section in ("HEADER.FIELDS", "HEADER.FIELDS.NOT"):
+        # Header lines, with their folded continuation lines
+        lines = re.split(rb"\r\n(?![ \t])", header)
+        selected = [
+            line for line in lines
+            if (line.split(b":", 1)[0].strip().decode(errors="replace").upper() in fields) == (section == "HEADER.FIELDS")
+        ]
+        return b"".join(line + b"\r\n" for line in selected) + b"\r\n"
+    raise _ProtocolError(f"Unsupported section {section}")
+
+
+def _matches(message: FakeMessage, keys: list, max_uid: int) -> bool:
+    """Whether a message matches all search keys, consuming them from the list."""
+    while keys:
+        if not _match_key(message, keys, max_uid):
+            return False
+    return True
+
+
+def _header_text(value) -> str:
+    """A header with its RFC 2047 encoded words decoded, which is what servers search in."""
+    try:
+        return str(make_header(decode_header(str(value))))
+    except (LookupError, ValueError):
+        return str(value)
+
+
+def _match_key(message: FakeMessage, keys: list, max_uid: int) -> bool:
+    """Evaluate (and consume) the first search key of keys."""
+    key = keys.pop(0)
+    if isinstance(key, list):
+        return _matches(message, list(key), max_uid)
+    key = _decode(key).upper()
+    if key == "ALL":
+        return True
+    if key == "OR":
+        first = _match_key(message, keys, max_uid)
+        second = _match_key(message, keys, max_uid)
+        return first or second
+    if key == "NOT":
+        return not _match_key(message, keys, max_uid)
+    if key in ("FROM", "TO", "SUBJECT"):
+        return _decode(keys.pop(0)).lower() in _header_text(message.headers.get(key, "")).lower()
+    if key == "HEADER":
+        name, value = _decode(keys.pop(0)), _decode(keys.pop(0))
+        return name in message.headers and value.lower() in str(message.headers[name]).lower()
+    if key == "UID":
+        return message.uid in _NumberSet.parse(keys.pop(0), max_uid)
+    if key in ("SENTBEFORE", "SENTSINCE", "BEFORE", "SINCE"):
+        threshold = _parse_search_date(keys.pop(0))
+        if key.startswith("SENT"):
+            sent = _parse_date_header(message.headers.get("Date"))
+            if sent is None:
+                return False
+            day = sent.date()
+        else:
+            day = message.internal_date.date()
+        return day < threshold if key.endswith("BEFORE") else day >= threshold
+    if key == "LARGER":
+        return len(message.raw) > int(keys.pop(0))
+    if key == "SMALLER":
+        return len(message.raw) < int(keys.pop(0))
+    if key in ("DELETED", "SEEN", "FLAGGED", "ANSWERED", "DRAFT"):
+        return "\\" + key.capitalize() in message.flags
+    if key in ("UNDELETED", "UNSEEN", "UNFLAGGED", "UNANSWERED", "UNDRAFT"):
+        return "\\" + key[2:].capitalize() not in message.flags
+    raise _ProtocolError(f"Unsupported search key {key}")
+
+
+def _is_atom(token, value: str) -> bool:
+    return isinstance(token, str) and token.upper() == value
+
+
+def _decode(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _to_sequence_set(numbers: List[int]) -> str:
+    """Format sorted numbers as a compact sequence set, e.g. "1:3,7"."""
+    ranges = []
+    for number in numbers:
+        if ranges and number == ranges[-1][1] + 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return ",".join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+
+def _parse_search_date(value):
+    day, month, year = _decode(value).split("-")
+    return datetime(int(year), _MONTHS.index(month.capitalize()) + 1, int(day)).date()
+
+
+def _parse_date_header(value) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _format_internal_date(value: datetime) -> str:
+    return f"{value.day:02d}-{_MONTHS[value.month - 1]}-{value.year} {value:%H:%M:%S %z}"
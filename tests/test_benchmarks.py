@@ -0,0 +1,89 @@
+"""
+Smoke tests of the synthetic mailbox generator and the benchmark harness (tests/benchmarks).
+"""
+
+import imaplib
+import json
+import time
+from datetime import datetime, timezone
+
+from benchmarks.mailbox_generator import MailboxProfile, generate_mailbox
+from benchmarks.network_proxy import NetworkShapingProxy
+from benchmarks.run_benchmarks import OPERATIONS, compare, run_benchmarks
+from fake_imap_server import FakeIMAPServer, build_message
+
+
+SMALL_PROFILE = MailboxProfile(messages=300, senders=30, folders=5, trash_messages=20, attachment_share=0.1, attachment_size=1024)
+
+
+def test_generator_is_reproducible():
+    now = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    mailboxes = []
+    for _ in range(2):
+        with FakeIMAPServer() as server:
+            summary = generate_mailbox(server, SMALL_PROFILE, now=now)
+        mailboxes.append((summary, [message.raw for message in server.mailboxes["INBOX"].messages]))
+
+    (first, first_raw), (second, second_raw) = mailboxes
+    assert first.inbox_counts == second.inbox_counts
+    assert first_raw == second_raw
+    assert sum(first.inbox_counts.values()) + sum(
+        len(server.mailboxes[folder].messages) for folder in first.folders
+    ) == SMALL_PROFILE.messages
+    # Zipf: the most frequent sender sends far more than an average one
+    assert first.inbox_counts[first.top_sender] > 3 * sum(first.inbox_counts.values()) / len(first.inbox_counts)
+    assert any("/" in folder for folder in first.folders)
+
+
+def test_run_benchmarks():
+    report = run_benchmarks(SMALL_PROFILE, ["minimal", "modern"], log=lambda message: None)
+
+    json.dumps(report)
+    for profile in ("minimal", "modern"):
+        results = report["results"][profile]
+        assert list(results) == OPERATIONS
+        assert all(result["round_trips"] > 0 for result in results.values())
+    # LIST-STATUS replaces a STATUS command per folder
+    assert report["results"]["modern"]["get_all_folders"]["round_trips"] == 1
+    assert compare(report, report, tolerance=0.2) == []
+
+
+def test_network_proxy_adds_round_trip_time(make_imap_server):
+    server = make_imap_server()
+    with NetworkShapingProxy(server.host, server.port, rtt=0.1) as proxy:
+        mail = imaplib.IMAP4(proxy.host, proxy.port)
+        start = time.perf_counter()
+        mail.noop()
+        elapsed = time.perf_counter() - start
+        mail.logout()
+
+    # Load on the test machine only adds time, so the upper bound is generous: it
+    # catches a delay applied per packet or per direction, not scheduling jitter
+    assert 0.1 <= elapsed < 1.0
+    assert proxy.connections == 1
+
+
+def test_network_proxy_limits_bandwidth(make_imap_server):
+    server = make_imap_server()
+    uid = server.add_message("INBOX", build_message("a@example.com", body="x" * 200_000))
+    with NetworkShapingProxy(server.host, server.port, rtt=0.0, bandwidth=1_000_000) as proxy:
+        mail = imaplib.IMAP4(proxy.host, proxy.port)
+        mail.login(server.username, server.password)
+        mail.select("INBOX")
+        start = time.perf_counter()
+        mail.uid("FETCH", str(uid), "(RFC822)")
+        elapsed = time.perf_counter() - start
+        mail.logout()
+
+    # 200 kB at 1 MB/s; no upper bound, a busy machine only makes it slower
+    assert elapsed >= 0.2
+    assert proxy.bytes_to_client > 200_000
+
+
+def test_run_benchmarks_through_proxy():
+    profile = MailboxProfile(messages=50, senders=5, folders=2, trash_messages=5)
+    report = run_benchmarks(profile, ["modern"], network={"rtt": 0.02}, log=lambda message: None)
+
+    results = report["results"]["modern"]
+    # Every round trip pays the network delay (a lower bound, which load cannot break)
+    assert results["get_all_folders"]["seconds"] >= 0.02 * results["get_all_folders"]["round_trips"]
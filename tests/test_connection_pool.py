@@ -0,0 +1,228 @@
+"""
+Tests of the IMAP connection pool (cleanmail.connection_pool) against the fake IMAP server.
+"""
+
+import gc
+import imaplib
+import threading
+import time
+import weakref
+
+import pytest
+
+from cleanmail import IMAPConnectionPool, MailAnalyzer
+from cleanmail.connection_pool import get_connection_pool
+from conftest import MINIMAL_CAPABILITIES, seed_mailbox
+
+
+@pytest.fixture
+def server(make_imap_server):
+    server = make_imap_server(capabilities=MINIMAL_CAPABILITIES)
+    seed_mailbox(server)
+    return server
+
+
+@pytest.fixture
+def make_pool(server):
+    """Factory for pools of logged in connections to the fake server, closed at the end of the test."""
+    pools = []
+
+    def connect() -> imaplib.IMAP4:
+        mail = imaplib.IMAP4(server.host, server.port)
+        mail.login(server.username, server.password)
+        return mail
+
+    def make(**kwargs) -> IMAPConnectionPool:
+        pool = IMAPConnectionPool(connect, **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def age_idle_connections(pool: IMAPConnectionPool, seconds: float) -> None:
+    pool._idle = [(mail, last_used - seconds) for mail, last_used in pool._idle]
+
+
+def test_connections_are_reused(server, make_pool):
+    pool = make_pool()
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert server.connections == 1
+    assert "NOOP" not in server.commands
+
+
+def test_idle_connections_expire(server, make_pool):
+    pool = make_pool(idle_timeout=60)
+    with pool.connection() as first:
+        pass
+    age_idle_connections(pool, 61)
+
+    with pool.connection() as second:
+        pass
+
+    assert first is not second
+    assert server.connections == 2
+    # The expired connection is logged out, not checked
+    assert server.commands.count("LOGOUT") == 1
+    assert "NOOP" not in server.commands
+
+
+def test_health_check_before_reuse(server, make_pool):
+    pool = make_pool(idle_timeout=300, health_check_interval=30)
+    with pool.connection() as first:
+        pass
+    age_idle_connections(pool, 31)
+
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert server.commands.count("NOOP") == 1
+
+
+def test_dead_connection_is_replaced(server, make_pool):
+    pool = make_pool(idle_timeout=300, health_check_interval=30)
+    with pool.connection() as first:
+        pass
+    # The server dropped the connection while it was idle
+    first.shutdown()
+    age_idle_connections(pool, 31)
+
+    with pool.connection() as second:
+        assert second.noop()[0] == "OK"
+
+    assert first is not second
+    assert server.connections == 2
+
+
+def test_aborted_connection_is_discarded(server, make_pool):
+    pool = make_pool()
+
+    with pytest.raises(imaplib.IMAP4.abort):
+        with pool.connection() as first:
+            raise imaplib.IMAP4.abort("socket error: BYE")
+    with pool.connection() as second:
+        pass
+
+    assert first is not second
+    assert first.state == "LOGOUT"
+    assert server.connections == 2
+
+
+def test_other_errors_keep_the_connection(make_pool):
+    pool = make_pool()
+
+    with pytest.raises(ValueError):
+        with pool.connection() as first:
+            raise ValueError("not an IMAP error")
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+
+
+def test_acquire_waits_for_a_free_connection(server, make_pool):
+    pool = make_pool(max_connections=1, acquire_timeout=10)
+    first = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+
+    time.sleep(0.1)
+    assert acquired == []
+    pool.release(first)
+    waiter.join(timeout=5)
+
+    assert acquired == [first]
+    assert server.connections == 1
+    pool.release(first)
+
+
+def test_acquire_times_out(make_pool):
+    pool = make_pool(max_connections=1, acquire_timeout=0.1)
+    first = pool.acquire()
+
+    with pytest.raises(Exception, match="Timed out waiting for a free IMAP connection"):
+        pool.acquire()
+
+    # The failed wait does not take a connection slot
+    pool.release(first)
+    assert pool.acquire() is first
+
+
+def test_reset_without_unselect_does_not_expunge(server, make_pool):
+    pool = make_pool()
+    inbox = server.mailboxes["INBOX"]
+    count = len(inbox.messages)
+
+    with pool.connection() as mail:
+        mail.select("INBOX")
+        mail.store("1", "+FLAGS.SILENT", "(\\Deleted)")
+    with pool.connection() as mail:
+        assert mail.state == "AUTH"
+
+    # CLOSE of a read-write folder would have expunged the flagged message
+    assert "UNSELECT" not in server.commands
+    assert server.commands[-2:] == ["EXAMINE", "CLOSE"]
+    assert len(inbox.messages) == count
+
+
+def test_release_after_close_logs_out(make_pool):
+    pool = make_pool()
+    mail = pool.acquire()
+
+    pool.close()
+    pool.release(mail)
+
+    assert mail.state == "LOGOUT"
+    assert pool._idle == []
+
+
+def test_shared_pool_does_not_keep_the_analyzer(server):
+    analyzer = MailAnalyzer(server.username, server.password, server.host, mail_port=server.port, use_ssl=False)
+    pool = analyzer.connection_pool
+    reference = weakref.ref(analyzer)
+    try:
+        with pool.connection() as mail:
+            assert mail.noop()[0] == "OK"
+        del analyzer
+        gc.collect()
+
+        assert reference() is None
+        # Another analyzer of the account shares the pool, unless it connects differently
+        assert get_connection_pool(server.host, server.username, server.password, server.port, use_ssl=False) is pool
+        ssl_pool = get_connection_pool(server.host, server.username, server.password, server.port, use_ssl=True)
+        assert ssl_pool is not pool
+        ssl_pool.close()
+    finally:
+        pool.close()
+
+
+def test_wrong_password_keeps_the_existing_pool(server, make_analyzer):
+    analyzer = make_analyzer(server)
+    with analyzer.connection_pool.connection() as first:
+        pass
+
+    # E.g. a typo in another session of the same account
+    wrong = MailAnalyzer(server.username, "wrong", server.host, mail_port=server.port, use_ssl=False)
+    try:
+        assert wrong.connection_pool is not analyzer.connection_pool
+        with pytest.raises(imaplib.IMAP4.error):
+            with wrong.connection_pool.connection():
+                pass
+    finally:
+        wrong.connection_pool.close()
+
+    assert not analyzer.connection_pool._closed
+    with analyzer.connection_pool.connection() as second:
+        pass
+    assert first is second
+    assert server.commands.count("LOGOUT") == 0
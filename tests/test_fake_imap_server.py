@@ -0,0 +1,116 @@
+"""
+Tests of the CONDSTORE/QRESYNC support (RFC 7162) of the fake IMAP server, which
+the resync of the header cache relies on.
+"""
+
+import imaplib
+
+import pytest
+
+from conftest import MODERN_CAPABILITIES
+from fake_imap_server import build_message
+
+
+@pytest.fixture
+def server(make_imap_server):
+    server = make_imap_server(capabilities=MODERN_CAPABILITIES)
+    for number in range(5):
+        server.add_message("INBOX", build_message("a@example.com", subject=f"Message {number}"))
+    return server
+
+
+@pytest.fixture
+def mail(server):
+    mail = imaplib.IMAP4(server.host, server.port)
+    mail.login(server.username, server.password)
+    yield mail
+    mail.logout()
+
+
+def examine(mail: imaplib.IMAP4, *parameters: str):
+    """EXAMINE INBOX with parameters, which imaplib's select() does not support."""
+    mail.untagged_responses = {}
+    mail.is_readonly = True
+    result = mail._simple_command("EXAMINE", "INBOX", *parameters)
+    mail.state = "SELECTED" if result[0] == "OK" else "AUTH"
+    return result
+
+
+def test_select_reports_highestmodseq(server, mail):
+    inbox = server.mailboxes["INBOX"]
+
+    assert examine(mail, "(CONDSTORE)")[0] == "OK"
+    assert mail.response("HIGHESTMODSEQ")[1] == [str(inbox.highestmodseq).encode()]
+    # Every change raises the mod-sequence
+    before = inbox.highestmodseq
+    inbox.expunge([1])
+    server.add_message("INBOX", build_message("b@example.com"))
+    assert inbox.highestmodseq == before + 2
+
+
+def test_qresync_must_be_enabled(mail):
+    with pytest.raises(imaplib.IMAP4.error, match="QRESYNC is not enabled"):
+        examine(mail, "(QRESYNC (1 1))")
+
+    assert mail.enable("QRESYNC")[0] == "OK"
+    assert mail.response("ENABLED")[1] == [b"QRESYNC"]
+    assert examine(mail, "(QRESYNC (1 1))")[0] == "OK"
+
+
+def test_qresync_reports_changes_since_modseq(server, mail):
+    inbox = server.mailboxes["INBOX"]
+    modseq = inbox.highestmodseq
+    inbox.expunge([2, 3])
+    new_uid = server.add_message("INBOX", build_message("b@example.com"))
+    mail.enable("QRESYNC")
+
+    assert examine(mail, f"(QRESYNC (1 {modseq}))")[0] == "OK"
+
+    assert mail.response("VANISHED")[1] == [b"(EARLIER) 2:3"]
+    assert mail.response("FETCH")[1] == [f"4 (UID {new_uid} FLAGS () MODSEQ ({inbox.highestmodseq}))".encode()]
+    assert mail.response("EXISTS")[1] == [b"4"]
+
+
+def test_qresync_known_uids(server, mail):
+    modseq = server.mailboxes["INBOX"].highestmodseq
+    server.mailboxes["INBOX"].expunge([1, 4])
+    mail.enable("QRESYNC")
+
+    examine(mail, f"(QRESYNC (1 {modseq} 2:5))")
+
+    assert mail.response("VANISHED")[1] == [b"(EARLIER) 4"]
+
+
+def test_qresync_with_changed_uidvalidity(server, mail):
+    inbox = server.mailboxes["INBOX"]
+    modseq = inbox.highestmodseq
+    inbox.expunge([1])
+    inbox.reset_uidvalidity(2)
+    mail.enable("QRESYNC")
+
+    examine(mail, f"(QRESYNC (1 {modseq}))")
+
+    # The client's state is of another UIDVALIDITY, there is nothing to report against it
+    assert mail.response("UIDVALIDITY")[1] == [b"2"]
+    assert mail.response("VANISHED")[1] == [None]
+    assert mail.response("FETCH")[1] == [None]
+    assert [message.uid for message in inbox.messages] == [1, 2, 3, 4]
+
+
+def test_expunge_reports_vanished_once_qresync_is_enabled(server, mail):
+    mail.enable("QRESYNC")
+    mail.select("INBOX")
+    mail.uid("STORE", "2:3", "+FLAGS.SILENT", "(\\Deleted)")
+
+    mail.expunge()
+
+    assert mail.response("VANISHED")[1] == [b"2:3"]
+    assert mail.response("EXPUNGE")[1] == [None]
+    mail.close()
+
+
+def test_enable_is_not_valid_when_selected(mail):
+    mail.select("INBOX")
+
+    with pytest.raises(imaplib.IMAP4.error):
+        mail.enable("QRESYNC")
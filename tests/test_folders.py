@@ -0,0 +1,76 @@
+"""
+Tests of the LIST response parser (cleanmail.folders).
+"""
+
+import pytest
+
+from cleanmail.folders import (
+    Folder, decode_modified_utf7, encode_modified_utf7, parse_list_response, parse_status_responses, quote_mailbox,
+)
+
+
+@pytest.mark.parametrize("decoded, encoded", [
+    ("INBOX", "INBOX"),
+    ("Envoyés", "Envoy&AOk-s"),
+    ("Tom & Jerry", "Tom &- Jerry"),
+    ("~peter/mail/台北/日本語", "~peter/mail/&U,BTFw-/&ZeVnLIqe-"),
+    ("Входящие", "&BBIERQQ+BDQETwRJBDgENQ-"),
+])
+def test_modified_utf7(decoded, encoded):
+    assert encode_modified_utf7(decoded) == encoded
+    assert decode_modified_utf7(encoded) == decoded
+
+
+def test_invalid_modified_utf7_is_kept():
+    assert decode_modified_utf7("Bad &AOk") == "Bad &AOk"
+    assert decode_modified_utf7("Bad &A-") == "Bad &A-"
+
+
+def test_parse_list_response():
+    folders = parse_list_response([
+        b'(\\HasChildren) "/" INBOX',
+        b'(\\HasNoChildren \\Trash) "/" "Deleted Items"',
+        b'(\\HasNoChildren) "." "INBOX.Envoy&AOk-s"',
+        b'(\\Noselect \\HasChildren) "/" "[Gmail]"',
+        b'(\\HasNoChildren) NIL "Quote \\"this\\" \\\\ that"',
+        (b'(\\HasNoChildren \\Archive) "/" {9}', b'Work/2024'),
+        b'',
+        None,
+    ])
+
+    assert [folder.raw_name for folder in folders] == [
+        "INBOX", "Deleted Items", "INBOX.Envoy&AOk-s", "[Gmail]", 'Quote "this" \\ that', "Work/2024",
+    ]
+    inbox, deleted, sent, gmail, quoted, work = folders
+    assert inbox.delimiter == "/" and inbox.parent is None and inbox.imap_name == "INBOX"
+    assert deleted.has_attribute("\\trash") and deleted.imap_name == '"Deleted Items"'
+    assert sent.name == "INBOX.Envoyés" and sent.short_name == "Envoyés" and sent.parent == "INBOX"
+    assert not gmail.selectable and inbox.selectable
+    assert quoted.delimiter is None and quoted.imap_name == '"Quote \\"this\\" \\\\ that"'
+    assert work.attributes == ("\\HasNoChildren", "\\Archive") and work.parent == "Work"
+
+
+def test_parse_list_response_skips_garbage():
+    assert parse_list_response([b"garbage", b'(\\HasNoChildren) "/"', b'(\\HasNoChildren) "/" "unterminated']) == []
+
+
+def test_parse_status_responses():
+    statuses = parse_status_responses([
+        b'"Deleted Items" (MESSAGES 3 UNSEEN 1)',
+        b"INBOX (MESSAGES 10 UNSEEN 2 SIZE 2048)",
+        (b"{9}", b"Work/2024"),
+        b" (MESSAGES 0 UNSEEN 0)",
+    ])
+
+    assert statuses == {
+        "Deleted Items": {"MESSAGES": 3, "UNSEEN": 1},
+        "INBOX": {"MESSAGES": 10, "UNSEEN": 2, "SIZE": 2048},
+        "Work/2024": {"MESSAGES": 0, "UNSEEN": 0},
+    }
+
+
+def test_quote_mailbox():
+    assert quote_mailbox("[Gmail]/Bin") == "[Gmail]/Bin"
+    assert quote_mailbox("Deleted Items") == '"Deleted Items"'
+    assert quote_mailbox("") == '""'
+    assert Folder("a b").imap_name == '"a b"'
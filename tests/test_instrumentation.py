@@ -0,0 +1,69 @@
+"""
+Tests of the per-command instrumentation of MailAnalyzer operations.
+"""
+
+import pytest
+
+from cleanmail import EmailValidationError, Instrumentation
+from conftest import SEED_COUNTS
+
+
+def test_operation_summary(seeded_imap_server, make_analyzer):
+    operations = []
+    commands = []
+    instrumentation = Instrumentation(
+        on_command=lambda operation, record: commands.append((operation, record.verb)),
+        on_operation=operations.append,
+    )
+    analyzer = make_analyzer(seeded_imap_server, instrumentation=instrumentation)
+    assert analyzer.bin_folder == "Trash"
+    seeded_imap_server.reset_counters()
+
+    assert analyzer.prone_emails_older_than("INBOX", 365) == SEED_COUNTS["old@archive.example"]
+
+    summary = instrumentation.last_operation
+    assert operations[-1] is summary
+    assert summary.name == "prone_emails_older_than"
+    assert summary.error is None
+    # The pool reuses the connection opened to look up the bin folder
+    assert [record.verb for record in summary.commands] == seeded_imap_server.commands
+    assert [verb for operation, verb in commands if operation == "prone_emails_older_than"] == seeded_imap_server.commands
+    assert summary.bytes_received == seeded_imap_server.bytes_sent
+    assert summary.bytes_sent == seeded_imap_server.bytes_received
+    assert all(record.result == "OK" and record.seconds >= record.first_byte_seconds for record in summary.commands)
+    assert summary.by_verb()["UID SEARCH"].count >= 1
+    assert summary.imap_seconds <= summary.seconds
+    assert "prone_emails_older_than" in str(summary)
+
+
+def test_connect_and_nested_operations(seeded_imap_server, make_analyzer):
+    analyzer = make_analyzer(seeded_imap_server)
+    assert analyzer.instrumentation.operations() == []
+
+    # The first folder lookup connects, logs in and lists the folders
+    assert analyzer.bin_folder == "Trash"
+    connect = analyzer.instrumentation.operations()[0]
+    assert connect.name == "list_folders"
+    assert [record.verb for record in connect.commands][:3] == ["CONNECT", "CAPABILITY", "LOGIN"]
+    assert connect.commands[0].response_size > 0
+
+    # delete_emails_from_sender calls delete_emails_from_senders, which counts as part of it
+    analyzer.delete_emails_from_sender("friend@example.com")
+    assert analyzer.instrumentation.last_operation.name == "delete_emails_from_sender"
+    stats = analyzer.instrumentation.stats()
+    assert stats["delete_emails_from_sender"].calls == 1
+    assert "delete_emails_from_senders" not in stats
+
+
+def test_failed_operation_and_hook(seeded_imap_server, make_analyzer):
+    def failing_hook(summary):
+        raise RuntimeError("hook failure")
+
+    analyzer = make_analyzer(seeded_imap_server, instrumentation=Instrumentation(on_operation=failing_hook))
+
+    # A failing hook does not break the operation
+    assert analyzer.count_messages("INBOX") == sum(SEED_COUNTS.values())
+    with pytest.raises(EmailValidationError):
+        analyzer.delete_emails_from_sender("not an address")
+    assert analyzer.instrumentation.last_operation.error == "EmailValidationError"
+    assert analyzer.instrumentation.stats()["delete_emails_from_sender"].errors == 1
@@ -0,0 +1,342 @@
+"""
+Tests of MailAnalyzer against the in-process fake IMAP server.
+
+Every test runs against a bare IMAP4rev1 server and against a server with all
+supported extensions (see conftest.py), so both the fast paths and the fallbacks
+are covered.
+"""
+
+from datetime import date, datetime, timezone
+
+import pytest
+
+from cleanmail import EmailValidationError, HeaderCache, SearchQuery
+from fake_imap_server import build_message
+from conftest import MINIMAL_CAPABILITIES, MODERN_CAPABILITIES, SEED_COUNTS, SEED_TRASH_COUNT, seed_mailbox
+
+
+INBOX_COUNT = sum(SEED_COUNTS.values())
+
+
+def test_folders(analyzer):
+    assert analyzer.bin_folder == "Trash"
+    assert analyzer.archive_folder == "Archive"
+
+    folders = {folder["raw_name"]: folder for folder in analyzer.get_all_folders()}
+
+    assert set(folders) == {"INBOX", "Trash", "Archive", "Projects"}
+    assert folders["INBOX"]["message_count"] == INBOX_COUNT
+    assert folders["INBOX"]["unseen_count"] == INBOX_COUNT
+    assert folders["Projects"]["message_count"] == 1
+    assert folders["Projects"]["unseen_count"] == 0
+    assert analyzer.count_messages("Trash") == SEED_TRASH_COUNT
+
+
+def test_folders_are_looked_up_lazily(seeded_imap_server, make_analyzer):
+    analyzer = make_analyzer(seeded_imap_server)
+    assert seeded_imap_server.connections == 0
+
+    assert analyzer.bin_folder == "Trash"
+    assert analyzer.archive_folder == "Archive"
+    # One LIST for both, on a single connection
+    assert seeded_imap_server.connections == 1
+    assert [command for command in seeded_imap_server.commands if command == "LIST"] == ["LIST"]
+
+
+def test_missing_archive_folder(seeded_imap_server, make_analyzer):
+    del seeded_imap_server.mailboxes["Archive"]
+    analyzer = make_analyzer(seeded_imap_server)
+
+    assert analyzer.archive_folder is None
+    assert analyzer.delete_emails_from_sender("news@paper.example") == SEED_COUNTS["news@paper.example"]
+    with pytest.raises(Exception, match="Archive"):
+        analyzer.prone_emails_older_than("INBOX", 365, action="archive")
+    assert analyzer.count_emails_older_than("INBOX", 365) == SEED_COUNTS["old@archive.example"]
+
+
+def test_special_use_folders(make_imap_server, make_analyzer):
+    server = make_imap_server(capabilities=MODERN_CAPABILITIES)
+    # Localized folder names that are not in the fallback name lists
+    del server.mailboxes["Trash"], server.mailboxes["Archive"]
+    server.add_mailbox("Prullenbak", ["\\Trash"])
+    server.add_mailbox("Gearchiveerd", ["\\Archive"])
+    server.add_mailbox("Ongewenst", ["\\Junk"])
+    server.add_mailbox("Verzonden items", ["\\Sent"])
+    analyzer = make_analyzer(server)
+
+    assert analyzer.bin_folder == "Prullenbak"
+    assert analyzer.archive_folder == "Gearchiveerd"
+    assert analyzer.special_folders == {
+        "\\Trash": "Prullenbak",
+        "\\Archive": "Gearchiveerd",
+        "\\Junk": "Ongewenst",
+        "\\Sent": "Verzonden items",
+    }
+    assert server.commands.count("LIST") == 1
+
+
+def test_special_use_takes_precedence_over_names(make_imap_server, make_analyzer):
+    for capabilities, bin_folder in ((MODERN_CAPABILITIES, "Deleted Items"), (MINIMAL_CAPABILITIES, "Trash")):
+        server = make_imap_server(capabilities=capabilities)
+        server.mailboxes["Trash"].attributes = []
+        server.add_mailbox("Deleted Items", ["\\Trash"])
+
+        # Without SPECIAL-USE, the server reports no attributes and the names are matched
+        assert make_analyzer(server).bin_folder == bin_folder
+
+
+def test_folders_with_special_names(seeded_imap_server, analyzer):
+    seeded_imap_server.add_mailbox("Envoy&AOk-s")
+    seeded_imap_server.add_message("Envoy&AOk-s", build_message("me@example.com"))
+    seeded_imap_server.add_mailbox('Say "hi"')
+
+    folders = {folder["raw_name"]: folder for folder in analyzer.get_all_folders()}
+
+    assert folders["Envoy&AOk-s"]["printable_name"] == "Envoyés"
+    assert folders["Envoy&AOk-s"]["message_count"] == 1
+    assert folders['Say "hi"']["message_count"] == 0
+
+
+def test_actions_on_folders_with_special_names(make_imap_server, make_analyzer):
+    # Names that need quoting and escaping in commands, not only spaces
+    server = make_imap_server(capabilities=MODERN_CAPABILITIES)
+    del server.mailboxes["Trash"]
+    bin_name, folder_name = 'Bin "old" \\ (1)', "100% * done"
+    server.add_mailbox(bin_name, ["\\Trash"])
+    server.add_mailbox(folder_name)
+    for _ in range(3):
+        server.add_message(folder_name, build_message("old@archive.example", date=datetime(2001, 1, 1, tzinfo=timezone.utc)))
+    analyzer = make_analyzer(server)
+
+    assert analyzer.bin_folder == bin_name and analyzer.special_folders["\\Trash"] == bin_name
+    assert analyzer.count_messages(bin_name) == 0
+    assert analyzer.count_emails_older_than(folder_name, 365) == 3
+    assert analyzer.prone_emails_older_than(folder_name, 365) == 3
+    uid = server.mailboxes[bin_name].messages[0].uid
+    assert analyzer.fetch_message(uid, None, foldername=bin_name)["From"] == "old@archive.example"
+    assert analyzer.empty_bin_folder() == 3
+    assert server.mailboxes[bin_name].messages == [] and server.mailboxes[folder_name].messages == []
+
+
+def test_folder_sizes_with_status_size(analyzer, seeded_imap_server):
+    folders = {folder["raw_name"]: folder for folder in analyzer.get_all_folders()}
+
+    if "STATUS=SIZE" in seeded_imap_server.capabilities:
+        assert folders["INBOX"]["size"] == seeded_imap_server.mailboxes["INBOX"].size
+    else:
+        assert folders["INBOX"]["size"] is None
+
+
+@pytest.mark.parametrize("headers_only", [True, False])
+def test_get_sender_statistics(analyzer, seeded_imap_server, headers_only):
+    df = analyzer.get_sender_statistics(headers_only=headers_only)
+
+    counts = dict(zip(df["Email"], df["Count"]))
+    assert counts == SEED_COUNTS
+    # pandas stores missing links as NaN
+    links = {email: link if isinstance(link, str) else None for email, link in zip(df["Email"], df["Unsubscribe Link"])}
+    assert links["newsletter@shop.example"] == "https://shop.example/unsubscribe"
+    # The HTML body is only scanned by a full analysis
+    expected_paper_link = None if headers_only else "https://paper.example/unsubscribe?id=7"
+    assert links["news@paper.example"] == expected_paper_link
+    assert links["friend@example.com"] is None
+
+    seen = [message for message in seeded_imap_server.mailboxes["INBOX"].messages if "\\Seen" in message.flags]
+    assert (len(seen) == 0) == headers_only
+
+
+def test_get_sender_statistics_max_batches(analyzer):
+    df = analyzer.get_sender_statistics(max_batches=0, headers_only=True)
+
+    assert df.empty
+
+
+def test_get_sender_statistics_uses_header_cache(seeded_imap_server, make_analyzer):
+    analyzer = make_analyzer(seeded_imap_server, header_cache=HeaderCache(":memory:"))
+    first = analyzer.get_sender_statistics(headers_only=True)
+    seeded_imap_server.reset_counters()
+
+    second = analyzer.get_sender_statistics(headers_only=True)
+
+    assert "UID FETCH" not in seeded_imap_server.commands
+    assert dict(zip(second["Email"], second["Count"])) == dict(zip(first["Email"], first["Count"]))
+
+
+@pytest.fixture
+def resync_server(make_imap_server):
+    server = make_imap_server(capabilities=MODERN_CAPABILITIES)
+    seed_mailbox(server)
+    return server
+
+
+@pytest.fixture
+def cached_analyzer(resync_server, make_analyzer, monkeypatch):
+    """An analyzer with a header cache that records its UID SEARCH criteria in analyzer.searches."""
+    analyzer = make_analyzer(resync_server, header_cache=HeaderCache(":memory:"))
+    analyzer.searches = []
+    uid_search = analyzer._uid_search
+
+    def recording_uid_search(mail, criteria):
+        analyzer.searches.append(str(criteria))
+        return uid_search(mail, criteria)
+
+    monkeypatch.setattr(analyzer, "_uid_search", recording_uid_search)
+    return analyzer
+
+
+def sender_counts(df) -> dict:
+    return dict(zip(df["Email"], df["Count"]))
+
+
+def test_resync_after_expunge_and_new_mail(resync_server, cached_analyzer, make_analyzer):
+    inbox = resync_server.mailboxes["INBOX"]
+    cached_analyzer.get_sender_statistics(headers_only=True)
+    expunged = [message.uid for message in inbox.messages[:3]]
+    inbox.expunge(expunged)
+    for _ in range(2):
+        resync_server.add_message("INBOX", build_message("new@example.com"))
+    cached_analyzer.searches.clear()
+    resync_server.reset_counters()
+
+    df = cached_analyzer.get_sender_statistics(headers_only=True)
+
+    # The SELECT reported the expunged UIDs, only UIDs above the cached ones were searched and fetched
+    assert "ENABLE" in resync_server.commands
+    assert cached_analyzer.searches == [f"UID {INBOX_COUNT + 1}:*"]
+    assert cached_analyzer.instrumentation.last_operation.counts["messages_analyzed"] == 2
+    expected = sender_counts(make_analyzer(resync_server).get_sender_statistics(headers_only=True))
+    assert sender_counts(df) == expected
+    assert expected["new@example.com"] == 2 and sum(expected.values()) == INBOX_COUNT - 1
+
+
+def test_resync_with_unchanged_modseq(resync_server, cached_analyzer):
+    first = cached_analyzer.get_sender_statistics(headers_only=True)
+    cached_analyzer.searches.clear()
+    resync_server.reset_counters()
+
+    second = cached_analyzer.get_sender_statistics(headers_only=True)
+
+    assert cached_analyzer.searches == []
+    assert "UID SEARCH" not in resync_server.commands and "UID FETCH" not in resync_server.commands
+    assert sender_counts(second) == sender_counts(first) == SEED_COUNTS
+
+
+def test_resync_with_changed_uidvalidity(resync_server, cached_analyzer):
+    cached_analyzer.get_sender_statistics(headers_only=True)
+    inbox = resync_server.mailboxes["INBOX"]
+    inbox.expunge([inbox.messages[0].uid])
+    resync_server.add_message("INBOX", build_message("new@example.com"))
+    inbox.reset_uidvalidity(inbox.uidvalidity + 1)
+    cached_analyzer.searches.clear()
+
+    df = cached_analyzer.get_sender_statistics(headers_only=True)
+
+    # The cached UIDs are of another UIDVALIDITY, the cache is rebuilt from a full search
+    assert cached_analyzer.searches == ["ALL"]
+    assert cached_analyzer.instrumentation.last_operation.counts["messages_analyzed"] == INBOX_COUNT
+    counts = sender_counts(df)
+    assert counts["new@example.com"] == 1 and sum(counts.values()) == INBOX_COUNT
+    assert set(df["UIDVALIDITY"]) == {inbox.uidvalidity}
+
+
+def test_truncated_analysis_does_not_advance_highestmodseq(resync_server, cached_analyzer):
+    def cached_highestmodseq():
+        return cached_analyzer.header_cache.folder(resync_server.host, resync_server.username, "INBOX").highestmodseq
+
+    cached_analyzer.get_sender_statistics(max_batches=0, headers_only=True)
+    assert cached_highestmodseq() is None
+
+    df = cached_analyzer.get_sender_statistics(headers_only=True)
+    assert sender_counts(df) == SEED_COUNTS
+    assert cached_highestmodseq() == resync_server.mailboxes["INBOX"].highestmodseq
+
+
+def test_fetch_message(analyzer):
+    df = analyzer.get_sender_statistics(headers_only=True)
+    row = df[df["Email"] == "news@paper.example"].iloc[0]
+
+    message = analyzer.fetch_message(int(row["UID"]), int(row["UIDVALIDITY"]))
+
+    assert message["From"] == "The Paper <news@paper.example>"
+    assert analyzer.fetch_message(int(row["UID"]), int(row["UIDVALIDITY"]) + 1) is None
+
+
+def test_delete_emails_from_sender(analyzer, seeded_imap_server):
+    assert analyzer.delete_emails_from_sender("Newsletter@Shop.example") == SEED_COUNTS["newsletter@shop.example"]
+
+    mailboxes = seeded_imap_server.mailboxes
+    assert len(mailboxes["INBOX"].messages) == INBOX_COUNT - SEED_COUNTS["newsletter@shop.example"]
+    assert len(mailboxes["Trash"].messages) == SEED_TRASH_COUNT + SEED_COUNTS["newsletter@shop.example"]
+    assert not any("\\Deleted" in message.flags for message in mailboxes["Trash"].messages)
+
+
+def test_delete_emails_from_sender_rejects_unsafe_address(analyzer):
+    with pytest.raises(EmailValidationError):
+        analyzer.delete_emails_from_sender('x@example.com" ALL "')
+
+
+def test_delete_emails_from_senders(analyzer, seeded_imap_server):
+    counts = analyzer.delete_emails_from_senders(["newsletter@shop.example", "news@paper.example", "nobody@example.com"])
+
+    assert counts == {
+        "newsletter@shop.example": SEED_COUNTS["newsletter@shop.example"],
+        "news@paper.example": SEED_COUNTS["news@paper.example"],
+        "nobody@example.com": 0,
+    }
+    remaining = {str(message.headers["From"]) for message in seeded_imap_server.mailboxes["INBOX"].messages}
+    assert remaining == {"A Friend <friend@example.com>", "Old News <old@archive.example>"}
+
+
+def test_delete_emails_from_senders_with_encoded_display_name(analyzer, seeded_imap_server):
+    # The server searches the decoded header, whose display name is "support@bank.example"
+    seeded_imap_server.add_message("INBOX", build_message("=?utf-8?q?support=40bank=2Eexample?= <x@phish.example>"))
+
+    counts = analyzer.delete_emails_from_senders(["friend@example.com", "support@bank.example"])
+
+    # Not credited to the first sender because its From address matches none of them
+    assert counts == {"friend@example.com": SEED_COUNTS["friend@example.com"], "support@bank.example": 1}
+    assert not any("phish" in str(message.headers["From"]) for message in seeded_imap_server.mailboxes["INBOX"].messages)
+
+
+def test_delete_emails_from_senders_failed_select(analyzer, seeded_imap_server):
+    analyzer.bin_folder
+    del seeded_imap_server.mailboxes["INBOX"]
+    seeded_imap_server.reset_counters()
+
+    with pytest.raises(Exception, match="Failed to select folder INBOX"):
+        analyzer.delete_emails_from_senders(["newsletter@shop.example"])
+    # No CLOSE in the authenticated state that would hide the failed SELECT
+    assert "CLOSE" not in seeded_imap_server.commands and "UNSELECT" not in seeded_imap_server.commands
+
+
+@pytest.mark.parametrize("action, destination", [("delete", "Trash"), ("archive", "Archive")])
+def test_prone_emails_older_than(analyzer, seeded_imap_server, action, destination):
+    before = len(seeded_imap_server.mailboxes[destination].messages)
+
+    assert analyzer.count_emails_older_than("INBOX", 365) == SEED_COUNTS["old@archive.example"]
+    assert analyzer.prone_emails_older_than("INBOX", 365, action=action) == SEED_COUNTS["old@archive.example"]
+
+    # Archiving copies the emails, deleting moves them
+    remaining = SEED_COUNTS["old@archive.example"] if action == "archive" else 0
+    assert analyzer.count_emails_older_than("INBOX", 365) == remaining
+    assert len(seeded_imap_server.mailboxes[destination].messages) == before + SEED_COUNTS["old@archive.example"]
+
+
+def test_empty_bin_folder(analyzer, seeded_imap_server):
+    progress = []
+
+    assert analyzer.empty_bin_folder(progress_callback=lambda current, total: progress.append((current, total))) == SEED_TRASH_COUNT
+
+    assert seeded_imap_server.mailboxes["Trash"].messages == []
+    assert progress[-1] == (SEED_TRASH_COUNT, SEED_TRASH_COUNT)
+
+
+def test_search_query_literals(analyzer):
+    # Non-ASCII text is sent as a literal, synchronising or LITERAL+
+    query = SearchQuery.subject("Café") | (SearchQuery.from_("friend@example.com") & SearchQuery.sent_since(date(2021, 1, 1)))
+
+    with analyzer.connection_pool.connection() as mail:
+        mail.select("INBOX", readonly=True)
+        uids = analyzer._uid_search(mail, query)
+
+    assert len(uids) == SEED_COUNTS["friend@example.com"]
@@ -0,0 +1,101 @@
+"""
+Tests of the Prometheus metrics, fed by the instrumentation of a MailAnalyzer.
+"""
+
+import imaplib
+import urllib.request
+
+import pytest
+
+from cleanmail import Instrumentation, MailAnalyzer, instrumentation
+from cleanmail.metrics import CONTENT_TYPE, CleanmailMetrics, Counter, Histogram, start_metrics_server
+from conftest import SEED_COUNTS
+
+
+def test_text_format():
+    counter = Counter("test_total", "A counter", ["name"])
+    counter.inc(name='a "quoted"\nname')
+    counter.inc(2, name="b")
+    histogram = Histogram("test_seconds", "A histogram", [0.1, 1], ["name"])
+    histogram.observe(0.05, name="a")
+    histogram.observe(0.5, name="a")
+    histogram.observe(5, name="a")
+
+    assert counter.render() == [
+        "# HELP test_total A counter",
+        "# TYPE test_total counter",
+        'test_total{name="a \\"quoted\\"\\nname"} 1',
+        'test_total{name="b"} 2',
+    ]
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{name="a",le="0.1"} 1',
+        'test_seconds_bucket{name="a",le="1"} 2',
+        'test_seconds_bucket{name="a",le="+Inf"} 3',
+        'test_seconds_sum{name="a"} 5.55',
+        'test_seconds_count{name="a"} 3',
+    ]
+
+
+def test_metrics_of_operations(seeded_imap_server, make_analyzer):
+    metrics = CleanmailMetrics()
+    instrumentation = Instrumentation(on_command=metrics.record_command, on_operation=metrics.record_operation)
+    analyzer = make_analyzer(seeded_imap_server, instrumentation=instrumentation)
+
+    analyzer.get_sender_statistics(headers_only=True)
+    deleted = analyzer.delete_emails_from_sender("newsletter@shop.example")
+
+    assert deleted == SEED_COUNTS["newsletter@shop.example"]
+    assert metrics.connections_opened.value() == 1
+    assert metrics.logins.value(result="OK") == 1
+    assert metrics.commands.value(command="UID SEARCH", result="OK") >= 2
+    assert metrics.operations.value(operation="delete_emails_from_sender", result="OK") == 1
+    assert metrics.messages["messages_analyzed"].value(operation="get_sender_statistics") == sum(SEED_COUNTS.values())
+    assert metrics.messages["messages_moved"].value(operation="delete_emails_from_sender") == deleted
+    assert metrics.messages["messages_expunged"].value(operation="delete_emails_from_sender") == deleted
+    assert sum(metrics.bytes_received._values.values()) == seeded_imap_server.bytes_sent
+
+    text = metrics.render()
+    assert 'cleanmail_operation_duration_seconds_count{operation="delete_emails_from_sender"} 1' in text
+    assert 'cleanmail_imap_connections{state="idle"}' in text
+
+
+def test_logins_outside_of_operations_are_counted(seeded_imap_server, make_analyzer, monkeypatch):
+    monkeypatch.setattr(instrumentation, "_global_command_hooks", [])
+    metrics = CleanmailMetrics()
+    instrumentation.add_global_hooks(on_command=metrics.record_command)
+    analyzer = make_analyzer(seeded_imap_server)
+    wrong = MailAnalyzer(
+        seeded_imap_server.username, "wrong", seeded_imap_server.host, mail_port=seeded_imap_server.port, use_ssl=False
+    )
+
+    # Like the Connect button, which only checks the credentials
+    with analyzer.connection_pool.connection() as mail:
+        mail.noop()
+    try:
+        with pytest.raises(imaplib.IMAP4.error):
+            with wrong.connection_pool.connection():
+                pass
+    finally:
+        wrong.connection_pool.close()
+
+    assert seeded_imap_server.connections == 2
+    assert metrics.connections_opened.value() == 2
+    assert metrics.logins.value(result="OK") == 1
+    assert metrics.logins.value(result="NO") == 1
+    # Other commands outside of an operation are not recorded
+    assert metrics.commands.value(command="NOOP", result="OK") == 0
+
+
+def test_metrics_endpoint():
+    metrics = CleanmailMetrics()
+    metrics.operations.inc(operation="connect", result="OK")
+    server = start_metrics_server(metrics, 0, "127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert response.headers["Content-Type"] == CONTENT_TYPE
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert 'cleanmail_operations_total{operation="connect",result="OK"} 1' in body
@@ -0,0 +1,103 @@
+"""
+Tests of pipelined IMAP commands (cleanmail.pipeline).
+"""
+
+import imaplib
+
+import pytest
+
+from benchmarks.network_proxy import NetworkShapingProxy
+from cleanmail import MailAnalyzer
+from cleanmail.pipeline import CommandPipeline
+from conftest import MINIMAL_CAPABILITIES, SEED_COUNTS, SEED_TRASH_COUNT, seed_mailbox
+from fake_imap_server import build_message
+
+
+@pytest.fixture
+def mail(seeded_imap_server):
+    mail = imaplib.IMAP4(seeded_imap_server.host, seeded_imap_server.port)
+    mail.login(seeded_imap_server.username, seeded_imap_server.password)
+    yield mail
+    mail.logout()
+
+
+def test_responses_are_attributed_in_order(mail):
+    with CommandPipeline(mail, window=2) as pipeline:
+        commands = [
+            pipeline.send("STATUS", name, "(MESSAGES)", untagged=["STATUS"])
+            for name in ("INBOX", "Missing", "Trash", "Projects")
+        ]
+        bad = pipeline.send("STATUS", "INBOX", "(NO-SUCH-ITEM)")
+        noop = pipeline.send("NOOP")
+
+    assert [command.result for command in commands] == ["OK", "NO", "OK", "OK"]
+    assert commands[0].untagged["STATUS"] == [f'"INBOX" (MESSAGES {sum(SEED_COUNTS.values())})'.encode()]
+    assert commands[1].untagged["STATUS"] == []
+    assert commands[2].untagged["STATUS"] == [f'"Trash" (MESSAGES {SEED_TRASH_COUNT})'.encode()]
+    assert commands[3].untagged["STATUS"] == [b'"Projects" (MESSAGES 1)']
+    # A BAD response does not break the pipeline
+    assert bad.result == "BAD" and noop.ok
+    assert mail.noop()[0] == "OK"
+
+
+def test_get_all_folders_pipelines_status(make_imap_server):
+    server = make_imap_server(capabilities=MINIMAL_CAPABILITIES)
+    seed_mailbox(server)
+    for number in range(30):
+        server.add_message(f"Folder {number}", build_message("a@example.com"))
+
+    with NetworkShapingProxy(server.host, server.port, rtt=0.05) as proxy:
+        analyzer = MailAnalyzer(server.username, server.password, proxy.host, mail_port=proxy.port, use_ssl=False)
+        try:
+            assert analyzer.bin_folder == "Trash"
+            folders = analyzer.get_all_folders()
+        finally:
+            analyzer.connection_pool.close()
+
+    assert len(folders) == 34
+    assert all(folder["message_count"] == 1 for folder in folders if folder["raw_name"].startswith("Folder "))
+    # 34 STATUS commands, one round trip instead of 34
+    summary = analyzer.instrumentation.last_operation
+    assert [record.verb for record in summary.commands] == ["STATUS"] * 34
+    assert summary.round_trips == 1
+    assert sum(record.pipelined for record in summary.commands) == 33
+
+
+def test_copy_progress_is_reported_per_batch(make_imap_server, make_analyzer):
+    # Without MOVE, messages are copied, flagged and expunged in pipelined steps
+    server = make_imap_server(capabilities=MINIMAL_CAPABILITIES)
+    for _ in range(120):
+        server.add_message("INBOX", build_message("bulk@example.com"))
+    server.add_mailbox("Trash")
+    analyzer = make_analyzer(server)
+    progress = []
+
+    with analyzer.connection_pool.connection() as mail:
+        mail.select("INBOX")
+        uids = analyzer._uid_search(mail, "ALL")
+        analyzer._move_message_uids(
+            mail, uids, "Trash", mark_as_deleted=True,
+            progress_callback=lambda current, total: progress.append((current, total, "STORE" in server.commands)),
+        )
+        mail.close()
+
+    # Reported as each COPY batch completes, before any message is flagged as deleted
+    assert progress == [(50, 120, False), (100, 120, False), (120, 120, False)]
+    assert len(server.mailboxes["INBOX"].messages) == 0
+    assert len(server.mailboxes["Trash"].messages) == 120
+
+
+def test_failed_copy_does_not_delete(make_imap_server, make_analyzer):
+    server = make_imap_server(capabilities=MINIMAL_CAPABILITIES)
+    seed_mailbox(server)
+    analyzer = make_analyzer(server)
+
+    with analyzer.connection_pool.connection() as mail:
+        mail.select("INBOX")
+        uids = analyzer._uid_search(mail, "ALL")
+        with pytest.raises(Exception, match="Failed to copy"):
+            analyzer._move_message_uids(mail, uids, "Missing", mark_as_deleted=True)
+        mail.close()
+
+    assert not any("\\Deleted" in message.flags for message in server.mailboxes["INBOX"].messages)
+    assert len(server.mailboxes["INBOX"].messages) == sum(SEED_COUNTS.values())
@@ -0,0 +1,98 @@
+"""
+Tests of the SEARCH criteria builder (cleanmail.search_query).
+"""
+
+from datetime import date
+
+import pytest
+
+from cleanmail import SearchQuery, UidSet
+
+
+def test_quoted_strings_are_escaped():
+    assert SearchQuery.from_('x@example.com" ALL "').compile() == [b'FROM "x@example.com\\" ALL \\""']
+    assert SearchQuery.subject("back\\slash").compile() == [b'SUBJECT "back\\\\slash"']
+    assert SearchQuery.subject('\\"').compile() == [b'SUBJECT "\\\\\\""']
+    assert SearchQuery.header("X-Mailer", "").compile() == [b'HEADER "X-Mailer" ""']
+
+
+def test_line_breaks_are_sent_as_literals():
+    # A quoted string cannot hold CR or LF, they would end the command line
+    assert SearchQuery.subject("a\r\nOK b").compile() == [b"SUBJECT {7}", b"a\r\nOK b"]
+    assert SearchQuery.subject("a\r\nOK b").compile(literal_plus=True) == [b"SUBJECT {7+}\r\na\r\nOK b"]
+
+
+def test_synchronising_literals_split_the_criteria():
+    query = SearchQuery.subject("Café") & SearchQuery.from_("friend@example.com") & SearchQuery.to("Zoë")
+
+    assert query.compile() == [
+        b"CHARSET UTF-8 SUBJECT {5}",
+        b'Caf\xc3\xa9 FROM "friend@example.com" TO {4}',
+        b"Zo\xc3\xab",
+    ]
+    assert query.compile(literal_plus=True) == [
+        b'CHARSET UTF-8 SUBJECT {5+}\r\nCaf\xc3\xa9 FROM "friend@example.com" TO {4+}\r\nZo\xc3\xab',
+    ]
+
+
+def test_charset_is_only_added_for_non_ascii_text():
+    assert SearchQuery.from_("friend@example.com").compile() == [b'FROM "friend@example.com"']
+    # CHARSET goes before the first key, also when the non-ASCII value comes later
+    query = SearchQuery.sent_before(date(2024, 1, 1)) | SearchQuery.subject("Ελλάδα")
+    assert query.compile(literal_plus=True)[0].startswith(b"CHARSET UTF-8 OR SENTBEFORE 1-Jan-2024 SUBJECT {12+}\r\n")
+
+
+def test_not_and_or_group_queries_with_several_keys():
+    one = SearchQuery.from_("a@example.com")
+    two = SearchQuery.from_("b@example.com") & SearchQuery.sent_since(date(2021, 3, 9))
+
+    assert str(~one) == 'NOT FROM "a@example.com"'
+    assert str(~two) == 'NOT (FROM "b@example.com" SENTSINCE 9-Mar-2021)'
+    assert str(one | two) == 'OR FROM "a@example.com" (FROM "b@example.com" SENTSINCE 9-Mar-2021)'
+    assert str(two | one) == 'OR (FROM "b@example.com" SENTSINCE 9-Mar-2021) FROM "a@example.com"'
+    # An OR is a single key, so it needs no parentheses
+    assert str((one | two) & SearchQuery.larger(100)) == (
+        'OR FROM "a@example.com" (FROM "b@example.com" SENTSINCE 9-Mar-2021) LARGER 100'
+    )
+    assert str(~(one | one)) == 'NOT OR FROM "a@example.com" FROM "a@example.com"'
+
+
+@pytest.mark.parametrize("count, expected", [
+    (1, 'FROM "s0"'),
+    (2, 'OR FROM "s0" FROM "s1"'),
+    (3, 'OR FROM "s0" OR FROM "s1" FROM "s2"'),
+    (4, 'OR OR FROM "s0" FROM "s1" OR FROM "s2" FROM "s3"'),
+    (5, 'OR OR FROM "s0" FROM "s1" OR FROM "s2" OR FROM "s3" FROM "s4"'),
+])
+def test_any_of_is_balanced(count, expected):
+    assert str(SearchQuery.any_of(SearchQuery.from_(f"s{number}") for number in range(count))) == expected
+
+
+def test_any_of_nesting_grows_logarithmically():
+    query = SearchQuery.any_of(SearchQuery.from_(f"s{number}") for number in range(64))
+    tokens = str(query).split()
+
+    # A balanced tree of 64 operands has 63 ORs and is 6 levels deep, so it starts with 6 ORs
+    assert tokens.count("OR") == 63
+    assert tokens[:7] == ["OR"] * 6 + ["FROM"]
+
+
+def test_all_of():
+    query = SearchQuery.all_of([SearchQuery.from_("a@example.com"), SearchQuery.uids(UidSet([1, 2, 3, 7]))])
+
+    assert str(query) == 'FROM "a@example.com" UID 1:3,7'
+    with pytest.raises(ValueError):
+        SearchQuery.all_of([])
+    with pytest.raises(ValueError):
+        SearchQuery.any_of([])
+
+
+def test_invalid_values_are_rejected():
+    with pytest.raises(ValueError):
+        SearchQuery.from_("a\x00b")
+    with pytest.raises(TypeError):
+        SearchQuery.from_(b"a@example.com")
+    with pytest.raises(ValueError):
+        SearchQuery.uids("1:* ALL")
+    with pytest.raises(ValueError):
+        SearchQuery.larger(-1)
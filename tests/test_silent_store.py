@@ -0,0 +1,65 @@
+"""
+Regression test: flag changes must use +FLAGS.SILENT, so the server does not echo
+an untagged FETCH response for every deleted message.
+
+Runs against the in-process fake IMAP server, no mail account needed.
+"""
+
+import pytest
+
+from fake_imap_server import build_message
+
+
+MESSAGE_COUNT = 500
+
+# A STORE answered with only its tagged OK is about 30 bytes,
+# echoing the flags costs about 40 bytes per message
+MAX_BYTES_PER_STORE = 100
+
+
+def make_message(sender: str, number: int) -> bytes:
+    return build_message(sender, subject=f"Message {number}", body=f"Body of message {number}")
+
+
+@pytest.fixture
+def server(make_imap_server):
+    # Without MOVE, deleting falls back to UID COPY + UID STORE + UID EXPUNGE
+    return make_imap_server(capabilities=["IMAP4rev1", "UIDPLUS", "UNSELECT"])
+
+
+@pytest.fixture
+def analyzer(server, make_analyzer):
+    return make_analyzer(server)
+
+
+def assert_silent_stores(server):
+    stores = [command for command in server.commands if command in ("STORE", "UID STORE")]
+    assert stores, "expected at least one STORE command"
+    store_bytes = sum(server.bytes_sent_by_command.get(command, 0) for command in set(stores))
+    assert store_bytes <= MAX_BYTES_PER_STORE * len(stores), (
+        f"{store_bytes} response bytes for {len(stores)} STORE commands, are the stores silent?"
+    )
+
+
+def test_delete_emails_from_sender_stores_silently(server, analyzer):
+    for number in range(MESSAGE_COUNT):
+        server.add_message("INBOX", make_message("news@example.com", number))
+    server.add_message("INBOX", make_message("friend@example.com", MESSAGE_COUNT))
+    server.reset_counters()
+
+    assert analyzer.delete_emails_from_sender("news@example.com") == MESSAGE_COUNT
+
+    assert_silent_stores(server)
+    assert len(server.mailboxes["INBOX"].messages) == 1
+    assert len(server.mailboxes["Trash"].messages) == MESSAGE_COUNT
+
+
+def test_empty_bin_folder_stores_silently(server, analyzer):
+    for number in range(MESSAGE_COUNT):
+        server.add_message("Trash", make_message("news@example.com", number))
+    server.reset_counters()
+
+    assert analyzer.empty_bin_folder() == MESSAGE_COUNT
+
+    assert_silent_stores(server)
+    assert server.mailboxes["Trash"].messages == []
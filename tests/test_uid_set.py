@@ -0,0 +1,117 @@
+"""
+Tests of the range encoded UID set (cleanmail.uid_set).
+"""
+
+import random
+
+import pytest
+
+from cleanmail import UidSet
+
+
+def test_parse_search_response():
+    uids = UidSet.parse(b"7 1 2 3 10 9")
+
+    assert list(uids.ranges()) == [(1, 3), (7, 7), (9, 10)]
+    assert uids.to_imap() == "1:3,7,9:10"
+    assert len(uids) == 6
+
+
+def test_parse_sequence_set():
+    uids = UidSet.parse("1:3,7,12:10,5:6")
+
+    assert list(uids.ranges()) == [(1, 3), (5, 7), (10, 12)]
+    assert len(uids) == 9
+    assert UidSet.parse(uids.to_imap()) == uids
+
+
+@pytest.mark.parametrize("data", [None, b"", "", b" "])
+def test_parse_empty(data):
+    uids = UidSet.parse(data)
+
+    assert not uids and len(uids) == 0
+    assert uids.to_imap() == "" and uids.first() is None and uids.last() is None
+
+
+def test_from_ranges_merges_overlapping_and_adjacent_ranges():
+    uids = UidSet.from_ranges([(20, 30), (1, 5), (6, 8), (3, 4), (25, 40), (50, 45)])
+
+    assert list(uids.ranges()) == [(1, 8), (20, 40), (45, 50)]
+    assert len(uids) == 8 + 21 + 6
+    assert uids.first() == 1 and uids.last() == 50
+
+
+def test_constructor_ignores_order_and_duplicates():
+    uids = UidSet([5, 3, 4, 4, 10, 1])
+
+    assert list(uids) == [1, 3, 4, 5, 10]
+    assert len(uids) == 5
+    assert 4 in uids and 2 not in uids and 11 not in uids and 0 not in uids
+
+
+def test_union_and_difference():
+    first = UidSet.parse("1:10,20:30")
+    second = UidSet.parse("5:25,40")
+
+    assert (first | second).to_imap() == "1:30,40"
+    assert (first - second).to_imap() == "1:4,26:30"
+    assert (second - first).to_imap() == "11:19,40"
+    assert first - UidSet() == first and UidSet() - first == UidSet()
+    assert (first - first) == UidSet()
+
+
+def test_union_and_difference_match_python_sets():
+    generator = random.Random(1)
+    for _ in range(200):
+        first = {generator.randint(1, 60) for _ in range(generator.randint(0, 40))}
+        second = {generator.randint(1, 60) for _ in range(generator.randint(0, 40))}
+
+        assert list(UidSet(first) | UidSet(second)) == sorted(first | second)
+        assert list(UidSet(first) - UidSet(second)) == sorted(first - second)
+        assert len(UidSet(first) - UidSet(second)) == len(first - second)
+
+
+def test_chunks_by_count():
+    uids = UidSet.parse("1:120,200,300:305")
+
+    chunks = list(uids.chunks(max_count=50))
+
+    assert [chunk.to_imap() for chunk in chunks] == ["1:50", "51:100", "101:120,200,300:305"]
+    assert [len(chunk) for chunk in chunks] == [50, 50, 27]
+    assert UidSet.from_ranges(r for chunk in chunks for r in chunk.ranges()) == uids
+
+
+def test_chunks_count_boundaries():
+    uids = UidSet.from_ranges([(1, 100)])
+
+    assert [chunk.to_imap() for chunk in uids.chunks(max_count=100)] == ["1:100"]
+    assert [chunk.to_imap() for chunk in uids.chunks(max_count=99)] == ["1:99", "100"]
+    assert [chunk.to_imap() for chunk in uids.chunks(max_count=1)][:3] == ["1", "2", "3"]
+    assert [chunk.to_imap() for chunk in uids.chunks()] == ["1:100"]
+    assert list(UidSet().chunks(max_count=10)) == []
+
+
+def test_chunks_by_length():
+    # Every other UID, so each UID is a range of its own: "1000,1002,1004,..."
+    uids = UidSet(range(1000, 3000, 2))
+
+    chunks = list(uids.chunks(max_length=30))
+
+    assert all(len(chunk.to_imap()) <= 30 for chunk in chunks)
+    # Six 4 digit UIDs and their separators are 29 characters, a seventh does not fit
+    assert [len(chunk) for chunk in chunks[:-1]] == [6] * (len(chunks) - 1)
+    assert sum(len(chunk) for chunk in chunks) == len(uids)
+    assert list(UidSet.from_ranges(r for chunk in chunks for r in chunk.ranges())) == list(uids)
+
+
+def test_chunks_by_count_and_length():
+    uids = UidSet(range(1, 400, 2))
+
+    # Whichever limit is reached first ends a batch
+    chunks = list(uids.chunks(max_count=10, max_length=20))
+    assert [chunk.to_imap() for chunk in chunks[:3]] == ["1,3,5,7,9,11,13,15", "17,19,21,23,25,27,29", "31,33,35,37,39,41,43"]
+    assert all(len(chunk) <= 10 and len(chunk.to_imap()) <= 20 for chunk in chunks)
+    assert sum(len(chunk) for chunk in chunks) == len(uids)
+
+    chunks = list(uids.chunks(max_count=5, max_length=20))
+    assert [chunk.to_imap() for chunk in chunks[:2]] == ["1,3,5,7,9", "11,13,15,17,19"]